@@ -1,24 +1,18 @@
 import pygame
 from pygame.locals import *
 
-from OpenGL.GL import *
-from OpenGL.GLU import *
-
 import time
 
+from features import FEATURE_COLORS, FEATURE_GROUPS, FEATURE_TYPES
+from memory_accounting import format_bytes
+import render_backend
+
 
-def drawUIText(x, y, font_size, textString):
-    font = pygame.font.Font("Fonts/FiraCode-VF.ttf", font_size)
-    render = font.render(
-        textString, True, (255, 255, 255, 255), (0, 0, 0, 0)).convert_alpha()
-    textData = pygame.image.tostring(render, "RGBA", True)
-    glWindowPos2d(x, y)
-    glDrawPixels(render.get_width(), render.get_height(),
-                 GL_RGBA, GL_UNSIGNED_BYTE, textData)
-    return render.get_width(), render.get_height()
+def drawUIText(x, y, font_size, textString, color=(255, 255, 255, 255)):
+    return render_backend.current().draw_text(x, y, font_size, textString, color)
 
 
-def drawUI(size, printer, sr, pt):
+def drawUI(size, printer, sr, pt, layer_stats=None):
     w, h = size
     t1w, t1h = drawUIText(
         10, h - (30), 16, "Layer " + printer.current_layer.__str__() + ".")
@@ -28,6 +22,66 @@ def drawUI(size, printer, sr, pt):
         10, h - (30 + t1h + t2h), 16, "Current Extrusion Speed: " + printer.get_extrusion_speed().__str__() + " mm/min.")
     t4w, t4h = drawUIText(
         10, h - (30 + t1h + t2h + t3h), 16, "Extruded Length: " + printer.get_total_extruded().__str__() + " mm^3.")
+    if layer_stats is not None and 0 <= printer.current_layer < len(layer_stats):
+        drawLayerStats(10, h - (30 + t1h + t2h + t3h + t4h), layer_stats[printer.current_layer])
+
+
+def drawLayerStats(x, y, stats):
+    lines = (
+        "Layer Time: " + format_print_time(stats["print_time"] + stats["travel_time"]) +
+        " (travel " + format_print_time(stats["travel_time"]) + ")",
+        "Layer Moves: %d extruding, %d travel (%.1f mm)" % (
+            stats["extrusion_moves"], stats["travel_moves"], stats["travel_distance"]),
+        "Layer Filament: %.2f mm" % stats["extruded"],
+        "Layer Feed Rate: %.0f-%.0f mm/min (mean %.0f)" % (
+            stats["feed_rate_min"], stats["feed_rate_max"], stats["feed_rate_mean"]),
+    )
+    for line in lines:
+        w, h = drawUIText(x, y, 16, line)
+        y -= h
+
+
+def drawPickedSegment(size, picked):
+    lines = ["Segment %d: layer %s, %.2f mm from the cursor" % (
+        picked["segment"], "?" if picked["layer"] is None else picked["layer"], picked["distance"])]
+    if picked.get("line") is not None:
+        lines.append("Line %d: %s (F%.0f)" % (picked["line"], picked["command"], picked["feed_rate"]))
+    y = 10
+    for line in reversed(lines):
+        w, h = drawUIText(10, y, 16, line)
+        y += h
+
+
+def drawFeatureLegend(size, print_object):
+    # the feature groups with their toggle keys, each type in the colour it is drawn with
+    w, h = size
+    x = w - 300
+    y = h - 30
+    for key, (group, features) in enumerate(FEATURE_GROUPS, 1):
+        is_hidden = set(features) <= print_object.hidden_features
+        tw, th = drawUIText(x, y, 16, "%d: %s%s" % (key, group, " (hidden)" if is_hidden else ""))
+        y -= th
+        for feature in features:
+            if is_hidden or feature in print_object.hidden_features:
+                continue
+            color = tuple(int(channel * 255) for channel in FEATURE_COLORS[feature]) + (255,)
+            tw, th = drawUIText(x + 20, y, 14, FEATURE_TYPES[feature], color)
+            y -= th
+
+
+def drawMemoryUsage(size, report):
+    # the last memory measurement, largest first, in the bottom right corner
+    w, h = size
+    y = 10
+    for name, usage in sorted(report.items(), key=lambda item: item[1]):
+        tw, th = drawUIText(w - 300, y, 14, "%s: %s" % (name.replace("_", " "), format_bytes(usage)))
+        y += th
+    drawUIText(w - 300, y, 16, "Memory (M to hide)")
+
+
+def drawLoadingProgress(size, file_name, progress):
+    w, h = size
+    drawUIText(w // 2 - 100, h // 2, 24, "Loading %s: %d%%" % (file_name, progress * 100))
 
 
 def format_print_time(print_time):
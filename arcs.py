@@ -0,0 +1,100 @@
+import math
+
+from lazy_import import lazy_module
+
+np = lazy_module("numpy")
+
+ARC_TOLERANCE = 0.05  # mm of chord error where no view decides it (headless, thumbnails)
+ARC_PIXEL_ERROR = 0.5  # chord error in pixels on screen, the viewer turns it into mm for the current zoom
+MIN_ARC_TOLERANCE = 0.001
+CLOCKWISE = 1  # G2
+COUNTERCLOCKWISE = -1  # G3
+FULL_CIRCLE = 2 * math.pi
+
+
+def is_arc_line(line):
+    # G2/G3 but not G28, G29, ...
+    return line[:2] in ("G2", "G3") and (len(line) == 2 or not line[2].isdigit())
+
+
+def arc_center(start, end, offset, radius, direction):
+    # the centre from I/J (offset from the start) or from R, where a negative R takes the longer way round
+    if offset is not None:
+        return start[0] + offset[0], start[1] + offset[1]
+    half_x = (end[0] - start[0]) / 2
+    half_y = (end[1] - start[1]) / 2
+    half_chord = math.hypot(half_x, half_y)
+    if half_chord == 0:
+        return None
+    height = math.sqrt(max(radius * radius - half_chord * half_chord, 0.0))
+    # the centre is left of the chord for a short counterclockwise arc
+    side = height / half_chord * (-1 if direction == CLOCKWISE else 1) * (1 if radius > 0 else -1)
+    return start[0] + half_x - half_y * side, start[1] + half_y + half_x * side
+
+
+def arc_geometry(start, end, center, direction):
+    # (start radius, end radius, start angle, signed sweep), start == end is a full circle
+    start_radius = math.hypot(start[0] - center[0], start[1] - center[1])
+    end_radius = math.hypot(end[0] - center[0], end[1] - center[1])
+    start_angle = math.atan2(start[1] - center[1], start[0] - center[0])
+    sweep = math.atan2(end[1] - center[1], end[0] - center[0]) - start_angle
+    if direction == CLOCKWISE:
+        if sweep >= -1e-9:
+            sweep -= FULL_CIRCLE
+    elif sweep <= 1e-9:
+        sweep += FULL_CIRCLE
+    return start_radius, end_radius, start_angle, sweep
+
+
+def arc_geometries(starts, ends, centers, directions):
+    # arc_geometry over N x 2 arrays of many arcs at once, each item of the tuple is an array
+    start_radii = np.hypot(starts[:, 0] - centers[:, 0], starts[:, 1] - centers[:, 1])
+    end_radii = np.hypot(ends[:, 0] - centers[:, 0], ends[:, 1] - centers[:, 1])
+    start_angles = np.arctan2(starts[:, 1] - centers[:, 1], starts[:, 0] - centers[:, 0])
+    sweeps = np.arctan2(ends[:, 1] - centers[:, 1], ends[:, 0] - centers[:, 0]) - start_angles
+    sweeps = np.where((directions == CLOCKWISE) & (sweeps >= -1e-9), sweeps - FULL_CIRCLE, sweeps)
+    sweeps = np.where((directions != CLOCKWISE) & (sweeps <= 1e-9), sweeps + FULL_CIRCLE, sweeps)
+    return start_radii, end_radii, start_angles, sweeps
+
+
+def arc_point(center, geometry, fraction):
+    start_radius, end_radius, start_angle, sweep = geometry
+    radius = start_radius + (end_radius - start_radius) * fraction
+    angle = start_angle + sweep * fraction
+    return center[0] + radius * math.cos(angle), center[1] + radius * math.sin(angle)
+
+
+def arc_length(geometry):
+    # also takes the arrays of arc_geometries
+    start_radius, end_radius, start_angle, sweep = geometry
+    return abs(sweep) * (start_radius + end_radius) / 2
+
+
+def chord_count(geometry, tolerance):
+    # chords needed so no point of the arc is further than tolerance from them
+    radius = max(geometry[0], geometry[1])
+    if radius <= tolerance:
+        return 1
+    step = 2 * math.acos(1 - tolerance / radius)
+    return max(math.ceil(abs(geometry[3]) / step), 1)
+
+
+def tessellate(start, end, center, direction, tolerance=ARC_TOLERANCE):
+    # the arc as a list of (x, y) points from start to end
+    geometry = arc_geometry(start, end, center, direction)
+    count = chord_count(geometry, tolerance)
+    return [arc_point(center, geometry, chord / count) for chord in range(count + 1)]
+
+
+def arc_distances(point, starts, ends, centers, directions):
+    # distance in the plane from point to each arc (N x 2 arrays, directions +1/-1), vectorised
+    radii, end_radii, start_angles, sweeps = arc_geometries(starts, ends, centers, directions)
+    offsets = np.asarray(point)[None, :2] - centers
+    angles = np.arctan2(offsets[:, 1], offsets[:, 0]) - start_angles
+    # how far along the sweep the point's angle is, 0..1 when it lies within the arc
+    turned = np.where(sweeps < 0, np.mod(-angles, FULL_CIRCLE), np.mod(angles, FULL_CIRCLE))
+    within = turned <= np.abs(sweeps)
+    to_circle = np.abs(np.hypot(offsets[:, 0], offsets[:, 1]) - radii)
+    to_ends = np.minimum(np.hypot(*(np.asarray(point)[None, :2] - starts).T),
+                         np.hypot(*(np.asarray(point)[None, :2] - ends).T))
+    return np.where(within, to_circle, to_ends)
@@ -1,29 +1,38 @@
+import logging
+import math
 import pygame
 from pygame.locals import *
-from OpenGL.GL import *
-from OpenGL.GLU import *
+
+import render_backend
+import sim_log
+
+log = sim_log.get_logger("camera")
 
 
 class Camera:
-    def __init__(self):
-        display = pygame.display.set_mode((0, 0), DOUBLEBUF | OPENGL)
+    def __init__(self, display_size=None):
+        # with a display_size the caller owns the GL context (offscreen export), otherwise the window is opened here
+        if display_size is None:
+            display = pygame.display.set_mode((0, 0), DOUBLEBUF | OPENGL)
+            display_size = display.get_size()
 
-        self.display_dimensions = display.get_size()
+        self.display_dimensions = display_size
+        self.backend = render_backend.current()
 
         self.init_fov_y = 45
         self.init_z_near = 0.1
         self.init_z_far = 3000
 
-        gluPerspective(self.init_fov_y,
-                       (self.display_dimensions[0]/self.display_dimensions[1]),
-                       self.init_z_near, self.init_z_far)
+        self.backend.perspective(self.init_fov_y,
+                                 (self.display_dimensions[0]/self.display_dimensions[1]),
+                                 self.init_z_near, self.init_z_far)
 
         self.init_x_translate = 0
         self.init_y_translate = 100
         self.init_z_translate = -1000
 
-        glTranslatef(self.init_x_translate,
-                     self.init_y_translate, self.init_z_translate)
+        self.backend.translate(self.init_x_translate,
+                               self.init_y_translate, self.init_z_translate)
 
         self.rotation_x = 0
         self.rotation_y = 0
@@ -45,13 +54,13 @@ class Camera:
     def __reset_camera_event(self, event):
         if event.type == pygame.KEYDOWN:
             if event.key == pygame.K_x:
-                glLoadIdentity()
-                gluPerspective(self.init_fov_y,
-                               (self.display_dimensions[0] /
-                                self.display_dimensions[1]),
-                               self.init_z_near, self.init_z_far)
-                glTranslatef(self.init_x_translate,
-                             self.init_y_translate, self.init_z_translate)
+                self.backend.load_identity()
+                self.backend.perspective(self.init_fov_y,
+                                         (self.display_dimensions[0] /
+                                          self.display_dimensions[1]),
+                                         self.init_z_near, self.init_z_far)
+                self.backend.translate(self.init_x_translate,
+                                       self.init_y_translate, self.init_z_translate)
                 self.rotation_x = 0
                 self.rotation_y = 0
                 self.rotation_z = 0
@@ -63,72 +72,94 @@ class Camera:
                 modded_x = abs_x_rot % 90
                 quadrant = self.zoom_rate if abs_x_rot <= 90 else -self.zoom_rate
                 if event.y == -1:
-                    glTranslatef(quadrant * (modded_x / 90), 0,
-                                 quadrant * (-(90 - modded_x) / 90))
+                    self.backend.translate(quadrant * (modded_x / 90), 0,
+                                           quadrant * (-(90 - modded_x) / 90))
                 if event.y == 1:
-                    glTranslatef(quadrant * (-modded_x / 90), 0,
-                                 quadrant * ((90 - modded_x) / 90))
+                    self.backend.translate(quadrant * (-modded_x / 90), 0,
+                                           quadrant * ((90 - modded_x) / 90))
             elif abs_x_rot == 90:
                 if event.y == -1:
-                    glTranslatef(self.zoom_rate, 0.0, 0.0)
+                    self.backend.translate(self.zoom_rate, 0.0, 0.0)
                 if event.y == 1:
-                    glTranslatef(-self.zoom_rate, 0.0, 0.0)
+                    self.backend.translate(-self.zoom_rate, 0.0, 0.0)
             elif 91 <= abs_x_rot <= 179 or 271 <= abs_x_rot <= 359:
                 modded_x = abs_x_rot % 90
                 quadrant = self.zoom_rate if abs_x_rot < 180 else -self.zoom_rate
                 if event.y == -1:
-                    glTranslatef(quadrant * ((90 - modded_x) / 90),
-                                 0, quadrant * (modded_x / 90))
+                    self.backend.translate(quadrant * ((90 - modded_x) / 90),
+                                           0, quadrant * (modded_x / 90))
                 if event.y == 1:
-                    glTranslatef(quadrant * (-(90 - modded_x) / 90),
-                                 0, quadrant * (-modded_x / 90))
+                    self.backend.translate(quadrant * (-(90 - modded_x) / 90),
+                                           0, quadrant * (-modded_x / 90))
             elif abs_x_rot == 180:
                 if event.y == -1:
-                    glTranslatef(0.0, 0.0, self.zoom_rate)
+                    self.backend.translate(0.0, 0.0, self.zoom_rate)
                 if event.y == 1:
-                    glTranslatef(0.0, 0.0, -self.zoom_rate)
+                    self.backend.translate(0.0, 0.0, -self.zoom_rate)
 
     def __x_rotation_pressed(self, pressed_key):
         if pressed_key[pygame.K_LEFT]:
-            glRotatef(-self.rotation_rate, 0, 1, 0)
+            self.backend.rotate(-self.rotation_rate, 0, 1, 0)
             self.rotation_x -= self.rotation_rate
             if self.rotation_x < 0:
                 self.rotation_x = 360
-            print("X: %d" % self.rotation_x)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("X: %d", self.rotation_x)
         elif pressed_key[pygame.K_RIGHT]:
-            glRotatef(self.rotation_rate, 0, 1, 0)
+            self.backend.rotate(self.rotation_rate, 0, 1, 0)
             self.rotation_x += self.rotation_rate
             if self.rotation_x >= 360:
                 self.rotation_x = 0
-            print("X: %d" % self.rotation_x)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("X: %d", self.rotation_x)
 
     def __y_rotation_pressed(self, pressed_key):
         if pressed_key[pygame.K_DOWN]:
-            glRotatef(self.rotation_rate, 1, 0, 0)
+            self.backend.rotate(self.rotation_rate, 1, 0, 0)
             self.rotation_y += self.rotation_rate
             if self.rotation_y >= 360:
                 self.rotation_y = 0
-            print("Y: %d" % self.rotation_y)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Y: %d", self.rotation_y)
         elif pressed_key[pygame.K_UP]:
-            glRotatef(-self.rotation_rate, 1, 0, 0)
+            self.backend.rotate(-self.rotation_rate, 1, 0, 0)
             self.rotation_y -= self.rotation_rate
             if self.rotation_y < 0:
                 self.rotation_y = 360
-            print("Y: %d" % self.rotation_y)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Y: %d", self.rotation_y)
 
     def __panning_pressed(self, pressed_key):
         if pressed_key[pygame.K_w]:
-            glTranslatef(0, -self.pan_rate, 0)
+            self.backend.translate(0, -self.pan_rate, 0)
         elif pressed_key[pygame.K_s]:
-            glTranslatef(0, self.pan_rate, 0)
+            self.backend.translate(0, self.pan_rate, 0)
         elif pressed_key[pygame.K_a]:
-            glTranslatef(-self.pan_rate, 0, 0)
+            self.backend.translate(-self.pan_rate, 0, 0)
         elif pressed_key[pygame.K_d]:
-            glTranslatef(self.pan_rate, 0, 0)
+            self.backend.translate(self.pan_rate, 0, 0)
         elif pressed_key[pygame.K_q]:
-            glTranslatef(0, 0, -self.pan_rate)
+            self.backend.translate(0, 0, -self.pan_rate)
         elif pressed_key[pygame.K_e]:
-            glTranslatef(0, 0, self.pan_rate)
+            self.backend.translate(0, 0, self.pan_rate)
+
+    def cast_ray(self, window_position):
+        # (origin, direction) in world space through a window pixel, from the near to the far plane
+        x = window_position[0]
+        y = self.backend.viewport_height() - window_position[1] - 1  # pygame counts rows from the top
+        near = self.backend.unproject(x, y, 0.0)
+        far = self.backend.unproject(x, y, 1.0)
+        return near, (far[0] - near[0], far[1] - near[1], far[2] - near[2])
+
+    def pixel_size(self, point):
+        # world units one pixel covers at the depth of point, near the middle of the view
+        center = (self.display_dimensions[0] // 2, self.display_dimensions[1] // 2)
+        origin, direction = self.cast_ray(center)
+        edge_origin, edge_direction = self.cast_ray((center[0] + 1, center[1]))
+        length = sum(component * component for component in direction)
+        t = sum((point[axis] - origin[axis]) * direction[axis] for axis in range(3)) / length
+        return math.dist([origin[axis] + direction[axis] * t for axis in range(3)],
+                         [edge_origin[axis] + edge_direction[axis] * t for axis in range(3)])
 
     def get_size(self):
         return (self.display_dimensions[0], self.display_dimensions[1])
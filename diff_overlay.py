@@ -0,0 +1,34 @@
+import numpy as np
+
+import render_backend
+import toolpath_diff
+from toolpath import PLANE_MOVE, load_toolpath
+
+
+# draws the segments of the loaded file that differ from another file on top of the printed object
+class DiffOverlay:
+    def __init__(self, printer, file_name, other_file_name, tolerance=toolpath_diff.GEOMETRY_TOLERANCE):
+        self.printer = printer
+        self.color = (1.0, 0.1, 0.1)
+        toolpath = load_toolpath(file_name)
+        differences = toolpath_diff.diff_toolpaths(toolpath, load_toolpath(other_file_name), tolerance)
+        changed_lines = np.concatenate([difference.changed_lines for difference in differences] +
+                                       [np.empty(0, dtype=np.int32)])
+        # the Z move of a changed line is not part of the compared extrusions, arcs are drawn as their chords
+        moves = toolpath.moves
+        is_changed = (moves["kind"] == PLANE_MOVE) & moves["extrude"] & np.isin(moves["line"], changed_lines)
+        self.starts, self.ends, rows = toolpath.plane_segments(is_changed)
+        self.layers = moves["layer"][rows]
+        self.differences = differences
+
+    def update_overlay_frame(self):
+        # only what has been printed so far is highlighted
+        visible = self.layers <= self.printer.current_layer
+        if not visible.any():
+            return
+        starts = self.printer.gcode_to_world(self.starts[visible])
+        ends = self.printer.gcode_to_world(self.ends[visible])
+        vertices = np.empty((len(starts) * 2, 3), dtype=np.float32)
+        vertices[0::2] = starts
+        vertices[1::2] = ends
+        render_backend.current().draw_lines(vertices, self.color, 5)
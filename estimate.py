@@ -0,0 +1,146 @@
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import sim_log
+from headless import HeadlessSimulation
+
+log = sim_log.get_logger("estimate")
+
+DEFAULT_PATTERNS = ("*.gcode", "*.txt", "*.bgcode", "*.gcode.gz", "*.gcode.zst")
+# raise with every change to the Printer motion math or the G-code it understands, cached results are dropped
+CACHE_VERSION = 5  # 2: G2/G3 arcs, 3: G90/G91, G92 and M82/M83, 4: move time from length and feed rate,
+# 5: keyed by the hash alone
+FIELDS = ("file", "sha256", "layers", "print_time", "filament", "commands")
+
+
+def hash_file(file_name):
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def find_files(targets, patterns=DEFAULT_PATTERNS):
+    files = []
+    for target in targets:
+        if os.path.isdir(target):
+            for pattern in patterns:
+                files.extend(glob.glob(os.path.join(target, pattern)))
+        else:
+            files.extend(glob.glob(target))
+    return sorted(set(files))
+
+
+def estimate_file(file_name):
+    result = HeadlessSimulation(file_name).run()
+    return {
+        "layers": result["layer"],
+        "print_time": result["elapsed_time"],
+        "filament": result["extruded"],
+        "commands": result["commands"],
+    }
+
+
+class EstimateCache:
+    # results keyed by content hash, moves take their length over their feed rate so no setting changes them
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.entries = {}
+        if file_name and os.path.exists(file_name):
+            try:
+                with open(file_name) as file:
+                    stored = json.load(file)
+                if stored.get("version") == CACHE_VERSION:
+                    self.entries = stored["entries"]
+            except (OSError, ValueError, KeyError):
+                log.warning("Ignoring unreadable estimate cache %s", file_name)
+
+    @staticmethod
+    def key(sha256):
+        return sha256
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, estimate):
+        self.entries[key] = estimate
+
+    def save(self):
+        if not self.file_name:
+            return
+        temporary_name = self.file_name + ".tmp"
+        with open(temporary_name, "w") as file:
+            json.dump({"version": CACHE_VERSION, "entries": self.entries}, file)
+        os.replace(temporary_name, self.file_name)
+
+
+def estimate_files(files, cache, workers=None):
+    hashes = {file_name: hash_file(file_name) for file_name in files}
+    estimates = {}
+    missing = []
+    for file_name in files:
+        cached = cache.get(EstimateCache.key(hashes[file_name]))
+        if cached is None:
+            missing.append(file_name)
+        else:
+            estimates[file_name] = cached
+    log.info("%d files, %d cached, %d to simulate", len(files), len(files) - len(missing), len(missing))
+
+    if missing:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            computed = executor.map(estimate_file, missing)
+            for file_name, estimate in zip(missing, computed):
+                estimates[file_name] = estimate
+                cache.put(EstimateCache.key(hashes[file_name]), estimate)
+        cache.save()
+
+    rows = []
+    for file_name in files:
+        row = {"file": file_name, "sha256": hashes[file_name]}
+        row.update(estimates[file_name])
+        rows.append(row)
+    return rows
+
+
+def write_rows(rows, output_format, stream):
+    if output_format == "json":
+        json.dump(rows, stream, indent=2)
+        stream.write("\n")
+    else:
+        writer = csv.DictWriter(stream, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate print time, filament and layers for sliced files")
+    parser.add_argument("targets", nargs="+", help="directories or glob patterns of G-code files")
+    parser.add_argument("--format", choices=("csv", "json"), default="csv")
+    parser.add_argument("-o", "--output", help="write to this file instead of stdout")
+    parser.add_argument("--cache", default=".estimate_cache.json",
+                        help="result cache keyed by file hash, empty string disables it")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (defaults to cpu count)")
+    parser.add_argument("--log-level", default="WARNING")
+    arguments = parser.parse_args()
+    sim_log.configure(arguments.log_level)
+
+    files = find_files(arguments.targets)
+    if not files:
+        parser.error("no G-code files found")
+    rows = estimate_files(files, EstimateCache(arguments.cache), arguments.workers)
+    if arguments.output:
+        with open(arguments.output, "w", newline="") as file:
+            write_rows(rows, arguments.format, file)
+    else:
+        write_rows(rows, arguments.format, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
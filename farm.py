@@ -0,0 +1,157 @@
+import argparse
+import heapq
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import preflight
+import sim_log
+from headless import HeadlessSimulation
+
+log = sim_log.get_logger("farm")
+
+
+def run_job(job_id, file_name, progress_queue, check_preflight=False):
+    if check_preflight:
+        report = preflight.validate_file(file_name)
+        if not report.is_ok():
+            progress_queue.put((job_id, None))
+            return job_id, {"file": file_name, "rejected": report.summary()}
+    simulation = HeadlessSimulation(file_name)
+
+    def report(progress):
+        progress_queue.put((job_id, progress))
+
+    result = simulation.run(report)
+    progress_queue.put((job_id, None))  # None marks the job as finished
+    return job_id, result
+
+
+class Farm:
+    def __init__(self, job_files, printer_count=None, workers=None, check_preflight=False):
+        self.job_files = list(job_files)
+        self.printer_count = printer_count or len(self.job_files)
+        self.workers = workers or os.cpu_count() or 1
+        self.check_preflight = check_preflight
+        self.progress = {}  # job id -> latest progress dict streamed back by its worker
+        self.results = {}
+        self.__progress_lock = threading.Lock()
+
+    def run(self, report_interval=1.0):
+        manager = multiprocessing.Manager()
+        progress_queue = manager.Queue()
+        coordinator = threading.Thread(target=self.__collect_progress,
+                                       args=(progress_queue, report_interval), daemon=True)
+        coordinator.start()
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                futures = [executor.submit(run_job, job_id, file_name, progress_queue, self.check_preflight)
+                           for job_id, file_name in enumerate(self.job_files)]
+                for future in as_completed(futures):
+                    job_id, result = future.result()
+                    self.results[job_id] = result
+        finally:
+            progress_queue.put(None)
+            coordinator.join()
+            manager.shutdown()
+        return self.build_schedule()
+
+    def __collect_progress(self, progress_queue, report_interval):
+        finished = 0
+        last_report = time.monotonic()
+        while True:
+            message = progress_queue.get()
+            if message is None:
+                return
+            job_id, progress = message
+            with self.__progress_lock:
+                if progress is None:
+                    finished += 1
+                else:
+                    self.progress[job_id] = progress
+            now = time.monotonic()
+            if now - last_report >= report_interval:
+                last_report = now
+                self.__report_progress(finished)
+
+    def __report_progress(self, finished):
+        with self.__progress_lock:
+            snapshot = dict(self.progress)
+        layers = sum(progress["layer"] for progress in snapshot.values())
+        simulated = sum(progress["elapsed_time"] for progress in snapshot.values())
+        log.info("%d/%d jobs finished, %d layers and %s of print time simulated",
+                 finished, len(self.job_files), layers, format_duration(simulated))
+
+    def build_schedule(self):
+        # jobs go, in order, to whichever printer frees up first
+        free_printers = [(0.0, printer_id) for printer_id in range(self.printer_count)]
+        heapq.heapify(free_printers)
+        busy_time = [0.0] * self.printer_count
+        jobs = []
+        rejected = []
+        for job_id, file_name in enumerate(self.job_files):
+            result = self.results[job_id]
+            if "rejected" in result:
+                rejected.append({"job": job_id, "file": file_name, "issues": result["rejected"]})
+                continue
+            start, printer_id = heapq.heappop(free_printers)
+            finish = start + result["elapsed_time"]
+            busy_time[printer_id] += result["elapsed_time"]
+            heapq.heappush(free_printers, (finish, printer_id))
+            jobs.append({
+                "job": job_id,
+                "file": file_name,
+                "printer": printer_id,
+                "start": start,
+                "finish": finish,
+                "layers": result["layer"],
+                "extruded": result["extruded"],
+            })
+        makespan = max((job["finish"] for job in jobs), default=0.0)
+        utilization = [(busy / makespan) if makespan > 0 else 0.0 for busy in busy_time]
+        return {"makespan": makespan, "utilization": utilization, "jobs": jobs, "rejected": rejected}
+
+
+def format_duration(seconds):
+    return "{:02}:{:02}:{:02}".format(int(seconds / 3600), int((seconds % 3600) / 60), int(seconds % 60))
+
+
+def print_schedule(schedule):
+    print("Makespan: %s" % format_duration(schedule["makespan"]))
+    for printer_id, utilization in enumerate(schedule["utilization"]):
+        print("Printer %3d: %5.1f%% utilized" % (printer_id, utilization * 100))
+    for job in schedule["jobs"]:
+        print("Job %3d on printer %3d: %s -> %s  %4d layers  %.1f mm  %s" % (
+            job["job"], job["printer"], format_duration(job["start"]), format_duration(job["finish"]),
+            job["layers"], job["extruded"], job["file"]))
+    for job in schedule["rejected"]:
+        print("Job %3d rejected by preflight: %s  %s" % (job["job"], job["issues"], job["file"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a print farm, one G-code job per printer")
+    parser.add_argument("jobs", nargs="+", help="G-code files, one job each")
+    parser.add_argument("--printers", type=int, default=None,
+                        help="number of printers (defaults to one per job)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (defaults to cpu count)")
+    parser.add_argument("--preflight", action="store_true", help="reject jobs that fail preflight.py checks")
+    parser.add_argument("--json", metavar="FILE", help="also write the schedule as JSON")
+    parser.add_argument("--log-level", default="INFO")
+    arguments = parser.parse_args()
+    sim_log.configure(arguments.log_level)
+
+    start = time.perf_counter()
+    farm = Farm(arguments.jobs, arguments.printers, arguments.workers, arguments.preflight)
+    schedule = farm.run()
+    log.info("Simulated %d jobs in %.2f s", len(arguments.jobs), time.perf_counter() - start)
+    print_schedule(schedule)
+    if arguments.json:
+        with open(arguments.json, "w") as file:
+            json.dump(schedule, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
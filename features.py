@@ -0,0 +1,59 @@
+# PrusaSlicer starts every section of a layer with ;TYPE:<name>, moves before the first marker are "Other"
+FEATURE_PREFIX = ";TYPE:"
+
+FEATURE_TYPES = (
+    "Other",
+    "Perimeter",
+    "External perimeter",
+    "Overhang perimeter",
+    "Internal infill",
+    "Solid infill",
+    "Top solid infill",
+    "Bridge infill",
+    "Gap fill",
+    "Ironing",
+    "Support material",
+    "Support material interface",
+    "Skirt/Brim",
+    "Wipe tower",
+    "Custom",
+)
+OTHER = 0
+
+# close to PrusaSlicer's preview colours
+FEATURE_COLORS = (
+    (0.5, 0.5, 0.5),
+    (1.0, 0.9, 0.3),
+    (1.0, 0.49, 0.22),
+    (0.0, 0.0, 1.0),
+    (0.69, 0.19, 0.16),
+    (0.59, 0.33, 0.8),
+    (0.94, 0.25, 0.25),
+    (0.3, 0.5, 0.73),
+    (1.0, 1.0, 1.0),
+    (1.0, 0.55, 0.41),
+    (0.0, 1.0, 0.0),
+    (0.12, 0.38, 0.13),
+    (0.0, 0.53, 0.43),
+    (0.7, 0.89, 0.67),
+    (0.37, 0.82, 0.58),
+)
+
+# the viewer toggles whole groups with the number keys 1-4
+FEATURE_GROUPS = (
+    ("Perimeters", (1, 2, 3)),
+    ("Infill", (4, 5, 6, 7, 8, 9)),
+    ("Support", (10, 11)),
+    ("Other", (0, 12, 13, 14)),
+)
+
+_codes = {name.lower(): code for code, name in enumerate(FEATURE_TYPES)}
+
+
+def is_feature_line(line):
+    return line[:6] == FEATURE_PREFIX
+
+
+def feature_code(line):
+    # code of a ;TYPE: line, unknown names (other slicers, newer PrusaSlicer types) count as Other
+    return _codes.get(line[6:].split(";")[0].strip().lower(), OTHER)
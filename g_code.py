@@ -1,58 +1,232 @@
+import logging
+import sys
+import threading
+from array import array
 from queue import Queue
 
+import sim_log
+from arcs import CLOCKWISE, COUNTERCLOCKWISE, is_arc_line
+from features import is_feature_line
+from gcode_input import read_line, read_line_blocks
+from gcode_program import (
+    ABSOLUTE_EXTRUSION, ABSOLUTE_POSITIONING, ARC_CLOCKWISE, ARC_COUNTERCLOCKWISE, F, I, J, LAYER_CHANGE,
+    MOVE, OPCODE_COUNT, R, RELATIVE_EXTRUSION, RELATIVE_POSITIONING, SET_FEATURE, SET_POSITION, X, Y, Z,
+    compile_line, disassemble, is_mode_line, operands)
+
+log = sim_log.get_logger("gcode")
+
+STDIN_FILE_NAME = "-"
+
 
 class GCode:
-    def __init__(self, printer, file_name):
+    def __init__(self, printer, file_name=None, buffer_size=0, load=True):
         self.printer = printer
         self.__file_name = file_name
-        self.__all_lines = self.__file_to_array()
-        self.command_queue = Queue(maxsize=0)
+        # without a file name, commands are streamed in through accept_line (see stream_server.py)
+        # "-" reads stdin incrementally once the print starts, so a slicer can be piped in
+        # with load=False the file is read later by load(), e.g. from a background thread
+        # only the compiled program is kept, the text is decoded again for the few lines that are shown
+        self.__instructions = None  # the accepted lines compiled by load(), see gcode_program.py
+        self.__line_numbers = None  # source line of each instruction
+        self.layer_listener = None  # called with the new layer number before a LAYER_CHANGE is processed
+        self.taken_listener = None  # called once commands were taken from command_queue, see stream_server.py
+        self.processed_commands = 0
+        self.load_progress = 0.0 if not self.is_streaming() else 1.0
+        if load and not self.is_streaming():
+            self.load()
+        self.command_queue = Queue(maxsize=buffer_size)
+        self.__g_90_count = 0
+        self.stream_finished = file_name != STDIN_FILE_NAME
+        # the interpreter's dispatch table, indexed by opcode (see gcode_program.py)
+        self.__handlers = [self.__skip] * OPCODE_COUNT
+        self.__handlers[MOVE] = self.__move
+        self.__handlers[ARC_CLOCKWISE] = self.__handlers[ARC_COUNTERCLOCKWISE] = self.__arc
+        self.__handlers[SET_POSITION] = self.__set_position
+        for opcode in (ABSOLUTE_POSITIONING, RELATIVE_POSITIONING, ABSOLUTE_EXTRUSION, RELATIVE_EXTRUSION):
+            self.__handlers[opcode] = self.__set_mode
+        self.__handlers[LAYER_CHANGE] = self.__change_layer
+        self.__handlers[SET_FEATURE] = self.__set_feature
+
+    def is_streaming(self):
+        return self.__file_name in (None, STDIN_FILE_NAME)
+
+    def load(self):
+        if not self.is_streaming():
+            self.__compile(self.__read_lines())
+        self.load_progress = 1.0
+
+    def is_loaded(self):
+        return self.load_progress >= 1.0
+
+    def __read_lines(self):
+        # read in blocks of lines so load_progress can be shown while large files are read,
+        # gzip, zstd and binary G-code are decoded on the way in
+        for block, progress in read_line_blocks(self.__file_name):
+            yield from block
+            self.load_progress = min(progress, 0.99)
 
-    def __file_to_array(self):
-        file = open(self.__file_name, "r")
-        lines = file.readlines()
-        file.close()
-        return lines
+    def __compile(self, lines):
+        self.__g_90_count = 0
+        line_numbers = array("i")
+        instructions = []
+        for line_number, line in enumerate(lines, 1):
+            if self.accept_line(line):
+                line_numbers.append(line_number)
+                instructions.append(compile_line(line))
+        self.__line_numbers = line_numbers
+        self.__instructions = instructions
 
     def populate_command_queue(self):
+        self.__g_90_count = 0
+        if self.__file_name == STDIN_FILE_NAME:
+            reader = threading.Thread(target=self.__read_stream, args=(sys.stdin,), name="gcode-stdin", daemon=True)
+            reader.start()
+            return
+        # the queue holds instructions rather than text, compiled while the file was loaded
+        instructions = [instruction for line_number, instruction in self.iterate_instructions()]
+        if self.command_queue.maxsize:
+            for instruction in instructions:
+                self.command_queue.put(instruction)
+            return
+        with self.command_queue.mutex:
+            self.command_queue.queue.extend(instructions)
+            self.command_queue.not_empty.notify_all()
+
+    def get_state(self):
+        # the commands still waiting in command_queue are saved separately (see snapshot.py)
+        return {"file_name": self.__file_name, "g_90_count": self.__g_90_count}
+
+    def set_state(self, state):
+        self.__g_90_count = state["g_90_count"]
+
+    def iterate_instructions(self):
+        # yields (1-based source line number, compiled instruction) of every line the print would process,
+        # see gcode_program.py. Nothing for streamed input
+        if self.__instructions is not None:
+            yield from zip(self.__line_numbers, self.__instructions)
+
+    def get_program(self):
+        return self.__line_numbers, self.__instructions
+
+    def set_program(self, program):
+        # the file was compiled again by another GCode (hot reload), commands already queued are not touched
+        self.__line_numbers, self.__instructions = program
+
+    def get_line(self, line_number):
+        # source text of a 1-based line, None for streamed input
+        if self.is_streaming() or line_number < 1:
+            return None
+        line = read_line(self.__file_name, line_number)
+        return None if line is None else line.rstrip()
+
+    def memory_usage(self):
+        # bytes per structure (see memory_accounting.py), the queue of a loaded file holds the same
+        # instructions as the compiled program, so only its slots are counted
+        from memory_accounting import container_size, queue_size
+        return {"gcode_program": container_size(self.__instructions or []),
+                "command_queue": queue_size(self.command_queue, shallow=self.__instructions is not None)}
+
+    def __read_stream(self, stream):
+        # iterating a pipe hands over lines as soon as they arrive instead of waiting for EOF
+        line_count = 0
+        for line in stream:
+            line_count += 1
+            if self.accept_line(line):
+                self.command_queue.put(compile_line(line))
+        self.stream_finished = True
+        log.info("Input stream ended after %d lines", line_count)
+
+    def accept_line(self, line):
         # G90 sets the mode to absolute-positioning, the 2nd G90 seems to start the actual print (maybe)
-        g_90_count = 0
-        for line in self.__all_lines:
-            if g_90_count != 2 and line[:3] == "G90":
-                g_90_count += 1
-            if g_90_count == 2 and line[:2] == "G1":
-                self.command_queue.put(line)
-            if "LAYER_CHANGE" in line and not "AFTER" in line and not "BEFORE" in line:
-                self.command_queue.put(line)
+        # state is kept between calls, so lines can be fed one at a time as they arrive.
+        # Mode and offset commands (M83 usually comes before the 2nd G90) are kept from the start
+        if self.__g_90_count != 2 and line[:3] == "G90":
+            self.__g_90_count += 1
+        if is_mode_line(line):
+            return True
+        if self.__g_90_count == 2 and (line[:2] in ("G0", "G1") or is_arc_line(line) or is_feature_line(line)):
+            return True
+        return "LAYER_CHANGE" in line and not "AFTER" in line and not "BEFORE" in line
 
     def process_g_code(self):
-        command = self.command_queue.get()
-        print("Processing: %s" % command)
-        code_x = 0
-        code_y = 0
-        code_z = 0
-        extrude = False
-        parameters = command[2:].split()
-        if command[:2] == "G1":
-            for param in parameters:
-                match param[:1]:
-                    case "F":
-                        self.printer.set_feed_rate(param[1:])
-                    case "X":
-                        code_x = param[1:]
-                    case "Y":
-                        code_y = param[1:]
-                    case "Z":
-                        code_z = param[1:]
-                    case "E":
-                        if not "-" in param[1:]:
-                            print(True)
-                            self.printer.set_extrusion_speed(param[1:])
-                            self.printer.add_to_extruded_total()
-                        extrude = True
-            if code_x != 0 or code_y != 0:
-                self.printer.g_code_plane_movement((code_x, code_y, extrude))
-            elif code_z != 0:
-                self.printer.g_code_layer_movement(code_z)
-        elif "LAYER_CHANGE" in command:
-            self.printer.current_layer += 1
+        instruction = self.command_queue.get()
+        if self.taken_listener is not None:
+            self.taken_listener()
+        self.processed_commands += 1
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Processing: %s", disassemble(instruction))
+        self.__handlers[instruction[0]](instruction)
+
+    def process_all(self, layer_callback=None):
+        # runs every queued instruction in one loop without locking the queue for each, for headless runs.
+        # Returns how many were run
+        with self.command_queue.mutex:
+            instructions = list(self.command_queue.queue)
+            self.command_queue.queue.clear()
+            self.command_queue.not_full.notify_all()
+        if self.taken_listener is not None:
+            self.taken_listener()
+        handlers = self.__handlers
+        for instruction in instructions:
+            handlers[instruction[0]](instruction)
+            if instruction[0] == LAYER_CHANGE and layer_callback is not None:
+                layer_callback()
+        self.processed_commands += len(instructions)
+        return len(instructions)
+
+    def __move(self, instruction):
+        words = operands(instruction)
+        extrude = self.__set_feed_and_extrusion(words)
+        x, y, z = self.printer.machine_state.position
+        # the printer moves Z and X/Y one after the other, a Z hop or layer change comes first
+        if words[Z] is not None:
+            self.printer.g_code_layer_movement(z)
+        if words[X] is not None or words[Y] is not None:
+            self.printer.g_code_plane_movement((x, y, extrude))
+
+    def __arc(self, instruction):
+        words = operands(instruction)
+        extrude = self.__set_feed_and_extrusion(words)
+        x, y, z = self.printer.machine_state.position
+        if words[Z] is not None:
+            self.printer.g_code_layer_movement(z)
+        offset = None if words[I] is None and words[J] is None else (words[I] or 0.0, words[J] or 0.0)
+        if offset is not None or words[R] is not None:
+            direction = CLOCKWISE if instruction[0] == ARC_CLOCKWISE else COUNTERCLOCKWISE
+            self.printer.g_code_arc_movement((x, y, extrude), offset, words[R], direction)
+        elif words[X] is not None or words[Y] is not None:
+            # without a centre or radius there is no arc, the head goes straight
+            self.printer.g_code_plane_movement((x, y, extrude))
+
+    def __set_feed_and_extrusion(self, words):
+        # moves the machine state to the command's target, returns whether the move extrudes
+        if words[F] is not None:
+            self.printer.set_feed_rate(words[F])
+        extruded = self.printer.machine_state.move(words)
+        if extruded is None:
+            return False
+        if extruded >= 0:
+            self.printer.set_extrusion_speed(extruded)
+            self.printer.add_to_extruded_total()
+        return True
+
+    def __set_position(self, instruction):
+        self.printer.machine_state.set_position(operands(instruction))
+
+    def __set_mode(self, instruction):
+        machine_state = self.printer.machine_state
+        if instruction[0] in (ABSOLUTE_POSITIONING, RELATIVE_POSITIONING):
+            machine_state.is_relative = instruction[0] == RELATIVE_POSITIONING
+        else:
+            machine_state.is_relative_extrusion = instruction[0] == RELATIVE_EXTRUSION
+
+    def __change_layer(self, instruction):
+        if self.layer_listener is not None:
+            self.layer_listener(self.printer.current_layer + 1)
+        self.printer.current_layer += 1
+
+    def __set_feature(self, instruction):
+        self.printer.current_feature = instruction[1]
+
+    def __skip(self, instruction):
+        pass
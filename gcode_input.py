@@ -0,0 +1,317 @@
+import io
+import os
+import re
+import struct
+import zlib
+
+import sim_log
+
+log = sim_log.get_logger("gcode")
+
+# inputs are recognised by their first bytes, not their extension
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+BGCODE_MAGIC = b"GCDE"
+
+BLOCK_SIZE = 1 << 20  # bytes of text handed over at a time
+
+# binary G-code (libbgcode): block types, compression and G-code encodings
+GCODE_BLOCK = 1
+THUMBNAIL_BLOCK = 5
+NO_COMPRESSION, DEFLATE, HEATSHRINK_11_4, HEATSHRINK_12_4 = 0, 1, 2, 3
+RAW_ENCODING, MEATPACK, MEATPACK_COMMENTS = 0, 1, 2
+CRC32_CHECKSUM = 1
+
+
+class GCodeFormatError(ValueError):
+    pass
+
+
+def input_format(file_name):
+    with open(file_name, "rb") as file:
+        head = file.read(4)
+    if head[:2] == GZIP_MAGIC:
+        return "gzip"
+    if head == ZSTD_MAGIC:
+        return "zstd"
+    if head == BGCODE_MAGIC:
+        return "bgcode"
+    return "text"
+
+
+def read_line_blocks(file_name, block_size=BLOCK_SIZE):
+    # yields (lines, fraction of the file read) while the file is decoded, compressed inputs are decompressed
+    # as they are read and never held in full as bytes or text
+    size = max(os.path.getsize(file_name), 1)
+    file_format = input_format(file_name)
+    with open(file_name, "rb") as raw:
+        if file_format == "bgcode":
+            for lines in _bgcode_line_blocks(raw, block_size):
+                yield lines, raw.tell() / size
+            return
+        if file_format == "gzip":
+            import gzip
+            stream = gzip.GzipFile(fileobj=raw, mode="rb")
+        elif file_format == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                raise GCodeFormatError("%s is zstd-compressed, install the zstandard package to read it" % file_name)
+            stream = zstandard.ZstdDecompressor().stream_reader(raw)
+        else:
+            stream = raw
+        text = io.TextIOWrapper(stream)
+        while True:
+            lines = text.readlines(block_size)
+            if not lines:
+                break
+            yield lines, raw.tell() / size
+
+
+def read_line(file_name, line_number):
+    # one 1-based line, decoded again from the start of the file. None past the end
+    for block, progress in read_line_blocks(file_name):
+        if line_number <= len(block):
+            return block[line_number - 1]
+        line_number -= len(block)
+    return None
+
+
+def _bgcode_line_blocks(file, block_size):
+    # only G-code blocks are decoded, metadata and thumbnails are skipped over but still checked
+    header = file.read(10)
+    if len(header) < 10 or header[:4] != BGCODE_MAGIC:
+        raise GCodeFormatError("Not a binary G-code file")
+    version, checksum_type = struct.unpack("<IH", header[4:])
+    checksum_size = 4 if checksum_type == CRC32_CHECKSUM else 0
+    pending = ""  # a line split between two blocks
+    lines = []
+    text_size = 0
+    while True:
+        block_header = file.read(8)
+        if not block_header:
+            break
+        if len(block_header) < 8:
+            raise GCodeFormatError("Binary G-code block header cut short")
+        block_type, compression, uncompressed_size = struct.unpack("<HHI", block_header)
+        compressed_size = uncompressed_size
+        if compression != NO_COMPRESSION:
+            size_bytes = file.read(4)
+            block_header += size_bytes
+            compressed_size = struct.unpack("<I", size_bytes)[0]
+        parameters_size = 6 if block_type == THUMBNAIL_BLOCK else 2
+        if block_type != GCODE_BLOCK and not checksum_size:
+            file.seek(parameters_size + compressed_size, os.SEEK_CUR)
+            continue
+        parameters = file.read(parameters_size)
+        payload = file.read(compressed_size)
+        if len(payload) < compressed_size:
+            raise GCodeFormatError("Binary G-code block cut short")
+        if checksum_size:
+            # the CRC32 covers the block header, its parameters and the data as stored
+            checksum = file.read(checksum_size)
+            expected = zlib.crc32(payload, zlib.crc32(parameters, zlib.crc32(block_header)))
+            if len(checksum) < checksum_size or struct.unpack("<I", checksum)[0] != expected:
+                raise GCodeFormatError("Binary G-code block at byte %d fails its checksum" % (
+                    file.tell() - len(block_header) - parameters_size - compressed_size - checksum_size))
+        if block_type != GCODE_BLOCK:
+            continue
+        encoding = struct.unpack("<H", parameters)[0]
+        data = _decompress(payload, compression, uncompressed_size)
+        if encoding == RAW_ENCODING:
+            text = data.decode("utf-8", "replace")
+        elif encoding in (MEATPACK, MEATPACK_COMMENTS):
+            text = unmeatpack(data)
+        else:
+            raise GCodeFormatError("Unknown binary G-code encoding %d" % encoding)
+        block_lines = (pending + text).splitlines(True)
+        pending = block_lines.pop() if block_lines and not block_lines[-1].endswith("\n") else ""
+        lines.extend(block_lines)
+        text_size += len(text)
+        if text_size >= block_size:
+            yield lines
+            lines = []
+            text_size = 0
+    if pending:
+        lines.append(pending)
+    if lines:
+        yield lines
+
+
+def _decompress(data, compression, uncompressed_size):
+    if compression == NO_COMPRESSION:
+        return data
+    if compression == DEFLATE:
+        return zlib.decompress(data)
+    if compression == HEATSHRINK_11_4:
+        return heatshrink_decompress(data, 11, 4, uncompressed_size)
+    if compression == HEATSHRINK_12_4:
+        return heatshrink_decompress(data, 12, 4, uncompressed_size)
+    raise GCodeFormatError("Unknown binary G-code compression %d" % compression)
+
+
+def heatshrink_decompress(data, window_bits, lookahead_bits, size_hint=0):
+    # LZSS as heatshrink writes it: a 1 bit is followed by an 8-bit literal, a 0 bit by a back-reference of
+    # window_bits (distance - 1) and lookahead_bits (length - 1), all most significant bit first. Each literal
+    # or back-reference is cut out of the 24 bits around the read position in one step
+    output = bytearray()
+    append = output.append
+    padded = bytes(data) + b"\0\0\0"
+    total_bits = len(data) * 8
+    reference_bits = 1 + window_bits + lookahead_bits
+    reference_shift = 24 - reference_bits
+    length_mask = (1 << lookahead_bits) - 1
+    size = 0
+    position = 0
+    while not size_hint or size < size_hint:
+        index = position >> 3
+        window = ((padded[index] << 16 | padded[index + 1] << 8 | padded[index + 2]) << (position & 7)) & 0xffffff
+        if window & 0x800000:
+            # the encoder pads the last byte with zeros, a tag without its literal is padding
+            position += 9
+            if position > total_bits:
+                break
+            append(window >> 15 & 0xff)
+            size += 1
+            continue
+        position += reference_bits
+        if position > total_bits:
+            break
+        fields = window >> reference_shift
+        distance = (fields >> lookahead_bits) + 1
+        length = (fields & length_mask) + 1
+        start = size - distance
+        if start < 0:
+            raise GCodeFormatError("Heatshrink back-reference before the start of the block")
+        if distance >= length:
+            output += output[start:start + length]
+        else:
+            # the reference overlaps the bytes it writes, its last distance bytes repeat
+            output += (output[start:] * (length // distance + 1))[:length]
+        size += length
+    return bytes(output)
+
+
+# MeatPack packs the most common G-code characters into 4 bits, 0b1111 marks a full byte that follows
+MEATPACK_CHARACTERS = b"0123456789. \nGX"
+MEATPACK_SIGNAL = 0xff
+MEATPACK_ENABLE_PACKING = 251
+MEATPACK_DISABLE_PACKING = 250
+MEATPACK_RESET = 249
+MEATPACK_ENABLE_NO_SPACES = 247
+MEATPACK_DISABLE_NO_SPACES = 246
+MEATPACK_FULL = 0xf
+NEWLINE = ord("\n")
+
+
+def _meatpack_table(is_no_spaces):
+    # the characters of every packed byte, None where one of its halves is a full byte marker
+    characters = bytearray(MEATPACK_CHARACTERS)
+    if is_no_spaces:
+        characters[11] = ord("E")
+    table = []
+    for byte in range(256):
+        first, second = byte & 0xf, byte >> 4
+        if first == MEATPACK_FULL or (second == MEATPACK_FULL and characters[first] != NEWLINE):
+            table.append(None)
+        elif characters[first] == NEWLINE:
+            table.append(b"\n")  # a newline ends the byte, its other half is unused
+        else:
+            table.append(bytes((characters[first], characters[second])))
+    return table, characters
+
+
+MEATPACK_TABLES = (_meatpack_table(False), _meatpack_table(True))
+
+
+def unmeatpack(data):
+    # two signal bytes and a command byte switch the modes, the data between them is copied or unpacked
+    output = bytearray()
+    is_packing = False
+    is_no_spaces = False
+    has_no_spaces = False
+    pieces = re.split(b"\xff\xff(.)", bytes(data), flags=re.DOTALL)
+    for index, piece in enumerate(pieces):
+        if index % 2:
+            command = piece[0]
+            if command == MEATPACK_ENABLE_PACKING:
+                is_packing = True
+            elif command == MEATPACK_DISABLE_PACKING:
+                is_packing = False
+            elif command == MEATPACK_ENABLE_NO_SPACES:
+                is_no_spaces = has_no_spaces = True
+            elif command == MEATPACK_DISABLE_NO_SPACES:
+                is_no_spaces = False
+            elif command == MEATPACK_RESET:
+                is_packing = False
+                is_no_spaces = False
+            continue
+        if is_packing:
+            _unpack(piece, output, *MEATPACK_TABLES[is_no_spaces])
+        else:
+            output += piece
+    text = output.decode("utf-8", "replace")
+    if not has_no_spaces:
+        return text
+    # without spaces "G1X10Y5E.2" would not split into words, spaces go back in front of every parameter
+    return "".join(_space_words(line) for line in text.splitlines(True))
+
+
+def _unpack(data, output, table, characters):
+    full_bytes = 0  # full characters still expected
+    held = None  # second packed character, written after the full character before it
+    for byte in data:
+        if full_bytes:
+            output.append(byte)
+            if held is not None:
+                output.append(held)
+                held = None
+            full_bytes -= 1
+            continue
+        packed = table[byte]
+        if packed is not None:
+            output += packed
+            continue
+        first = byte & 0xf
+        second = byte >> 4
+        if first == MEATPACK_FULL:
+            full_bytes = 2 if second == MEATPACK_FULL else 1
+            if second != MEATPACK_FULL:
+                held = characters[second]
+            continue
+        output.append(characters[first])
+        full_bytes = 1
+
+
+# commands whose argument is free text, keeping whatever spaces it still has
+TEXT_COMMANDS = ("M23", "M28", "M30", "M32", "M117", "M118", "M928")
+PARAMETER_LETTERS = "ABCDEFHIJKLPQRSTUVWXYZ"
+
+
+def _space_words(line):
+    # a space goes back after the command word and in front of each parameter letter that follows a value,
+    # letters after letters or inside quotes belong to a word and stay as they are
+    if not line or line[0] == ";":
+        return line
+    comment = line.find(";")
+    command, rest = (line, "") if comment == -1 else (line[:comment], line[comment:])
+    end = 1
+    while end < len(command) and (command[end].isdigit() or command[end] == "."):
+        end += 1
+    if end == 1 or not command[0].isalpha():
+        return line
+    words = [command[:end]]
+    if command[:end] in TEXT_COMMANDS:
+        if end < len(command) and not command[end].isspace():
+            words.append(" ")
+        return "".join(words) + command[end:] + rest
+    is_quoted = False
+    previous = command[end - 1]
+    for character in command[end:]:
+        if character == '"':
+            is_quoted = not is_quoted
+        elif not is_quoted and character in PARAMETER_LETTERS and not (previous.isspace() or previous.isalpha()):
+            words.append(" ")
+        words.append(character)
+        previous = character
+    return "".join(words) + rest
@@ -0,0 +1,165 @@
+import operator
+import struct
+
+from features import feature_code, is_feature_line
+
+# G-code is compiled once into instructions: an opcode byte, an argument byte and packed float64 operands.
+# For commands with parameters the argument is a mask of the words present (bit n is WORDS[n]) and only
+# those words follow, other opcodes carry their argument in that byte (the feature code of a ;TYPE: line)
+NOP = 0
+MOVE = 1  # G0, G1
+ARC_CLOCKWISE = 2  # G2
+ARC_COUNTERCLOCKWISE = 3  # G3
+SET_POSITION = 4  # G92
+ABSOLUTE_POSITIONING = 5  # G90
+RELATIVE_POSITIONING = 6  # G91
+ABSOLUTE_EXTRUSION = 7  # M82
+RELATIVE_EXTRUSION = 8  # M83
+LAYER_CHANGE = 9  # ;LAYER_CHANGE
+SET_FEATURE = 10  # ;TYPE:
+OPCODE_COUNT = 11
+OPCODE_NAMES = ("NOP", "MOVE", "ARC_CW", "ARC_CCW", "SET_POSITION", "G90", "G91", "M82", "M83", "LAYER_CHANGE",
+                "FEATURE")
+
+WORDS = "XYZEFIJR"
+X, Y, Z, E, F, I, J, R = range(len(WORDS))
+WORD_SLOTS = {word: slot for words in (WORDS, WORDS.lower()) for slot, word in enumerate(words)}
+
+COMMAND_OPCODES = {
+    "G0": MOVE, "G00": MOVE, "G1": MOVE, "G01": MOVE,
+    "G2": ARC_CLOCKWISE, "G02": ARC_CLOCKWISE, "G3": ARC_COUNTERCLOCKWISE, "G03": ARC_COUNTERCLOCKWISE,
+    "G92": SET_POSITION, "G90": ABSOLUTE_POSITIONING, "G91": RELATIVE_POSITIONING,
+    "M82": ABSOLUTE_EXTRUSION, "M83": RELATIVE_EXTRUSION,
+}
+# opcodes whose argument byte is a word mask followed by operands
+OPERAND_OPCODES = frozenset((MOVE, ARC_CLOCKWISE, ARC_COUNTERCLOCKWISE, SET_POSITION))
+# commands that only change modes or offsets, they are kept even before the print starts
+MODE_COMMANDS = frozenset(("G90", "G91", "G92", "M82", "M83"))
+# files without M82/M83 keep being read with relative extrusion, as this simulator always did
+DEFAULT_RELATIVE_EXTRUSION = True
+
+# mask -> (struct of an instruction with that mask, word slot of each operand)
+_LAYOUTS = [(struct.Struct("<BB%dd" % bin(mask).count("1")),
+             tuple(slot for slot in range(len(WORDS)) if mask >> slot & 1)) for mask in range(1 << len(WORDS))]
+# mask -> picks the words by slot out of the unpacked instruction with a None appended for missing words
+_GATHERS = [operator.itemgetter(*[2 + slots.index(slot) if slot in slots else 2 + len(slots)
+                                  for slot in range(len(WORDS))]) for layout, slots in _LAYOUTS]
+
+
+def is_mode_line(line):
+    # G90, G91, G92, M82 or M83 but not G920 and so on
+    return line[:3] in MODE_COMMANDS and not line[3:4].isdigit()
+
+
+def compile_line(line):
+    # the instruction of one accepted line (see GCode.accept_line), NOP for anything it does not simulate
+    if "LAYER_CHANGE" in line:
+        return bytes((LAYER_CHANGE, 0))
+    if is_feature_line(line):
+        return bytes((SET_FEATURE, feature_code(line)))
+    words = line.split(";", 1)[0].split(None, 1)
+    if not words:
+        return bytes((NOP, 0))
+    opcode = COMMAND_OPCODES.get(words[0]) or COMMAND_OPCODES.get(words[0].upper(), NOP)
+    if opcode not in OPERAND_OPCODES:
+        return bytes((opcode, 0))
+    values = {}  # slot -> value
+    mask = 0
+    if len(words) > 1:
+        for word in words[1].split():
+            slot = WORD_SLOTS.get(word[:1])
+            if slot is None:
+                continue
+            try:
+                values[slot] = float(word[1:])
+            except ValueError:
+                continue
+            mask |= 1 << slot
+    layout, slots = _LAYOUTS[mask]
+    return layout.pack(opcode, mask, *[values[slot] for slot in slots])
+
+
+def operands(instruction):
+    # the words of an instruction by slot (see WORDS), None for missing ones
+    return _GATHERS[instruction[1]](_LAYOUTS[instruction[1]][0].unpack(instruction) + (None,))
+
+
+def instruction_size(data, offset=0):
+    if data[offset] in OPERAND_OPCODES:
+        return _LAYOUTS[data[offset + 1]][0].size
+    return 2
+
+
+def join_instructions(instructions):
+    return b"".join(instructions)
+
+
+def split_instructions(data):
+    instructions = []
+    offset = 0
+    while offset < len(data):
+        size = instruction_size(data, offset)
+        instructions.append(bytes(data[offset:offset + size]))
+        offset += size
+    return instructions
+
+
+def disassemble(instruction):
+    # readable form for logs, e.g. "MOVE X10.0 Y5.0 E0.2"
+    name = OPCODE_NAMES[instruction[0]] if instruction[0] < OPCODE_COUNT else "?%d" % instruction[0]
+    if instruction[0] not in OPERAND_OPCODES:
+        return name if instruction[0] != SET_FEATURE else "%s %d" % (name, instruction[1])
+    return " ".join([name] + ["%s%r" % (WORDS[slot], value)
+                              for slot, value in enumerate(operands(instruction)) if value is not None])
+
+
+class MachineState:
+    # what firmware remembers between commands: where the head was sent in machine coordinates, the G92
+    # offsets and the positioning and extrusion modes. Printer keeps one so snapshots and hot reload
+    # checkpoints carry it, toolpath.compile_lines keeps its own
+    def __init__(self):
+        self.position = [0.0, 0.0, 0.0]
+        self.offset = [0.0, 0.0, 0.0]  # machine = G-code + offset, set by G92
+        self.extruder_position = 0.0  # E in G-code coordinates, only kept with absolute extrusion
+        self.is_relative = False
+        self.is_relative_extrusion = DEFAULT_RELATIVE_EXTRUSION
+
+    def get_state(self):
+        return {"position": list(self.position), "offset": list(self.offset),
+                "extruder_position": self.extruder_position, "is_relative": self.is_relative,
+                "is_relative_extrusion": self.is_relative_extrusion}
+
+    def set_state(self, state):
+        self.position = list(state["position"])
+        self.offset = list(state["offset"])
+        self.extruder_position = state["extruder_position"]
+        self.is_relative = state["is_relative"]
+        self.is_relative_extrusion = state["is_relative_extrusion"]
+
+    def move(self, words):
+        # makes the target of a move the position and returns the mm of filament it feeds (negative for
+        # retractions), None without an E word. A missing axis keeps its position
+        for axis in (X, Y, Z):
+            if words[axis] is not None:
+                if self.is_relative:
+                    self.position[axis] += words[axis]
+                else:
+                    self.position[axis] = words[axis] + self.offset[axis]
+        code_e = words[E]
+        if code_e is None:
+            return None
+        # G91 makes E relative as well, M83 only E (Marlin). Relative E is not added up, slicers reset it with
+        # G92 E0 before switching to absolute, and a sum would make every later layer differ on hot reload
+        if self.is_relative or self.is_relative_extrusion:
+            return code_e
+        extruded = code_e - self.extruder_position
+        self.extruder_position = code_e
+        return extruded
+
+    def set_position(self, words):
+        # G92: the head stays where it is and from now on is called the given coordinates
+        for axis in (X, Y, Z):
+            if words[axis] is not None:
+                self.offset[axis] = self.position[axis] - words[axis]
+        if words[E] is not None:
+            self.extruder_position = words[E]
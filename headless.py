@@ -0,0 +1,46 @@
+import time
+
+from printer import Printer
+from g_code import GCode
+
+
+# runs the same Printer + GCode pipeline as main.py without a window or per-tick movement queue
+class HeadlessSimulation:
+    def __init__(self, file_name, tick_rate=1, simulation_speed=1):
+        self.file_name = file_name
+        self.printer = Printer(tick_rate, headless=True)
+        for speed in range(1, simulation_speed):
+            self.printer.increase_simulation_speed()
+        self.g_code = GCode(self.printer, file_name)
+        self.commands_processed = 0
+        self.wall_time = 0.0
+
+    def run(self, progress_callback=None):
+        start = time.perf_counter()
+        self.printer.start_print(self.g_code)
+        layer_callback = None
+        if progress_callback is not None:
+            def layer_callback():
+                progress_callback(self.get_progress())
+        while not self.g_code.command_queue.empty():
+            self.commands_processed += self.g_code.process_all(layer_callback)
+        self.wall_time = time.perf_counter() - start
+        return self.get_result()
+
+    def get_progress(self):
+        return {
+            "layer": self.printer.current_layer,
+            "elapsed_time": self.printer.get_elapsed_time(),
+            "extruded": self.printer.get_total_extruded(),
+        }
+
+    def get_result(self):
+        result = self.get_progress()
+        result["file"] = self.file_name
+        result["commands"] = self.commands_processed
+        result["wall_time"] = self.wall_time
+        return result
+
+    def get_layer_stats(self):
+        import layer_stats
+        return layer_stats.load_layer_stats(self.file_name)
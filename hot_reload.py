@@ -0,0 +1,204 @@
+import hashlib
+import os
+import threading
+import time
+
+import sim_log
+from g_code import GCode
+from gcode_program import LAYER_CHANGE, join_instructions
+from printed_object import PrintedObject
+from printer import Printer
+from snapshot import queue_items, refill_queue
+
+log = sim_log.get_logger("reload")
+
+POLL_INTERVAL = 0.5  # seconds between checks of the file's size and modification time
+# the parts of a layer's end state the next layer's moves depend on
+MOTION_STATE = ("nozzle", "feed_rate", "current_feature", "machine_state")
+
+
+def split_layers(g_code):
+    # the compiled commands a print processes, grouped by layer, layer k starts with its own LAYER_CHANGE.
+    # Edits that compile to the same instructions (comments, number formatting) change no layer
+    layers = [[]]
+    for line_number, instruction in g_code.iterate_instructions():
+        if instruction[0] == LAYER_CHANGE:
+            layers.append([])
+        layers[-1].append(instruction)
+    return layers
+
+
+def layer_hashes(layers):
+    return [hashlib.blake2b(join_instructions(instructions), digest_size=16).digest() for instructions in layers]
+
+
+def simulate_layer(printer_state, commands):
+    # re-plans one layer from the printer state it started with, stepping it like the viewer's main loop.
+    # Returns the permanent points and feature codes it prints and the printer state after it
+    printer = Printer(printer_state["tick_rate"])
+    printer.set_state(printer_state)
+    print_object = PrintedObject(printer)
+    g_code = GCode(printer)
+    refill_queue(g_code.command_queue, commands)
+    while not printer.movement_queue.empty() or not g_code.command_queue.empty():
+        if not printer.movement_queue.empty():
+            insert_status = printer.move_printer()
+            printer.update_nozzle_position()
+            if insert_status[1]:
+                print_object.insert_temporary_point()
+            if insert_status[0]:
+                print_object.insert_permanent_point()
+                print_object.erase_temporary_points()
+        else:
+            g_code.process_g_code()
+    return print_object.permanent_line_points, print_object.permanent_features, printer.get_state()
+
+
+class HotReloader:
+    # watches the simulated file and, when the slicer rewrites it, re-plans only the layers whose commands
+    # changed. The printer state at the start of every layer is kept so a layer can be re-simulated alone
+    def __init__(self, file_name, printer, print_object, g_code, poll_interval=POLL_INTERVAL):
+        self.file_name = file_name
+        self.printer = printer
+        self.print_object = print_object
+        self.g_code = g_code
+        self.poll_interval = poll_interval
+        self.layers = None
+        self.hashes = None
+        self.checkpoints = {}  # layer -> (printer state before its LAYER_CHANGE, points printed before it)
+        self.__pending = None
+        self.__lock = threading.Lock()
+        g_code.layer_listener = self.__checkpoint
+        self.__thread = threading.Thread(target=self.__watch, name="gcode-watch", daemon=True)
+
+    def start(self):
+        self.__thread.start()
+
+    def __checkpoint(self, layer):
+        self.checkpoints[layer] = (self.printer.get_state(), self.print_object.point_count())
+
+    def __signature(self):
+        status = os.stat(self.file_name)
+        return status.st_size, status.st_mtime_ns
+
+    def __read(self):
+        reader = GCode(None, self.file_name)
+        layers = split_layers(reader)
+        return reader.get_program(), layers, layer_hashes(layers)
+
+    def __watch(self):
+        signature = self.__signature()
+        program, self.layers, self.hashes = self.__read()
+        log.info("Watching %s (%d layers)", self.file_name, len(self.layers) - 1)
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                changed = self.__signature()
+                if changed == signature:
+                    continue
+                # slicers write the file in pieces, wait until it stops changing
+                time.sleep(self.poll_interval)
+                if self.__signature() != changed:
+                    continue
+                signature = changed
+                pending = self.__read()
+            except OSError as error:
+                log.warning("Could not read %s: %s", self.file_name, error)
+                continue
+            with self.__lock:
+                self.__pending = pending
+
+    def apply(self, is_printing):
+        # called from the main loop, returns whether anything printed was changed
+        with self.__lock:
+            pending = self.__pending
+            self.__pending = None
+        if pending is None or self.hashes is None:
+            return False
+        program, layers, hashes = pending
+        start = time.perf_counter()
+        self.g_code.set_program(program)
+        changed = {layer for layer in range(max(len(hashes), len(self.hashes)))
+                   if layer >= len(hashes) or layer >= len(self.hashes) or hashes[layer] != self.hashes[layer]}
+        self.layers = layers
+        self.hashes = hashes
+        if not changed or not is_printing:
+            log.info("%s reloaded, %d layers changed", self.file_name, len(changed))
+            return False
+
+        current = self.printer.current_layer
+        resimulated = []
+        for layer in range(min(changed), current):
+            if layer not in changed:
+                continue
+            if layer not in self.checkpoints or layer + 1 not in self.checkpoints:
+                log.warning("Layer %d changed but was not simulated here, restart the print to see it", layer)
+                continue
+            old_end_state = self.__resimulate(layer, layers[layer])
+            if old_end_state is not None:
+                resimulated.append(layer)
+                if _motion(self.checkpoints[layer + 1][0]) != _motion(old_end_state):
+                    # the next layer starts from a different place, so it is re-planned as well
+                    changed.add(layer + 1)
+
+        if current in changed and current in self.checkpoints:
+            if self.__rewind(current, layers):
+                resimulated.append(current)
+        else:
+            if current in changed:
+                log.warning("Layer %d changed but was not simulated here, restart the print to see it", current)
+            # the rest of the current layer is unchanged, only what comes after it is replaced
+            remaining = queue_items(self.g_code.command_queue)
+            next_layer = next((index for index, command in enumerate(remaining) if command[0] == LAYER_CHANGE),
+                              len(remaining))
+            refill_queue(self.g_code.command_queue,
+                         remaining[:next_layer] + [line for layer in layers[current + 1:] for line in layer])
+        log.info("%s reloaded in %.1f ms: %d layers changed, re-planned %s", self.file_name,
+                 (time.perf_counter() - start) * 1000, len(changed), resimulated)
+        return True
+
+    def __resimulate(self, layer, commands):
+        # returns the layer's previous end state, None when it could not be replaced
+        state, begin = self.checkpoints[layer]
+        old_end_state, end = self.checkpoints[layer + 1]
+        points, features, end_state = simulate_layer(state, commands)
+        if not self.print_object.replace_points(begin, end, points, features, layer):
+            log.warning("Layer %d changed but was already spilled to disk, restart the print to see it", layer)
+            return None
+        point_change = len(points) - (end - begin)
+        extruded_change = end_state["total_extruded"] - old_end_state["total_extruded"]
+        time_change = end_state["elapsed_time"] - old_end_state["elapsed_time"]
+        for later, (later_state, count) in self.checkpoints.items():
+            if later > layer:
+                later_state["total_extruded"] += extruded_change
+                later_state["elapsed_time"] += time_change
+                self.checkpoints[later] = (later_state, count + point_change)
+        self.checkpoints[layer + 1] = (end_state, begin + len(points))
+        self.printer.total_extruded += extruded_change
+        self.printer.elapsed_time += time_change
+        return old_end_state
+
+    def __rewind(self, layer, layers):
+        # the layer being printed changed: drop what it printed so far and start it again from its checkpoint
+        state, begin = self.checkpoints[layer]
+        if not self.print_object.replace_points(begin, self.print_object.point_count(), [], [], None):
+            log.warning("Layer %d changed but was already spilled to disk, restart the print to see it", layer)
+            return False
+        self.print_object.erase_temporary_points()
+        self.printer.set_state(dict(state))
+        refill_queue(self.printer.movement_queue, [])
+        refill_queue(self.g_code.command_queue, [line for commands in layers[layer:] for line in commands])
+        return True
+
+
+def _motion(state):
+    # rounded, re-planning an unchanged layer may differ in the last bits of the accumulated steps
+    return tuple(_rounded(state[key]) for key in MOTION_STATE)
+
+
+def _rounded(value):
+    if isinstance(value, dict):
+        return tuple((key, _rounded(item)) for key, item in sorted(value.items()))
+    if isinstance(value, list):
+        return tuple(_rounded(item) for item in value)
+    return round(value, 6)
@@ -0,0 +1,121 @@
+import json
+import time
+
+import pygame
+
+import sim_log
+
+log = sim_log.get_logger("input")
+
+RECORDING_VERSION = 1
+
+
+def _serializable(value):
+    if isinstance(value, (bool, int, float, str)) or value is None:
+        return True
+    if isinstance(value, (tuple, list)):
+        return all(_serializable(item) for item in value)
+    return False
+
+
+def event_to_dict(event):
+    attributes = {name: value for name, value in event.dict.items() if _serializable(value)}
+    return {"type": event.type, "attributes": attributes}
+
+
+def dict_to_event(data):
+    attributes = {name: tuple(value) if isinstance(value, list) else value
+                  for name, value in data["attributes"].items()}
+    return pygame.event.Event(data["type"], attributes)
+
+
+class FrameTimes:
+    def __init__(self):
+        self.times = []
+        self.__last = None
+
+    def tick(self):
+        now = time.perf_counter()
+        if self.__last is not None:
+            self.times.append(now - self.__last)
+        self.__last = now
+
+    def summary(self):
+        if not self.times:
+            return {"frames": 0}
+        ordered = sorted(self.times)
+        return {
+            "frames": len(ordered) + 1,
+            "total": sum(ordered),
+            "mean_ms": sum(ordered) / len(ordered) * 1000,
+            "p50_ms": ordered[len(ordered) // 2] * 1000,
+            "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+            "max_ms": ordered[-1] * 1000,
+        }
+
+
+# the source of events and held keys for one frame of the main loop, optionally written to a recording
+class LiveInput:
+    def __init__(self, record_file_name=None, file_name=None):
+        self.__recording = None
+        self.frame = 0
+        if record_file_name is not None:
+            self.__recording = open(record_file_name, "w")
+            self.__recording.write(json.dumps({"version": RECORDING_VERSION, "file": file_name}) + "\n")
+            log.info("Recording input to %s", record_file_name)
+
+    def next_frame(self):
+        events = pygame.event.get()
+        pressed = pygame.key.get_pressed()
+        if self.__recording is not None:
+            # only the scancodes that are held are stored, most frames hold none
+            held = [scancode for scancode, is_held in enumerate(pressed) if is_held]
+            self.__recording.write(json.dumps({
+                "frame": self.frame,
+                "events": [event_to_dict(event) for event in events],
+                "held": held,
+            }, separators=(",", ":")) + "\n")
+        self.frame += 1
+        return events, pressed
+
+    def close(self):
+        if self.__recording is not None:
+            self.__recording.close()
+            self.__recording = None
+
+
+# plays a recording back frame by frame, then asks the viewer to quit
+class ReplayInput:
+    def __init__(self, file_name):
+        with open(file_name) as file:
+            header = json.loads(file.readline())
+            if header.get("version") != RECORDING_VERSION:
+                raise ValueError("%s is not a version %d input recording" % (file_name, RECORDING_VERSION))
+            self.frames = [json.loads(line) for line in file if line.strip()]
+        self.recorded_file = header.get("file")
+        self.frame = 0
+        self.frame_times = FrameTimes()
+        self.__key_count = len(pygame.key.get_pressed())
+        log.info("Replaying %d frames from %s", len(self.frames), file_name)
+
+    def is_finished(self):
+        return self.frame >= len(self.frames)
+
+    def next_frame(self):
+        self.frame_times.tick()
+        pygame.event.pump()  # keeps the window responsive, real input is ignored during a replay
+        pygame.event.clear()
+        if self.is_finished():
+            return [pygame.event.Event(pygame.QUIT)], pygame.key.ScancodeWrapper((False,) * self.__key_count)
+        recorded = self.frames[self.frame]
+        self.frame += 1
+        held = set(recorded["held"])
+        pressed = pygame.key.ScancodeWrapper(tuple(scancode in held for scancode in range(self.__key_count)))
+        return [dict_to_event(event) for event in recorded["events"]], pressed
+
+    def close(self):
+        summary = self.frame_times.summary()
+        if summary["frames"] > 1:
+            log.info("Replayed %d frames in %.2f s: mean %.2f ms, p50 %.2f ms, p95 %.2f ms, max %.2f ms per frame",
+                     summary["frames"], summary["total"], summary["mean_ms"], summary["p50_ms"],
+                     summary["p95_ms"], summary["max_ms"])
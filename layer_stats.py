@@ -0,0 +1,127 @@
+import argparse
+import csv
+import json
+import sys
+
+import numpy as np
+
+import sim_log
+import toolpath as toolpath_module
+from toolpath import LAYER_MOVE, PLANE_MOVE
+
+log = sim_log.get_logger("layer_stats")
+
+LAYER_STATS_DTYPE = np.dtype([
+    ("layer", np.int32),
+    ("print_time", np.float64),  # seconds spent on extruding moves
+    ("travel_time", np.float64),  # seconds spent on non-extruding and Z moves
+    ("extrusion_moves", np.int32),
+    ("travel_moves", np.int32),
+    ("extruded", np.float64),  # filament, positive E only like Printer.add_to_extruded_total
+    ("travel_distance", np.float64),
+    ("feed_rate_min", np.float32),
+    ("feed_rate_max", np.float32),
+    ("feed_rate_mean", np.float32),
+    ("x_min", np.float32),  # bounding box of the extruded segments, NaN for layers without extrusion
+    ("x_max", np.float32),
+    ("y_min", np.float32),
+    ("y_max", np.float32),
+    ("z_min", np.float32),
+    ("z_max", np.float32),
+])
+
+
+def _reduce_by_layer(ufunc, layers, values, layer_count, fill):
+    # layers is sorted, so every layer is a contiguous run that reduceat can collapse in one call
+    result = np.full(layer_count, fill, dtype=np.float64)
+    if len(layers) == 0:
+        return result
+    starts = np.flatnonzero(np.diff(layers, prepend=layers[0] - 1))
+    result[layers[starts]] = ufunc.reduceat(values, starts)
+    return result
+
+
+def compute_layer_stats(toolpath):
+    moves = toolpath.moves
+    layer_count = toolpath.layer_count
+    layers = moves["layer"]
+    is_move = moves["kind"] != toolpath_module.FEED_ONLY
+    is_extrusion = is_move & (moves["kind"] == PLANE_MOVE) & moves["extrude"]
+    is_travel = is_move & ~is_extrusion
+    durations = toolpath.durations()
+    lengths = toolpath.lengths()
+    feed_rates = moves["feed_rate"].astype(np.float64)
+
+    stats = np.zeros(layer_count, dtype=LAYER_STATS_DTYPE)
+    stats["layer"] = np.arange(layer_count)
+    stats["print_time"] = np.bincount(layers, weights=durations * is_extrusion, minlength=layer_count)
+    stats["travel_time"] = np.bincount(layers, weights=durations * is_travel, minlength=layer_count)
+    stats["extrusion_moves"] = np.bincount(layers, weights=is_extrusion, minlength=layer_count)
+    stats["travel_moves"] = np.bincount(layers, weights=is_travel, minlength=layer_count)
+    stats["extruded"] = np.bincount(layers, weights=np.maximum(moves["e"], 0.0), minlength=layer_count)
+    stats["travel_distance"] = np.bincount(layers, weights=lengths * is_travel, minlength=layer_count)
+
+    move_layers = layers[is_move]
+    move_feed_rates = feed_rates[is_move]
+    move_counts = np.bincount(move_layers, minlength=layer_count)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        stats["feed_rate_mean"] = np.bincount(move_layers, weights=move_feed_rates, minlength=layer_count) / move_counts
+    stats["feed_rate_min"] = _reduce_by_layer(np.minimum, move_layers, move_feed_rates, layer_count, np.nan)
+    stats["feed_rate_max"] = _reduce_by_layer(np.maximum, move_layers, move_feed_rates, layer_count, np.nan)
+
+    starts = toolpath.start_points()[is_extrusion]
+    ends = toolpath.end_points()[is_extrusion]
+    extrusion_layers = layers[is_extrusion]
+    for axis, name in enumerate(("x", "y", "z")):
+        stats[name + "_min"] = _reduce_by_layer(np.minimum, extrusion_layers,
+                                                 np.minimum(starts[:, axis], ends[:, axis]), layer_count, np.nan)
+        stats[name + "_max"] = _reduce_by_layer(np.maximum, extrusion_layers,
+                                                 np.maximum(starts[:, axis], ends[:, axis]), layer_count, np.nan)
+    return stats
+
+
+def load_layer_stats(file_name, use_cache=True):
+    if use_cache:
+        stats = toolpath_module.load_cached(file_name, "layer_stats")
+        if stats is not None and stats.dtype == LAYER_STATS_DTYPE:
+            return stats
+    stats = compute_layer_stats(toolpath_module.load_toolpath(file_name, use_cache))
+    if use_cache:
+        toolpath_module.save_cached(file_name, layer_stats=stats)
+    return stats
+
+
+def stats_to_rows(stats):
+    return [{name: row[name].item() for name in LAYER_STATS_DTYPE.names} for row in stats]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-layer statistics of a G-code file")
+    parser.add_argument("file")
+    parser.add_argument("--format", choices=("table", "csv", "json"), default="table")
+    parser.add_argument("--no-cache", action="store_true", help="recompile instead of using <file>.toolpath.npz")
+    parser.add_argument("--log-level", default="WARNING")
+    arguments = parser.parse_args()
+    sim_log.configure(arguments.log_level)
+
+    stats = load_layer_stats(arguments.file, not arguments.no_cache)
+    if arguments.format == "json":
+        json.dump(stats_to_rows(stats), sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    elif arguments.format == "csv":
+        writer = csv.DictWriter(sys.stdout, fieldnames=LAYER_STATS_DTYPE.names)
+        writer.writeheader()
+        writer.writerows(stats_to_rows(stats))
+    else:
+        print("layer  print s  travel s  moves  travels  extruded mm  feed min/max/mean      z")
+        for row in stats:
+            print("%5d %8.1f %9.1f %6d %8d %12.2f  %5.0f/%5.0f/%7.1f %6.2f" % (
+                row["layer"], row["print_time"], row["travel_time"], row["extrusion_moves"], row["travel_moves"],
+                row["extruded"], row["feed_rate_min"], row["feed_rate_max"], row["feed_rate_mean"], row["z_max"]))
+        print("total %8.1f %9.1f %6d %8d %12.2f" % (
+            stats["print_time"].sum(), stats["travel_time"].sum(), stats["extrusion_moves"].sum(),
+            stats["travel_moves"].sum(), stats["extruded"].sum()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import weakref
+
+import numpy as np
+
+import sim_log
+from features import FEATURE_COLORS
+from vertex_layout import FEATURE_COLOR_OFFSET, FEATURE_COLUMN, LAYER_COLOR_OFFSET, VERTEX_FLOATS, VERTEX_STRIDE
+
+log = sim_log.get_logger("spill")
+
+# heap cost of one permanent point, measured with tracemalloc over layers 2-300 of astro.txt (478-495 bytes):
+# its position tuple from Printer (136), colour tuple and list slots in PrintedObject (255) and half a
+# segment of the picking index with its grid cells (100)
+POINT_BYTES = 490
+
+
+class SpilledBatch:
+    def __init__(self, vertices, runs):
+        self.vertices = vertices  # read-only memmap, VERTEX_FLOATS per vertex
+        self.runs = runs  # (feature, first vertex, vertex count)
+        self.files = [vertices.filename]  # the vertices and every array added with SpillStore.map_array
+
+
+class SpillStore:
+    # completed layers of a PrintedObject moved out of the Python heap into memory-mapped files,
+    # the OS pages them in while they are drawn and can drop them again at any time
+    def __init__(self, directory=None):
+        self.directory = tempfile.mkdtemp(prefix="simulator-spill-", dir=directory)
+        self.batches = []
+        self.vertex_count = 0
+        self.__finalizer = weakref.finalize(self, shutil.rmtree, self.directory, True)
+
+    def __len__(self):
+        return self.vertex_count
+
+    def spill(self, points, features):
+        vertices = np.empty((len(points), VERTEX_FLOATS), dtype=np.float32)
+        vertices[:, 0:6] = np.array([position + color for position, color in points], dtype=np.float32)
+        codes = np.array(features, dtype=np.int64)
+        vertices[:, 6:9] = np.array(FEATURE_COLORS, dtype=np.float32)[codes]
+        vertices[:, FEATURE_COLUMN] = codes
+        file_name = os.path.join(self.directory, "batch_%04d.bin" % len(self.batches))
+        vertices.tofile(file_name)
+        changes = np.flatnonzero(np.diff(codes)) + 1
+        starts = np.concatenate(([0], changes))
+        ends = np.concatenate((changes, [len(codes)]))
+        runs = [(int(codes[start]), int(start), int(end - start)) for start, end in zip(starts, ends)]
+        mapped = np.memmap(file_name, dtype=np.float32, mode="r", shape=vertices.shape)
+        self.batches.append(SpilledBatch(mapped, runs))
+        self.vertex_count += len(points)
+        log.info("Spilled %d points to %s (%d spilled in total)", len(points), file_name, self.vertex_count)
+
+    def map_array(self, name, array):
+        # stores another array of the latest batch (the segment index of its layers), returns it memory-mapped
+        batch = self.batches[-1]
+        file_name = os.path.join(self.directory, "batch_%04d_%s.bin" % (len(self.batches) - 1, name))
+        array.tofile(file_name)
+        batch.files.append(file_name)
+        if not array.size:
+            return array
+        return np.memmap(file_name, dtype=array.dtype, mode="r", shape=array.shape)
+
+    def draw(self, backend, is_colored_by_feature, hidden_features):
+        # arrays straight from the mapped files, under the same transform as PrintedObject's own points
+        color_offset = FEATURE_COLOR_OFFSET if is_colored_by_feature else LAYER_COLOR_OFFSET
+        for batch in self.batches:
+            ranges = [(first, count) for feature, first, count in batch.runs if feature not in hidden_features]
+            backend.draw_vertex_array(batch.vertices, VERTEX_STRIDE, color_offset, ranges)
+
+    def to_points(self):
+        # (points, features) in PrintedObject's form, pages every batch back in (snapshots)
+        points = []
+        features = []
+        for batch in self.batches:
+            rows = batch.vertices[:, :6].tolist()
+            points.extend((tuple(row[:3]), tuple(row[3:])) for row in rows)
+            features.extend(batch.vertices[:, FEATURE_COLUMN].astype(np.int64).tolist())
+        return points, features
+
+    def feature_runs(self):
+        # (feature, point count) of every run in the batches, in print order
+        return [(feature, count) for batch in self.batches for feature, first, count in batch.runs]
+
+    def clear(self):
+        for batch in self.batches:
+            for file_name in batch.files:
+                os.remove(file_name)
+        self.batches = []
+        self.vertex_count = 0
@@ -0,0 +1,18 @@
+import importlib.util
+import sys
+
+
+def lazy_module(name):
+    # returns the module right away but only executes it on first attribute access,
+    # afterwards it is an ordinary module so lookups cost nothing extra
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError("No module named %r" % name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
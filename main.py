@@ -1,51 +1,333 @@
-import UI
-import pygame
 import time
 
-from printer import Printer
-from camera import Camera
-from g_code import GCode
-from printed_object import PrintedObject
+STARTED = time.perf_counter()  # taken before any other import so they count towards startup
+
+import argparse
+import threading
+
+import sim_log
+
+# pygame, OpenGL and the scene modules are imported inside main() once the arguments are known,
+# analysis modules (numpy) only when the feature that needs them is first used
+
+log = sim_log.get_logger("main")
+
+NULL_DISPLAY_SIZE = (1280, 720)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="3D printer G-code simulator")
+    # just change a .gcode file to .txt extension
+    parser.add_argument("file", nargs="?", default="astro.txt",
+                        help="G-code file to simulate, - reads slicer output from stdin as it is produced")
+    parser.add_argument("--listen", metavar="[HOST:]PORT",
+                        help="accept G-code from a print host over TCP instead of reading the file")
+    parser.add_argument("--unix", metavar="PATH",
+                        help="accept G-code from a print host over a Unix socket instead of reading the file")
+    parser.add_argument("--stream-buffer", type=int, default=32, metavar="N",
+                        help="commands buffered before the stream server holds back its ok")
+    parser.add_argument("--diff", metavar="FILE",
+                        help="highlight printed segments that differ from this other slicing of the model")
+    parser.add_argument("--preflight", action="store_true",
+                        help="refuse to start prints that fail the bed, Z, feed rate and extrusion checks")
+    parser.add_argument("--snapshot", metavar="FILE",
+                        help="save the simulation here with F5 and when the viewer is closed mid-print")
+    parser.add_argument("--resume", metavar="FILE", help="continue a print from a snapshot saved earlier")
+    parser.add_argument("--record", metavar="FILE",
+                        help="record every event and held key per frame, for replaying the session later")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="drive the viewer from a recording frame by frame, then print frame time statistics")
+    parser.add_argument("--process", action="store_true",
+                        help="run the simulation in its own process, handing printed vertices over in shared memory")
+    parser.add_argument("--process-rate", type=float, default=1000.0, metavar="STEPS",
+                        help="simulation steps per second with --process, 0 runs as fast as possible")
+    parser.add_argument("--watch", action="store_true",
+                        help="reload the file when the slicer rewrites it, re-planning only the layers that changed")
+    parser.add_argument("--memory-budget", type=float, metavar="MB",
+                        help="move completed layers to memory-mapped files once the printed points exceed this")
+    parser.add_argument("--render-backend", choices=("immediate", "buffered", "null"), default="immediate",
+                        help="how the scene is drawn: immediate mode, buffered vertex arrays, or null to only count "
+                             "primitives without a GL context (benchmarks on machines without a display)")
+    parser.add_argument("--metrics", metavar="[HOST:]PORT",
+                        help="serve simulator metrics in Prometheus text format, on localhost unless a host is given")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="sample the main loop from startup and write collapsed stacks here on exit, "
+                             "P starts and stops sampling at any time")
+    parser.add_argument("--profile-interval", type=float, default=5.0, metavar="MS",
+                        help="time between profiler samples")
+    parser.add_argument("--memory-report", type=float, metavar="SECONDS",
+                        help="log the memory held by each part of the simulator every SECONDS")
+    parser.add_argument("--memory-trace", action="store_true",
+                        help="run tracemalloc and log the allocation sites that grew with every memory report")
+    parser.add_argument("--log-level", default="WARNING",
+                        help="level printed to the terminal (DEBUG, INFO, WARNING, ...)")
+    parser.add_argument("--trace-ring", type=int, default=0, metavar="N",
+                        help="keep the last N log records in memory, dump them with L")
+    parser.add_argument("--trace-level", default="DEBUG",
+                        help="lowest level kept in the trace ring")
+    return parser.parse_args()
+
+
+def report_primitives(counts):
+    frames = max(counts["clears"], 1)
+    print("Drew %d frames: %.1f draw calls, %.0f lines, %.0f points, %.0f vertices, %.1f texts per frame" % (
+        counts["clears"], counts["draw_calls"] / frames, counts["lines"] / frames, counts["points"] / frames,
+        counts["vertices"] / frames, counts["texts"] / frames))
+
+
+def create_stream_server(arguments, g_code):
+    from stream_server import GCodeStreamServer
+    if arguments.unix:
+        return GCodeStreamServer(g_code, unix_path=arguments.unix)
+    host, _, port = arguments.listen.rpartition(":")
+    return GCodeStreamServer(g_code, host or "127.0.0.1", int(port))
+
+
+class BackgroundLoader:
+    # reads the G-code file (and builds the diff overlay) while the window is already drawing
+    def __init__(self, g_code, arguments, printer, startup_timer):
+        self.g_code = g_code
+        self.arguments = arguments
+        self.printer = printer
+        self.startup_timer = startup_timer
+        self.diff_overlay = None
+        self.finished = False
+        self.__thread = threading.Thread(target=self.__load, name="gcode-loader", daemon=True)
+
+    def start(self):
+        self.__thread.start()
+
+    def wait(self):
+        self.__thread.join()
+
+    def __load(self):
+        self.g_code.load()
+        self.startup_timer.mark("G-code loaded")
+        if self.arguments.diff:
+            from diff_overlay import DiffOverlay
+            self.diff_overlay = DiffOverlay(self.printer, self.arguments.file, self.arguments.diff)
+            self.startup_timer.mark("diff computed")
+        self.finished = True
 
 
 def main():
-    printing_time = 0.0
+    arguments = parse_arguments()
+    sim_log.configure(arguments.log_level, arguments.trace_ring, arguments.trace_level)
+    startup_timer = sim_log.PhaseTimer("startup", STARTED)
+    startup_timer.mark("arguments parsed")
+
+    if arguments.process and arguments.render_backend == "null":
+        raise SystemExit("--render-backend null draws nothing to count with --process, which keeps its own buffers")
+    if arguments.process and arguments.metrics:
+        raise SystemExit("--metrics reads the simulation's state directly and cannot be combined with --process")
+    if arguments.process and (arguments.memory_report or arguments.memory_trace):
+        raise SystemExit("--memory-report measures the simulation's state directly and cannot be combined with --process")
+    if arguments.process:
+        # the simulation process only loads a file and prints it, everything else lives in the viewer's own loop
+        for flag, is_set in (("--preflight", arguments.preflight), ("--diff", arguments.diff),
+                             ("--watch", arguments.watch), ("--snapshot", arguments.snapshot),
+                             ("--resume", arguments.resume), ("--record", arguments.record),
+                             ("--replay", arguments.replay), ("--memory-budget", arguments.memory_budget is not None),
+                             ("--listen", arguments.listen), ("--unix", arguments.unix),
+                             ("reading stdin (-)", arguments.file == "-")):
+            if is_set:
+                raise SystemExit("%s is not supported with --process" % flag)
+
+    import pygame
+    import render_backend
+    from camera import Camera
+    startup_timer.mark("pygame and OpenGL imported")
     pygame.init()
+    if arguments.render_backend == "null":
+        # a plain window only for input, SDL_VIDEODRIVER=dummy runs without a display
+        display_size = pygame.display.set_mode(NULL_DISPLAY_SIZE).get_size()
+        backend = render_backend.use(render_backend.NullBackend(display_size))
+        camera = Camera(display_size)
+    else:
+        backend = render_backend.use(arguments.render_backend)
+        camera = Camera()
+    startup_timer.mark("window opened")
+
+    if arguments.process:
+        import sim_process
+        sim_process.run_viewer(arguments, camera, startup_timer)
+        return
+
+    import UI
+    import arcs
+    from printer import Printer
+    from g_code import GCode
+    from printed_object import PrintedObject
+    import picking
+    from features import FEATURE_GROUPS
     # adjust tick_rate / adjust_feed_rate for a good balance of performance /clarity
     tick_rate = 1
 
-    camera = Camera()
     printer = Printer(tick_rate)
-    print_object = PrintedObject(printer)
-    # just change a .gcode file to .txt extension
-    g_code = GCode(printer, "astro.txt")
+    # extruding arcs are split into chords that stay within ARC_PIXEL_ERROR on screen at the zoom level they
+    # are queued at, the pixel size costs two ray casts so it is only asked for then
+    printer.arc_tolerance_function = lambda: max(arcs.ARC_PIXEL_ERROR * camera.pixel_size(printer.nozzle_position),
+                                                 arcs.MIN_ARC_TOLERANCE)
+    print_object = PrintedObject(printer, None if arguments.memory_budget is None
+                                 else int(arguments.memory_budget * (1 << 20)))
+    is_listening = arguments.listen is not None or arguments.unix is not None
+    if is_listening:
+        g_code = GCode(printer, buffer_size=arguments.stream_buffer)
+    else:
+        g_code = GCode(printer, arguments.file, load=False)
+    is_streaming = g_code.is_streaming()
+    loader = BackgroundLoader(g_code, arguments, printer, startup_timer)
+    loader.start()
+    reloader = None
+    if arguments.watch and not is_streaming:
+        from hot_reload import HotReloader
+        reloader = HotReloader(arguments.file, printer, print_object, g_code)
+        reloader.start()
+    from input_recording import LiveInput, ReplayInput
+    if arguments.replay:
+        input_source = ReplayInput(arguments.replay)
+    else:
+        input_source = LiveInput(arguments.record, arguments.file)
+    if arguments.replay or arguments.record:
+        # recorded frames only line up again when the file is ready on the same frame
+        loader.wait()
+    frame_metrics = None
+    if arguments.metrics:
+        import metrics
+        host, _, port = arguments.metrics.rpartition(":")
+        simulator_metrics = metrics.SimulatorMetrics(printer, g_code, print_object)
+        metrics.MetricsServer(simulator_metrics, host or "127.0.0.1", int(port)).start()
+        frame_metrics = simulator_metrics.frames
+    from sampling_profiler import SamplingProfiler
+    profiler = SamplingProfiler(printer, arguments.profile_interval / 1000)
+    if arguments.profile:
+        profiler.start()
+    import memory_accounting
+    memory_monitor = memory_accounting.MemoryMonitor(
+        printer, g_code, print_object,
+        arguments.memory_report or memory_accounting.REPORT_INTERVAL, arguments.memory_trace)
+    is_memory_reported = bool(arguments.memory_report or arguments.memory_trace)
+    show_memory = False
+    startup_timer.mark("scene created")
+    is_first_frame = True
+    is_startup_reported = False
 
     is_printing = False  # locks printing if printing is already in progress
     is_paused = False  #
+    if arguments.resume:
+        import snapshot
+        viewer_state = snapshot.load_snapshot(arguments.resume, printer, print_object, g_code)
+        is_printing = viewer_state["is_printing"]
+        is_paused = viewer_state["is_paused"]
+        startup_timer.mark("snapshot resumed")
+
+    def save_snapshot():
+        import snapshot
+        snapshot.save_snapshot(arguments.snapshot or snapshot.default_snapshot_name(arguments.file),
+                               printer, print_object, g_code,
+                               {"is_printing": is_printing, "is_paused": is_paused})
+
+    def shutdown():
+        if arguments.snapshot and is_printing and not is_streaming:
+            save_snapshot()
+        if isinstance(backend, render_backend.NullBackend):
+            report_primitives(backend.counts)
+        profiler.stop(arguments.profile)
+        input_source.close()
+        pygame.quit()
+        quit()
+
+    segment_source = None  # maps picked segments to their G-code lines, loaded on the first click
+    picked_segment = None
+
+    def pick_segment(window_position):
+        nonlocal segment_source
+        start = time.perf_counter()
+        ray = camera.cast_ray(window_position)
+        edge_ray = camera.cast_ray((window_position[0] + picking.PICK_RADIUS, window_position[1]))
+        hit = print_object.pick_segment(ray, edge_ray)
+        pick_time = time.perf_counter() - start
+        if hit is None:
+            return None
+        picked = {"segment": hit[0], "distance": hit[1], "layer": print_object.segment_index.segment(hit[0])[5]}
+        if not is_streaming and loader.finished:
+            if segment_source is None:
+                segment_source = picking.SegmentSource(arguments.file)
+            segment = print_object.segment_index.segment(hit[0])
+            middle = ((segment[0] + segment[2]) / 2, segment[4],
+                      (segment[1] + segment[3]) / 2 + print_object.z_position)
+            source = segment_source.describe(hit[0], printer.world_to_gcode([middle])[0])
+            if source is not None:
+                picked.update(source)
+                picked["command"] = g_code.get_line(source["line"])
+        log.info("Picked %s in %.3f ms", picked, pick_time * 1000)
+        return picked
+
+    current_layer_stats = None  # per-layer statistics table, loaded the first time it is shown
+    show_layer_stats = False
+    memory_monitor.caches["toolpath_cache"] = lambda: (
+        None if segment_source is None else (segment_source.toolpath.moves, segment_source.rows))
+    memory_monitor.caches["layer_stats_cache"] = lambda: current_layer_stats
     while True:
-        for event in pygame.event.get():
+        events, pressed_keys = input_source.next_frame()
+        if frame_metrics is not None:
+            frame_metrics.tick()
+        for event in events:
             if event.type == pygame.QUIT:
-                pygame.quit()
-                quit()
+                shutdown()
             if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_f and not is_printing:
-                    printer.start_print(g_code)
-                    is_printing = True
+                if event.key == pygame.K_f and not is_printing and loader.finished:
+                    report = None
+                    if arguments.preflight:
+                        import preflight
+                        report = preflight.validate_file(arguments.file)
+                    if report is not None and not report.is_ok():
+                        log.warning("Preflight failed, not printing:\n%s", report.format())
+                    else:
+                        printer.start_print(g_code)
+                        is_printing = True
                 if event.key == pygame.K_z:
                     is_paused = not is_paused
                 if event.key == pygame.K_j:
                     printer.increase_simulation_speed()
                 if event.key == pygame.K_k:
                     printer.decrease_simulation_speed()
+                if event.key == pygame.K_i and not is_streaming:
+                    if current_layer_stats is None:
+                        import layer_stats
+                        current_layer_stats = layer_stats.load_layer_stats(arguments.file)
+                    show_layer_stats = not show_layer_stats
+                if event.key == pygame.K_t:
+                    print_object.is_colored_by_feature = not print_object.is_colored_by_feature
+                if pygame.K_1 <= event.key < pygame.K_1 + len(FEATURE_GROUPS):
+                    print_object.toggle_features(FEATURE_GROUPS[event.key - pygame.K_1][1])
+                if event.key == pygame.K_l:
+                    sim_log.dump_ring()
+                if event.key == pygame.K_p:
+                    profiler.toggle(arguments.profile)
+                if event.key == pygame.K_m:
+                    show_memory = not show_memory
+                    if show_memory:
+                        memory_monitor.update(force=True)
+                if event.key == pygame.K_F5 and is_printing and not is_streaming:
+                    save_snapshot()
                 if event.key == pygame.K_ESCAPE:
-                    pygame.quit()
-                    quit()
+                    shutdown()
+
+            if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                picked_segment = pick_segment(event.pos)
 
             camera.update_camera_event(event)
 
+        if reloader is not None and reloader.apply(is_printing):
+            # segment numbers and line numbers may have moved
+            segment_source = None
+            picked_segment = None
+            current_layer_stats = None
+            show_layer_stats = False
+
         if not printer.movement_queue.empty():
             insert_status = printer.move_printer()
-            printing_time += float(printer.get_movement_rate() / 2)
             if insert_status[1]:
                 print_object.insert_temporary_point()
             if insert_status[0]:
@@ -54,14 +336,41 @@ def main():
         elif not g_code.command_queue.empty() and not is_paused:
             g_code.process_g_code()
 
-        camera.update_camera_frame(pygame.key.get_pressed())
+        camera.update_camera_frame(pressed_keys)
         print_object.update_object_frame()
+        if loader.diff_overlay is not None:
+            loader.diff_overlay.update_overlay_frame()
         printer.update_printer_frame()
         UI.drawUI(camera.get_size(), printer,
-                  printer.get_simulation_rate(), printing_time)
+                  printer.get_simulation_rate(), printer.get_elapsed_time(),
+                  current_layer_stats if show_layer_stats else None)
+        if print_object.is_colored_by_feature or print_object.hidden_features:
+            UI.drawFeatureLegend(camera.get_size(), print_object)
+        if picked_segment is not None:
+            UI.drawPickedSegment(camera.get_size(), picked_segment)
+        if is_memory_reported or show_memory:
+            memory_monitor.update()
+        if show_memory and memory_monitor.report is not None:
+            UI.drawMemoryUsage(camera.get_size(), memory_monitor.report)
+        if not loader.finished:
+            UI.drawLoadingProgress(camera.get_size(), arguments.file, g_code.load_progress)
 
         pygame.display.flip()
+        if is_first_frame:
+            startup_timer.mark("first frame")
+            is_first_frame = False
+        if not is_startup_reported and loader.finished:
+            startup_timer.report()
+            is_startup_reported = True
+        if is_streaming and not is_printing and loader.finished:
+            # the head is zeroed against the first drawn frame, only then may streamed commands arrive
+            printer.start_print(g_code)
+            is_printing = True
+            if is_listening:
+                create_stream_server(arguments, g_code).start()
         pygame.time.wait(tick_rate)
 
 
-main()
+# the simulation process (--process) is spawned and imports this module again
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import sys
+import time
+
+import sim_log
+
+log = sim_log.get_logger("memory")
+
+REPORT_INTERVAL = 10.0  # seconds between reports when none is given
+SAMPLE_SIZE = 512  # items measured per container, the rest are assumed to be alike
+TRACE_FRAMES = 1  # stack depth tracemalloc records, one frame keeps its overhead low
+TRACE_TOP = 8  # allocation sites listed per tracemalloc diff
+
+
+def deep_size(value, seen=None):
+    # bytes of value and everything it holds, objects reachable twice are counted once
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in value)
+    elif isinstance(value, dict):
+        size += sum(deep_size(key, seen) + deep_size(item, seen) for key, item in value.items())
+    elif hasattr(value, "nbytes"):
+        size += value.nbytes
+    return size
+
+
+def container_size(items, count=None, shallow=False):
+    # estimated bytes of a large sequence from a sample of its items spread over it.
+    # shallow only counts the container, for lists whose items are already counted elsewhere
+    count = len(items) if count is None else count
+    size = sys.getsizeof(items) if isinstance(items, (list, tuple)) else 8 * count
+    if shallow or not count:
+        return size
+    step = max(count // SAMPLE_SIZE, 1)
+    sample = [items[index] for index in range(0, count, step)][:SAMPLE_SIZE]
+    seen = set()
+    return size + int(sum(deep_size(item, seen) for item in sample) / len(sample) * count)
+
+
+def queue_size(queue, shallow=False):
+    # the deque behind a queue.Queue, read under its lock
+    with queue.mutex:
+        items = list(queue.queue)
+    return container_size(items, shallow=shallow) - sys.getsizeof(items) + 8 * len(items)
+
+
+class MemoryMonitor:
+    # measures what the simulator's big structures hold every interval seconds on the main loop, so nothing
+    # changes underneath it. With trace, tracemalloc runs as well and every report lists the lines whose
+    # allocations grew most since the one before
+    def __init__(self, printer, g_code, print_object, interval=REPORT_INTERVAL, trace=False):
+        self.printer = printer
+        self.g_code = g_code
+        self.print_object = print_object
+        self.interval = interval
+        self.caches = {}  # name -> callable returning a cached object (toolpath, layer statistics), None if unused
+        self.report = None  # subsystem -> bytes of the last measurement
+        self.is_logged = True
+        self.__last = None
+        self.__snapshot = None
+        self.trace = trace
+        if trace:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACE_FRAMES)
+
+    def update(self, force=False):
+        # returns the new report when one was taken
+        now = time.perf_counter()
+        if not force and self.__last is not None and now - self.__last < self.interval:
+            return None
+        self.__last = now
+        self.report = self.measure()
+        if self.is_logged:
+            log.info("Memory: %s", ", ".join("%s %s" % (name, format_bytes(size))
+                                             for name, size in self.report.items()))
+        if self.trace:
+            self.__log_growth()
+        return self.report
+
+    def measure(self):
+        report = {}
+        report.update(self.g_code.memory_usage())
+        report.update(self.printer.memory_usage())
+        report.update(self.print_object.memory_usage())
+        for name, get_cache in self.caches.items():
+            cache = get_cache()
+            if cache is not None:
+                report[name] = deep_size(cache)
+        if self.trace:
+            import tracemalloc
+            report["traced"] = tracemalloc.get_traced_memory()[0]
+        return report
+
+    def __log_growth(self):
+        import tracemalloc
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        if self.__snapshot is not None:
+            growth = [stat for stat in snapshot.compare_to(self.__snapshot, "lineno") if stat.size_diff >= 1024]
+            for stat in growth[:TRACE_TOP]:
+                frame = stat.traceback[0]
+                log.info("  %+d KiB (%d KiB held) at %s:%d", stat.size_diff // 1024, stat.size // 1024,
+                         frame.filename, frame.lineno)
+        self.__snapshot = snapshot
+
+
+def format_bytes(size):
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024:
+            return "%.0f %s" % (size, unit) if unit == "B" else "%.1f %s" % (size, unit)
+        size /= 1024
+    return "%.2f GiB" % size
@@ -0,0 +1,151 @@
+import bisect
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import sim_log
+
+log = sim_log.get_logger("metrics")
+
+DEFAULT_PORT = 9250
+# frame time histogram bucket upper bounds in seconds, Prometheus adds +Inf
+FRAME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.0167, 0.025, 0.0333, 0.05, 0.1, 0.25, 0.5, 1.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class FrameHistogram:
+    # filled by the main loop once per frame, read by the server thread
+    def __init__(self, buckets=FRAME_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.__last = None
+        self.__lock = threading.Lock()
+
+    def tick(self):
+        now = time.perf_counter()
+        if self.__last is not None:
+            self.observe(now - self.__last)
+        self.__last = now
+
+    def observe(self, seconds):
+        with self.__lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+
+    def snapshot(self):
+        with self.__lock:
+            return list(self.counts), self.count, self.total
+
+
+def resident_memory():
+    # bytes, None when the platform offers no way to read it
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # peak, in bytes on macOS
+    except (ImportError, OSError):
+        return None
+
+
+class SimulatorMetrics:
+    # reads the simulator's state when scraped, the main loop only ticks the frame histogram.
+    # Plain attribute reads are safe from the server thread, the queues lock themselves
+    def __init__(self, printer, g_code, print_object):
+        self.printer = printer
+        self.g_code = g_code
+        self.print_object = print_object
+        self.frames = FrameHistogram()
+        self.__last_scrape = (time.perf_counter(), 0.0, 0)  # wall time, simulated seconds, commands
+
+    def render(self):
+        now = time.perf_counter()
+        elapsed_time = self.printer.get_elapsed_time()
+        commands = self.g_code.processed_commands
+        last_now, last_elapsed_time, last_commands = self.__last_scrape
+        self.__last_scrape = (now, elapsed_time, commands)
+        interval = max(now - last_now, 1e-9)
+
+        lines = []
+
+        def metric(name, kind, help_text, value, labels=""):
+            lines.append("# HELP simulator_%s %s" % (name, help_text))
+            lines.append("# TYPE simulator_%s %s" % (name, kind))
+            lines.append("simulator_%s%s %s" % (name, labels, _format(value)))
+
+        counts, count, total = self.frames.snapshot()
+        lines.append("# HELP simulator_frame_seconds Time between the starts of two viewer frames.")
+        lines.append("# TYPE simulator_frame_seconds histogram")
+        cumulative = 0
+        for bound, bucket_count in zip(self.frames.buckets + ("+Inf",), counts):
+            cumulative += bucket_count
+            lines.append('simulator_frame_seconds_bucket{le="%s"} %d' % (bound, cumulative))
+        lines.append("simulator_frame_seconds_sum %s" % _format(total))
+        lines.append("simulator_frame_seconds_count %d" % count)
+
+        metric("speed_setting", "gauge", "Simulation speed multiplier chosen with J and K.",
+               self.printer.get_simulation_rate())
+        metric("speed_ratio", "gauge", "Simulated machine seconds per wall clock second since the last scrape.",
+               (elapsed_time - last_elapsed_time) / interval)
+        metric("commands_processed_total", "counter", "G-code commands processed.", commands)
+        metric("commands_per_second", "gauge", "G-code commands processed per second since the last scrape.",
+               (commands - last_commands) / interval)
+        metric("command_backlog", "gauge", "Commands queued and not yet processed.",
+               self.g_code.command_queue.qsize())
+        metric("motion_backlog", "gauge", "Planned head movement steps not yet simulated.",
+               self.printer.movement_queue.qsize())
+        metric("vertices", "gauge", "Vertices of the printed object, spilled layers included.",
+               self.print_object.point_count() + len(self.print_object.temporary_points))
+        metric("current_layer", "gauge", "Layer being printed.", self.printer.current_layer)
+        metric("extruded_total", "gauge", "Filament extruded so far in mm.", self.printer.get_total_extruded())
+        metric("simulated_seconds_total", "counter", "Simulated machine seconds of every planned move.",
+               elapsed_time)
+        rss = resident_memory()
+        if rss is not None:
+            metric("resident_memory_bytes", "gauge", "Resident memory of the viewer process.", rss)
+        return "\n".join(lines) + "\n"
+
+
+def _format(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug("%s %s", self.address_string(), format % args)
+
+
+class MetricsServer:
+    # Prometheus text format over HTTP from a daemon thread, localhost only unless told otherwise
+    def __init__(self, metrics, host="127.0.0.1", port=DEFAULT_PORT):
+        self.metrics = metrics
+        self.__server = HTTPServer((host, port), _MetricsHandler)
+        self.__server.metrics = metrics
+        self.host, self.port = self.__server.server_address[:2]
+        self.__thread = threading.Thread(target=self.__server.serve_forever, name="metrics", daemon=True)
+
+    def start(self):
+        self.__thread.start()
+        log.info("Serving metrics on http://%s:%d/metrics", self.host, self.port)
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
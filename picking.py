@@ -0,0 +1,322 @@
+import bisect
+import math
+import sys
+
+from lazy_import import lazy_module
+
+np = lazy_module("numpy")
+
+CELL_SIZE = 2.0  # mm, the grid laid over every layer
+PICK_RADIUS = 4  # pixels around the cursor that still select a segment
+
+
+class SegmentIndex:
+    # uniform grid per layer height over the segments PrintedObject draws, filled as they are inserted.
+    # Segments are stored without PrintedObject's z_position shift, x/z is the plane of a layer, y its height.
+    # Completed layers can be moved to memory-mapped arrays (spill), numbers keep counting over both
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.clear()
+
+    def __len__(self):
+        return self.__spilled_count + len(self.segments)
+
+    def clear(self):
+        self.segments = []  # (x0, z0, x1, z1, height, layer) in insertion order, from spilled_count on
+        self.__heights = []  # sorted layer heights
+        self.__grids = {}  # height -> {(cell x, cell z): [segment number]}
+        self.__bounds = {}  # height -> [min x, min z, max x, max z]
+        self.__spilled_count = 0
+        self.__spilled_batches = []  # (first segment number, segments, cell keys, cell starts, cell numbers)
+        self.__spilled_firsts = []  # first segment number of every batch, for bisect
+        self.__spilled_grids = {}  # height -> [(batch, first cell, end cell)]
+
+    def segment(self, number):
+        # (x0, z0, x1, z1, height, layer) of any segment, spilled or not
+        if number >= self.__spilled_count:
+            return self.segments[number - self.__spilled_count]
+        batch = self.__spilled_batches[bisect.bisect_right(self.__spilled_firsts, number) - 1]
+        x0, z0, x1, z1, height, layer = batch[1][number - batch[0]].tolist()
+        return x0, z0, x1, z1, height, None if math.isnan(layer) else int(layer)
+
+    def layers(self, start):
+        # layer of every segment from number start on, start must not be spilled
+        return [segment[5] for segment in self.segments[start - self.__spilled_count:]]
+
+    def truncate(self, count):
+        # forgets every segment numbered count or above, the cell lists are in insertion order.
+        # Spilled segments stay, count must not be below the spilled ones
+        heights = {segment[4] for segment in self.segments[count - self.__spilled_count:]}
+        del self.segments[count - self.__spilled_count:]
+        for height in heights:
+            grid = self.__grids[height]
+            for cell in list(grid):
+                numbers = grid[cell]
+                del numbers[bisect.bisect_left(numbers, count):]
+                if not numbers:
+                    del grid[cell]
+            if not grid:
+                # the bounds of layers that keep some segments stay as they were, they only get looser
+                del self.__grids[height]
+                if height not in self.__spilled_grids:
+                    self.__heights.remove(height)
+                    del self.__bounds[height]
+
+    def spill(self, count, map_array):
+        # moves the segments numbered below count and their grid cells into arrays written by
+        # map_array(name, array), which gives them back memory-mapped (SpillStore.map_array).
+        # Cells are kept per height as sorted keys with the numbers of every cell in one array
+        moved = self.segments[:count - self.__spilled_count]
+        if not moved:
+            return
+        first = self.__spilled_count
+        rows = _segment_rows(moved)
+        keys = []
+        starts = [0]
+        numbers = []
+        ranges = {}
+        for height in sorted({segment[4] for segment in moved}):
+            grid = self.__grids[height]
+            first_cell = len(keys)
+            for cell in sorted(grid, key=_cell_key):
+                cell_numbers = grid[cell]
+                end = bisect.bisect_left(cell_numbers, count)
+                if not end:
+                    continue
+                keys.append(_cell_key(cell))
+                numbers.extend(cell_numbers[:end])
+                starts.append(len(numbers))
+                if end == len(cell_numbers):
+                    del grid[cell]
+                else:
+                    del cell_numbers[:end]
+            if not grid:
+                del self.__grids[height]
+            ranges[height] = (first_cell, len(keys))
+        # plain array views of the mappings, indexing a memmap is several times slower
+        batch = (first,) + tuple(np.asarray(map_array(name, array)) for name, array in (
+            ("segments", rows), ("cell_keys", np.array(keys, dtype=np.uint64)),
+            ("cell_starts", np.array(starts, dtype=np.int64)), ("cell_numbers", np.array(numbers, dtype=np.int64))))
+        self.__spilled_batches.append(batch)
+        self.__spilled_firsts.append(first)
+        for height, (first_cell, end_cell) in ranges.items():
+            self.__spilled_grids.setdefault(height, []).append((batch, first_cell, end_cell))
+        del self.segments[:len(moved)]
+        self.__spilled_count = count
+
+    def to_arrays(self):
+        # (x0, z0, x1, z1, height, layer) rows of every segment, spilled or not, NaN for unknown layers (snapshots)
+        return np.concatenate([batch[1] for batch in self.__spilled_batches] + [_segment_rows(self.segments)])
+
+    def load(self, rows):
+        # replaces the index with the segments of to_arrays. The cells every segment passes through are found
+        # for all of them at once, with the same half-cell steps as insert
+        self.clear()
+        rows = np.asarray(rows, dtype=np.float64)
+        if not len(rows):
+            return
+        self.segments = [(x0, z0, x1, z1, height, None if math.isnan(layer) else int(layer))
+                         for x0, z0, x1, z1, height, layer in rows.tolist()]
+        x0, z0, x1, z1, heights = rows[:, 0], rows[:, 1], rows[:, 2], rows[:, 3], rows[:, 4]
+        steps = np.maximum((2 * np.maximum(np.abs(x1 - x0), np.abs(z1 - z0)) / self.cell_size).astype(np.int64), 1)
+        counts = steps + 1
+        numbers = np.repeat(np.arange(len(rows)), counts)
+        t = (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)) / steps[numbers]
+        cell_x = np.floor((x0[numbers] + (x1 - x0)[numbers] * t) / self.cell_size).astype(np.int64)
+        cell_z = np.floor((z0[numbers] + (z1 - z0)[numbers] * t) / self.cell_size).astype(np.int64)
+        point_heights = heights[numbers]
+        order = np.lexsort((numbers, cell_z, cell_x, point_heights))
+        numbers, cell_x, cell_z, point_heights = numbers[order], cell_x[order], cell_z[order], point_heights[order]
+        is_new_cell = np.ones(len(numbers), dtype=bool)
+        is_new_cell[1:] = (cell_x[1:] != cell_x[:-1]) | (cell_z[1:] != cell_z[:-1]) | \
+            (point_heights[1:] != point_heights[:-1])
+        # a segment passing a cell more than once is listed once
+        is_kept = is_new_cell.copy()
+        is_kept[1:] |= numbers[1:] != numbers[:-1]
+        numbers, is_new_cell = numbers[is_kept], is_new_cell[is_kept]
+        cell_x, cell_z, point_heights = cell_x[is_kept], cell_z[is_kept], point_heights[is_kept]
+        cell_starts = np.flatnonzero(is_new_cell)
+        cell_ends = np.append(cell_starts[1:], len(numbers))
+        number_list = numbers.tolist()
+        cells = list(zip(cell_x[cell_starts].tolist(), cell_z[cell_starts].tolist()))
+        cell_numbers = [number_list[start:end] for start, end in zip(cell_starts.tolist(), cell_ends.tolist())]
+        cell_heights = point_heights[cell_starts]
+        height_values, height_starts = np.unique(cell_heights, return_index=True)
+        height_ends = np.append(height_starts[1:], len(cell_heights))
+        for height, start, end in zip(height_values.tolist(), height_starts.tolist(), height_ends.tolist()):
+            self.__grids[height] = dict(zip(cells[start:end], cell_numbers[start:end]))
+        height_values, inverse = np.unique(heights, return_inverse=True)
+        low = np.full((len(height_values), 2), np.inf)
+        high = np.full((len(height_values), 2), -np.inf)
+        np.minimum.at(low, inverse, np.column_stack((np.minimum(x0, x1), np.minimum(z0, z1))))
+        np.maximum.at(high, inverse, np.column_stack((np.maximum(x0, x1), np.maximum(z0, z1))))
+        self.__heights = height_values.tolist()
+        self.__bounds = {height: bounds for height, bounds
+                         in zip(self.__heights, np.hstack((low, high)).tolist())}
+
+    def mapped_size(self):
+        return sum(sum(array.nbytes for array in batch[1:]) for batch in self.__spilled_batches)
+
+    def memory_usage(self):
+        from memory_accounting import container_size
+        size = container_size(self.segments) + container_size(list(self.__bounds.values()))
+        for grid in self.__grids.values():
+            size += container_size(list(grid.values())) + sys.getsizeof(grid)
+        return size
+
+    def insert(self, start, end, layer):
+        height = round(start[1], 3)
+        x0, z0, x1, z1 = start[0], start[2], end[0], end[2]
+        number = len(self)
+        self.segments.append((x0, z0, x1, z1, height, layer))
+        grid = self.__grids.get(height)
+        if grid is None:
+            grid = self.__grids[height] = {}
+            if height not in self.__bounds:
+                self.__bounds[height] = [x0, z0, x0, z0]
+                bisect.insort(self.__heights, height)
+        bounds = self.__bounds[height]
+        bounds[0] = min(bounds[0], x0, x1)
+        bounds[1] = min(bounds[1], z0, z1)
+        bounds[2] = max(bounds[2], x0, x1)
+        bounds[3] = max(bounds[3], z0, z1)
+        # walk the segment in half-cell steps so every cell it passes through lists it
+        steps = max(int(2 * max(abs(x1 - x0), abs(z1 - z0)) / self.cell_size), 1)
+        cells = set()
+        for step in range(steps + 1):
+            t = step / steps
+            cells.add((math.floor((x0 + (x1 - x0) * t) / self.cell_size),
+                       math.floor((z0 + (z1 - z0) * t) / self.cell_size)))
+        for cell in cells:
+            grid.setdefault(cell, []).append(number)
+        return number
+
+    def pick(self, ray, edge_ray):
+        # ray and edge_ray are (origin, direction) through the cursor and PICK_RADIUS pixels beside it,
+        # the gap between them at a distance is how close a segment has to be there.
+        # Returns (segment number, distance in mm) of the hit nearest to the camera, or None
+        origin, direction = ray
+        edge_origin, edge_direction = edge_ray
+        if direction[1] == 0:
+            return None
+        hits = []
+        for height in self.__heights:
+            t = (height - origin[1]) / direction[1]
+            if t < 0:
+                continue
+            x = origin[0] + direction[0] * t
+            z = origin[2] + direction[2] * t
+            radius = math.dist((edge_origin[0] + edge_direction[0] * t, edge_origin[2] + edge_direction[2] * t),
+                               (x, z))
+            bounds = self.__bounds[height]
+            if bounds[0] - radius <= x <= bounds[2] + radius and bounds[1] - radius <= z <= bounds[3] + radius:
+                hits.append((t, height, x, z, radius))
+        hits.sort()
+        for t, height, x, z, radius in hits:
+            found = self.__nearest_in_layer(height, x, z, radius)
+            if found is not None:
+                return found
+        return None
+
+    def __nearest_in_layer(self, height, x, z, radius):
+        reach = max(math.ceil(radius / self.cell_size), 1)
+        cell_x = math.floor(x / self.cell_size)
+        cell_z = math.floor(z / self.cell_size)
+        cells = [(column, row) for column in range(cell_x - reach, cell_x + reach + 1)
+                 for row in range(cell_z - reach, cell_z + reach + 1)]
+        candidates = set()
+        grid = self.__grids.get(height, {})
+        for cell in cells:
+            candidates.update(grid.get(cell, ()))
+        best = None
+        for number in candidates:
+            distance = _point_segment_distance(x, z, self.segments[number - self.__spilled_count])
+            if distance <= radius and (best is None or distance < best[1]):
+                best = (number, distance)
+        if height in self.__spilled_grids:
+            wanted = np.array([_cell_key(cell) for cell in cells], dtype=np.uint64)
+            for (first, segments, keys, starts, numbers), first_cell, end_cell in self.__spilled_grids[height]:
+                positions = first_cell + np.searchsorted(keys[first_cell:end_cell], wanted)
+                inside = positions < end_cell
+                positions = positions[inside][keys[positions[inside]] == wanted[inside]]
+                if not len(positions):
+                    continue
+                found = np.unique(np.concatenate([numbers[start:end] for start, end
+                                                  in zip(starts[positions].tolist(), starts[positions + 1].tolist())]))
+                distances = _point_segment_distances(x, z, segments[found - first])
+                nearest = int(np.argmin(distances))
+                if distances[nearest] <= radius and (best is None or distances[nearest] < best[1]):
+                    best = (int(found[nearest]), float(distances[nearest]))
+        return best
+
+
+def _segment_rows(segments):
+    return np.array([segment[:5] + (np.nan if segment[5] is None else segment[5],) for segment in segments],
+                    dtype=np.float64).reshape(-1, 6)
+
+
+def _point_segment_distances(x, z, segments):
+    # _point_segment_distance over rows of spilled segments
+    x0, z0, x1, z1 = segments[:, 0], segments[:, 1], segments[:, 2], segments[:, 3]
+    dx, dz = x1 - x0, z1 - z0
+    length = dx * dx + dz * dz
+    t = np.clip(((x - x0) * dx + (z - z0) * dz) / np.where(length == 0, 1.0, length), 0.0, 1.0)
+    return np.hypot(x - (x0 + dx * t), z - (z0 + dz * t))
+
+
+def _cell_key(cell):
+    # one unsigned 64 bit number per grid cell, the column in the high half
+    return (cell[0] & 0xffffffff) << 32 | (cell[1] & 0xffffffff)
+
+
+def _point_segment_distance(x, z, segment):
+    x0, z0, x1, z1 = segment[:4]
+    dx, dz = x1 - x0, z1 - z0
+    length = dx * dx + dz * dz
+    t = 0.0 if length == 0 else min(max(((x - x0) * dx + (z - z0) * dz) / length, 0.0), 1.0)
+    return math.hypot(x - (x0 + dx * t), z - (z0 + dz * t))
+
+
+class SegmentSource:
+    # maps the n-th drawn segment back to its G1 command, PrintedObject draws one per extruding plane move.
+    # Arcs are drawn with as many segments as the zoom level asked for, in files with arcs the segment is
+    # matched to the nearest extruding move of its layer instead
+    def __init__(self, file_name):
+        from toolpath import PLANE_MOVE, load_toolpath
+        self.toolpath = load_toolpath(file_name)
+        moves = self.toolpath.moves
+        self.rows = np.flatnonzero((moves["kind"] == PLANE_MOVE) & moves["extrude"])
+        self.has_arcs = bool(moves["arc"][self.rows].any())
+
+    def describe(self, segment_number, g_code_point=None):
+        # g_code_point: a point of the segment in G-code millimetres (Printer.world_to_gcode), used with arcs
+        if self.has_arcs and g_code_point is not None:
+            row = self.__nearest_row(g_code_point)
+        elif segment_number < len(self.rows):
+            row = self.rows[segment_number]
+        else:
+            row = None
+        if row is None:
+            return None
+        move = self.toolpath.moves[row]
+        return {"line": int(move["line"]), "layer": int(move["layer"]), "feed_rate": float(move["feed_rate"]),
+                "x": float(move["x"]), "y": float(move["y"]), "z": float(move["z"]), "e": float(move["e"])}
+
+    def __nearest_row(self, point):
+        moves = self.toolpath.moves
+        rows = self.rows[np.abs(moves["z"][self.rows] - point[2]) < 0.01]
+        if not len(rows):
+            return None
+        starts = self.toolpath.start_points()[rows, :2].astype(np.float64)
+        ends = self.toolpath.end_points()[rows, :2].astype(np.float64)
+        deltas = ends - starts
+        lengths = np.maximum((deltas * deltas).sum(axis=1), 1e-12)
+        t = np.clip(((point[:2] - starts) * deltas).sum(axis=1) / lengths, 0.0, 1.0)
+        distances = np.hypot(*(starts + deltas * t[:, None] - point[:2]).T)
+        is_arc = moves["arc"][rows] != 0
+        if is_arc.any():
+            from arcs import arc_distances
+            centers = starts[is_arc] + np.column_stack((moves["i"][rows[is_arc]], moves["j"][rows[is_arc]]))
+            distances[is_arc] = arc_distances(point, starts[is_arc], ends[is_arc], centers,
+                                              moves["arc"][rows[is_arc]])
+        return rows[np.argmin(distances)]
@@ -0,0 +1,115 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import sim_log
+from toolpath import FEED_ONLY, PLANE_MOVE, load_toolpath
+
+log = sim_log.get_logger("preflight")
+
+# Printer's 37.5 dimension gives the 180 mm square plate drawn by Plate, G-code coordinates start at its corner
+BED_SIZE = (180.0, 180.0)
+MIN_FEED_RATE = 60.0  # mm/min
+MAX_FEED_RATE = 15000.0
+Z_TOLERANCE = 0.05  # mm an extruding move may sit below what was already printed
+EXTRUSION_RATIO_FACTOR = 5.0  # E per mm above this multiple of the file's median is suspicious
+MAX_ISSUES_SHOWN = 10
+
+CHECKS = {
+    "out_of_bed": "moves outside the %.0f x %.0f mm plate" % BED_SIZE,
+    "below_plate": "moves below the plate (Z < 0)",
+    "z_backwards": "extrusion below already printed layers",
+    "feed_rate": "feed rates outside %.0f-%.0f mm/min" % (MIN_FEED_RATE, MAX_FEED_RATE),
+    "extrusion_jump": "extrusion far above the file's usual E per mm",
+}
+
+
+class PreflightReport:
+    def __init__(self, file_name, issues, move_count, duration):
+        self.file_name = file_name
+        self.issues = issues  # check name -> array of offending source line numbers
+        self.move_count = move_count
+        self.duration = duration
+
+    def is_ok(self):
+        return not any(len(lines) for lines in self.issues.values())
+
+    def issue_count(self):
+        return sum(len(lines) for lines in self.issues.values())
+
+    def summary(self):
+        return {name: len(lines) for name, lines in self.issues.items() if len(lines)}
+
+    def format(self):
+        text = ["%s: %d moves checked in %.1f ms, %s" % (
+            self.file_name, self.move_count, self.duration * 1000, "ok" if self.is_ok() else
+            "%d issues" % self.issue_count())]
+        for name, lines in self.issues.items():
+            if len(lines):
+                shown = ", ".join(str(line) for line in lines[:MAX_ISSUES_SHOWN])
+                more = " ..." if len(lines) > MAX_ISSUES_SHOWN else ""
+                text.append("  %s: %d (%s) at lines %s%s" % (name, len(lines), CHECKS[name], shown, more))
+        return "\n".join(text)
+
+
+def validate(toolpath, bed_size=BED_SIZE, min_feed_rate=MIN_FEED_RATE, max_feed_rate=MAX_FEED_RATE,
+             z_tolerance=Z_TOLERANCE, extrusion_ratio_factor=EXTRUSION_RATIO_FACTOR):
+    start = time.perf_counter()
+    moves = toolpath.moves
+    lines = moves["line"]
+    is_move = moves["kind"] != FEED_ONLY
+    is_extrusion = (moves["kind"] == PLANE_MOVE) & moves["extrude"] & (moves["e"] > 0)
+    issues = {}
+
+    x = moves["x"]
+    y = moves["y"]
+    issues["out_of_bed"] = lines[is_move & ((x < 0) | (x > bed_size[0]) | (y < 0) | (y > bed_size[1]))]
+    issues["below_plate"] = lines[is_move & (moves["z"] < 0)]
+
+    # highest Z printed before each move, an extruding move below it would drive the nozzle into the part
+    printed_z = np.where(is_extrusion, moves["z"], -np.inf)
+    highest_before = np.maximum.accumulate(np.concatenate(([-np.inf], printed_z[:-1])))
+    issues["z_backwards"] = lines[is_extrusion & (moves["z"] < highest_before - z_tolerance)]
+
+    feed_rate = moves["feed_rate"]
+    issues["feed_rate"] = lines[is_move & ((feed_rate < min_feed_rate) | (feed_rate > max_feed_rate))]
+
+    lengths = toolpath.lengths()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(lengths > 0, moves["e"] / lengths, np.inf)
+    finite = ratio[is_extrusion & np.isfinite(ratio)]
+    median = float(np.median(finite)) if len(finite) else 0.0
+    issues["extrusion_jump"] = lines[is_extrusion & (ratio > median * extrusion_ratio_factor)] if median > 0 \
+        else lines[:0]
+
+    return PreflightReport(toolpath.file_name, issues, len(moves), time.perf_counter() - start)
+
+
+def validate_file(file_name, use_cache=True, **limits):
+    return validate(load_toolpath(file_name, use_cache), **limits)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check G-code files against the simulated printer before printing")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--bed", type=float, nargs=2, default=BED_SIZE, metavar=("X", "Y"), help="plate size in mm")
+    parser.add_argument("--min-feed", type=float, default=MIN_FEED_RATE)
+    parser.add_argument("--max-feed", type=float, default=MAX_FEED_RATE)
+    parser.add_argument("--no-cache", action="store_true", help="recompile instead of using <file>.toolpath.npz")
+    parser.add_argument("--log-level", default="WARNING")
+    arguments = parser.parse_args()
+    sim_log.configure(arguments.log_level)
+
+    failed = 0
+    for file_name in arguments.files:
+        report = validate_file(file_name, not arguments.no_cache, bed_size=arguments.bed,
+                               min_feed_rate=arguments.min_feed, max_feed_rate=arguments.max_feed)
+        print(report.format())
+        failed += not report.is_ok()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,78 @@
-from OpenGL.GL import *
 import random
 
+from layer_store import POINT_BYTES, SpillStore
+from picking import SegmentIndex
+import render_backend
+from vertex_layout import VERTEX_STRIDE
+
+
+def layer_color(height):
+    # the same height always gives the same colour, rounding keeps float drift in the head position out of the seed
+    height = round(height, 3)
+    random.seed(height * 4)
+    red = random.random()
+    random.seed(height * 9)
+    green = random.random()
+    random.seed(height * 13)
+    blue = random.random()
+    return red, green, blue
+
 class PrintedObject:
-    def __init__(self, printer):
+    def __init__(self, printer, memory_budget=None, spill_directory=None):
         self.printer = printer
+        # above memory_budget bytes of points, completed layers are moved to memory-mapped files
+        self.memory_budget = memory_budget
+        self.spilled = SpillStore(spill_directory) if memory_budget is not None else None
+        self.__layer = None
+        self.__layer_start = 0  # first point of the current layer in permanent_line_points
         self.temporary_points = []
         self.permanent_line_points = []
+        self.permanent_features = []  # feature type code of every permanent point
+        # the same points split into runs of one feature type, in print order so the drawing order is unchanged,
+        # hiding or recolouring a type only changes which runs are drawn and how. Points are only appended
+        # until the list is replaced, BufferedBackend uploads just the new ones
+        self.feature_buffers = []
+        self.hidden_features = set()
+        self.is_colored_by_feature = False
         self.z_position = 0
-
+        self.segment_index = SegmentIndex()  # every pair of permanent points is one segment, for mouse picking
 
     def update_object_frame(self):
-        glClear(GL_COLOR_BUFFER_BIT|GL_DEPTH_BUFFER_BIT)
-        self.__build_permanent_printed_object()
-        self.__build_temporary_printed_object()
+        backend = render_backend.current()
+        backend.clear()
+        # points keep the raw nozzle z, the drawn z is -z + z_position
+        backend.push_matrix()
+        backend.translate(0, 0, self.z_position)
+        backend.scale(1, 1, -1)
+        self.__build_permanent_printed_object(backend)
+        self.__build_temporary_printed_object(backend)
+        backend.pop_matrix()
 
     def __generate_layer_color(self):
-        z_position = self.printer.get_nozzle_position()[1]
-        random.seed(z_position * 4)
-        red = random.random()
-        random.seed(z_position * 9)
-        green = random.random()
-        random.seed(z_position * 13)
-        blue = random.random()
-        return red, green, blue
-
-    def __build_permanent_printed_object(self):
-        glLineWidth(4)
-        glBegin(GL_LINES)
-        for point in self.permanent_line_points:
-            glColor3d(point[1][0], point[1][1], point[1][2])
-            glVertex3f(point[0][0], point[0][1], -point[0][2] + self.z_position)
-        glEnd()
-
-    def __build_temporary_printed_object(self):
-        glPointSize(4)
-        glBegin(GL_POINTS)
-        for point in self.temporary_points:
-            glColor3d(point[1][0], point[1][1], point[1][2])
-            glVertex3d(point[0][0], point[0][1], -point[0][2] + self.z_position)
-        glEnd()
+        return layer_color(self.printer.get_nozzle_position()[1])
+
+    def __build_permanent_printed_object(self, backend):
+        if self.spilled is not None:
+            self.spilled.draw(backend, self.is_colored_by_feature, self.hidden_features)
+        backend.draw_feature_runs(self.feature_buffers, self.is_colored_by_feature, self.hidden_features)
+
+    def __build_temporary_printed_object(self, backend):
+        backend.draw_colored_points(self.temporary_points, 4)
 
     def insert_permanent_point(self):
         self.z_position = self.printer.get_z_position()
-        self.permanent_line_points.append((self.printer.get_nozzle_position(), self.__generate_layer_color()))
+        if self.printer.current_layer != self.__layer:
+            self.__layer = self.printer.current_layer
+            self.__layer_start = len(self.permanent_line_points)
+            if self.spilled is not None and len(self.permanent_line_points) * POINT_BYTES > self.memory_budget:
+                self.__spill_completed_layers()
+        point = (self.printer.get_nozzle_position(), self.__generate_layer_color())
+        self.permanent_line_points.append(point)
+        # both points of a segment get the same type, no command is processed while a move is drawn
+        self.permanent_features.append(self.printer.current_feature)
+        self.__add_to_feature_buffer(point, self.printer.current_feature)
+        if len(self.permanent_line_points) % 2 == 0:
+            self.__index_segment(len(self.permanent_line_points) - 2, self.printer.current_layer)
 
     def insert_temporary_point(self):
         self.z_position = self.printer.get_z_position()
@@ -50,3 +80,115 @@ class PrintedObject:
 
     def erase_temporary_points(self):
         self.temporary_points.clear()
+
+    def __spill_completed_layers(self):
+        # layer changes only happen between moves, so no segment is split between disk and heap
+        self.spilled.spill(self.permanent_line_points[:self.__layer_start],
+                           self.permanent_features[:self.__layer_start])
+        # their segments and grid cells go into the same batch, two spilled points are one segment
+        self.segment_index.spill(len(self.spilled) // 2, self.spilled.map_array)
+        self.permanent_line_points = self.permanent_line_points[self.__layer_start:]
+        self.permanent_features = self.permanent_features[self.__layer_start:]
+        self.__layer_start = 0
+        self.feature_buffers = []
+        for point, feature in zip(self.permanent_line_points, self.permanent_features):
+            self.__add_to_feature_buffer(point, feature)
+
+    def point_count(self):
+        return len(self.permanent_line_points) + (len(self.spilled) if self.spilled is not None else 0)
+
+    def replace_points(self, start, end, points, features, layer):
+        # swaps the permanent points start:end (counted over everything printed) for points of the given layer,
+        # used by hot reloading. Spilled layers can not be changed any more, False is returned for those
+        spilled = self.point_count() - len(self.permanent_line_points)
+        if start < spilled:
+            return False
+        following_layers = self.segment_index.layers(end // 2)
+        heap_start = start - spilled
+        heap_end = end - spilled
+        self.permanent_line_points[heap_start:heap_end] = points
+        self.permanent_features[heap_start:heap_end] = features
+        self.feature_buffers = []
+        for point, feature in zip(self.permanent_line_points, self.permanent_features):
+            self.__add_to_feature_buffer(point, feature)
+        self.segment_index.truncate(start // 2)
+        layers = [layer] * (len(points) // 2) + following_layers
+        for number, first_point in enumerate(range(heap_start, len(self.permanent_line_points) - 1, 2)):
+            self.__index_segment(first_point, layers[number])
+        if self.__layer_start >= heap_end:
+            self.__layer_start += len(points) - (heap_end - heap_start)
+        elif self.__layer_start > heap_start:
+            self.__layer_start = heap_start
+        return True
+
+    def get_all_permanent_points(self):
+        # (points, feature codes) of everything printed, spilled layers included
+        if self.spilled is None or not len(self.spilled):
+            return self.permanent_line_points, self.permanent_features
+        points, features = self.spilled.to_points()
+        return points + self.permanent_line_points, features + self.permanent_features
+
+    def get_feature_runs(self):
+        # (feature, point count) of the runs everything printed is drawn in, spilled layers included
+        runs = self.spilled.feature_runs() if self.spilled is not None else []
+        return runs + [(feature, len(points)) for feature, points in self.feature_buffers]
+
+    def memory_usage(self):
+        # the feature runs and the spilled layers only hold references to points counted here or are on disk
+        from memory_accounting import container_size
+        usage = {
+            "permanent_points": container_size(self.permanent_line_points),
+            "point_features": container_size(self.permanent_features, shallow=True),
+            "temporary_points": container_size(self.temporary_points),
+            "feature_runs": sum(container_size(points, shallow=True) for feature, points in self.feature_buffers),
+            "segment_index": self.segment_index.memory_usage(),
+        }
+        if self.spilled is not None:
+            usage["spilled_mapped"] = self.spilled.vertex_count * VERTEX_STRIDE + self.segment_index.mapped_size()
+        return usage
+
+    def __add_to_feature_buffer(self, point, feature):
+        if not self.feature_buffers or self.feature_buffers[-1][0] != feature:
+            self.feature_buffers.append((feature, []))
+        self.feature_buffers[-1][1].append(point)
+
+    def toggle_features(self, features):
+        # hides the given feature types, or shows them again when they are all hidden already
+        features = set(features)
+        if features <= self.hidden_features:
+            self.hidden_features -= features
+        else:
+            self.hidden_features |= features
+
+    def __index_segment(self, first_point, layer):
+        # stored as drawn before the z_position shift, which moves everything printed so far together
+        start = self.permanent_line_points[first_point][0]
+        end = self.permanent_line_points[first_point + 1][0]
+        self.segment_index.insert((start[0], start[1], -start[2]), (end[0], end[1], -end[2]), layer)
+
+    def pick_segment(self, ray, edge_ray):
+        # rays from Camera.cast_ray, returns (segment number, distance) of the printed segment under them
+        shifted = []
+        for origin, direction in (ray, edge_ray):
+            shifted.append(((origin[0], origin[1], origin[2] - self.z_position), direction))
+        return self.segment_index.pick(shifted[0], shifted[1])
+
+    def get_state(self):
+        return {"z_position": self.z_position}
+
+    def set_state(self, state, permanent_line_points, temporary_points, permanent_features, feature_runs,
+                  segments):
+        # feature_runs as from get_feature_runs, segments as from SegmentIndex.to_arrays
+        self.z_position = state["z_position"]
+        self.permanent_line_points = permanent_line_points
+        self.permanent_features = permanent_features
+        self.temporary_points = temporary_points
+        if self.spilled is not None:
+            self.spilled.clear()
+        self.__layer = None
+        self.feature_buffers = []
+        first = 0
+        for feature, count in feature_runs:
+            self.feature_buffers.append((feature, permanent_line_points[first:first + count]))
+            first += count
+        self.segment_index.load(segments)
@@ -1,22 +1,36 @@
-import pygame
-from OpenGL.GL import *
-from OpenGL.GLU import *
+import logging
 from queue import Queue
 import math
 
+from gcode_program import MachineState
 from head import PrinterHead
 from rail_horizontal import HorizontalRail
 from rail_vertical import VerticalRail
 from plate import Plate
+import arcs
+import sim_log
+from lazy_import import lazy_module
+import render_backend
+
+np = lazy_module("numpy")
+
+log = sim_log.get_logger("printer")
+
+# 37.5 dimension should create the 180mm print plate size (1 to 1)
+DIMENSION = 37.5
+# the nozzle's drawn height is G-code Z plus the bed level once the head is zeroed
+BED_LEVEL = -DIMENSION * 4.5
+PART_COLOR = (1.0, 1.0, 1.0)
 
 
 class Printer:
 
-    def __init__(self, tick_rate):
+    def __init__(self, tick_rate, headless=False):
         self.tick_rate = tick_rate
-        # 37.5 dimension should create the 180mm print plate size (1 to 1)
-        self.__dimension = 37.5
-        self.__bed_level = -self.__dimension * 4.5
+        # headless printers jump straight to each target instead of queueing per-tick steps
+        self.headless = headless
+        self.__dimension = DIMENSION
+        self.__bed_level = BED_LEVEL
         self.__plate_x_zero = 0
         self.__plate_z_zero = 0
         # handles the x shift for the entire printer in relation to the camera
@@ -37,7 +51,16 @@ class Printer:
 
         self.movement_queue = Queue(maxsize=0)
         self.nozzle_position = (0, 0, 0)  # updated whenever the head is built
+        self.__nozzle_offset = None  # nozzle tip of a head at model position 0, see update_nozzle_position
         self.current_layer = 0
+        self.current_feature = 0  # features.FEATURE_TYPES code of the last ;TYPE: comment
+        self.elapsed_time = 0.0  # simulated machine seconds of every planned move
+        # largest distance in mm between a drawn arc and its chords, or a function giving it for every
+        # extruding arc as it is queued (the viewer's zoom level)
+        self.arc_tolerance = arcs.ARC_TOLERANCE
+        self.arc_tolerance_function = None
+        # commanded position, G92 offsets and modes, GCode turns commands into targets with it
+        self.machine_state = MachineState()
 
         # extrusion variables
         self.extrusion_speed = 0
@@ -52,6 +75,79 @@ class Printer:
     def get_nozzle_position(self):
         return self.nozzle_position[0],  self.nozzle_position[1], (self.__model_z_position - self.nozzle_position[2])
 
+    def get_state(self):
+        # scalar simulation state, the movement queue is saved separately (see snapshot.py)
+        return {
+            "tick_rate": self.tick_rate,
+            "plate_zero": [self.__plate_x_zero, self.__plate_z_zero],
+            "model_position": [self.__model_x_position, self.__model_y_position, self.__model_z_position],
+            "nozzle": [self.__nozzle_x_position, self.__nozzle_y_position, self.__nozzle_z_position],
+            "nozzle_position": list(self.nozzle_position),
+            "simulation_speed": self.__simulation_speed,
+            "feed_rate": self.__feed_rate,
+            "movement_rate": self.__movement_rate,
+            "current_layer": self.current_layer,
+            "current_feature": self.current_feature,
+            "elapsed_time": self.elapsed_time,
+            "extrusion_speed": self.extrusion_speed,
+            "total_extruded": self.total_extruded,
+            "machine_state": self.machine_state.get_state(),
+        }
+
+    def set_state(self, state):
+        self.tick_rate = state["tick_rate"]
+        self.__plate_x_zero, self.__plate_z_zero = state["plate_zero"]
+        self.__model_x_position, self.__model_y_position, self.__model_z_position = state["model_position"]
+        self.__nozzle_x_position, self.__nozzle_y_position, self.__nozzle_z_position = state["nozzle"]
+        self.nozzle_position = tuple(state["nozzle_position"])
+        self.__simulation_speed = state["simulation_speed"]
+        self.__feed_rate = state["feed_rate"]
+        self.__movement_rate = state["movement_rate"]
+        self.current_layer = state["current_layer"]
+        self.current_feature = state["current_feature"]
+        self.elapsed_time = state["elapsed_time"]
+        self.extrusion_speed = state["extrusion_speed"]
+        self.total_extruded = state["total_extruded"]
+        self.machine_state.set_state(state["machine_state"])
+
+    def get_head_state(self):
+        # what a viewer needs to draw the head and the HUD, as plain numbers (see sim_process.py)
+        return (self.__model_x_position, self.__model_y_position, self.__model_z_position,
+                self.nozzle_position[0], self.nozzle_position[1], self.nozzle_position[2],
+                self.current_layer, self.current_feature, self.__simulation_speed,
+                self.extrusion_speed, self.total_extruded, self.elapsed_time)
+
+    def set_head_state(self, values):
+        values = [float(value) for value in values]
+        self.__model_x_position, self.__model_y_position, self.__model_z_position = values[0:3]
+        self.nozzle_position = tuple(values[3:6])
+        self.current_layer = int(values[6])
+        self.current_feature = int(values[7])
+        self.__simulation_speed = int(values[8])
+        self.extrusion_speed, self.total_extruded, self.elapsed_time = values[9:12]
+
+    def gcode_to_world(self, points):
+        # maps G-code millimetres (N x 3 array of X, Y, Z) to where PrintedObject draws them this frame
+        points = np.asarray(points, dtype=np.float64)
+        world = np.empty_like(points)
+        world[:, 0] = self.nozzle_position[0] + points[:, 0] - self.__nozzle_x_position
+        world[:, 1] = self.nozzle_position[1] + points[:, 2] - self.__nozzle_z_position
+        world[:, 2] = self.nozzle_position[2] - (points[:, 1] - self.__nozzle_y_position)
+        return world
+
+    def world_to_gcode(self, points):
+        # the inverse of gcode_to_world
+        points = np.asarray(points, dtype=np.float64)
+        g_code = np.empty_like(points)
+        g_code[:, 0] = points[:, 0] - self.nozzle_position[0] + self.__nozzle_x_position
+        g_code[:, 1] = self.nozzle_position[2] - points[:, 2] + self.__nozzle_y_position
+        g_code[:, 2] = points[:, 1] - self.nozzle_position[1] + self.__nozzle_z_position
+        return g_code
+
+    def memory_usage(self):
+        from memory_accounting import queue_size
+        return {"movement_queue": queue_size(self.movement_queue)}
+
     def set_feed_rate(self, feed_rate):
         self.__feed_rate = float(feed_rate)
 
@@ -61,8 +157,12 @@ class Printer:
     def get_simulation_rate(self):
         return self.__simulation_speed
 
+    def get_elapsed_time(self):
+        return self.elapsed_time
+
     def start_print(self, g_code):
         self.__zero_head()
+        self.machine_state = MachineState()
 
         g_code.populate_command_queue()
 
@@ -92,6 +192,11 @@ class Printer:
             else -(x_difference / required_ticks)
         y_step = (y_difference / required_ticks) if self.__nozzle_y_position < float(coordinate_info[1]) \
             else -(y_difference / required_ticks)
+        self.elapsed_time += self.__move_seconds(line_length)
+        if self.headless:
+            self.__nozzle_x_position = float(coordinate_info[0])
+            self.__nozzle_y_position = float(coordinate_info[1])
+            return
         self.movement_queue.put(
             (0, 0, 0, coordinate_info[2], coordinate_info[2]))
         for tick in range(required_ticks):
@@ -100,18 +205,68 @@ class Printer:
         self.movement_queue.put(
             (0, 0, 0, coordinate_info[2], coordinate_info[2]))
 
+    def g_code_arc_movement(self, coordinate_info, offset, radius, direction):
+        # coordinate_info is (x or None, y or None, extrude), a missing word keeps the current position.
+        # The head follows the arc exactly, every tick is a step between two points on it. When extruding,
+        # the arc is drawn as chords within arc_tolerance: each chord is a pair of permanent points
+        start = (self.__nozzle_x_position, self.__nozzle_y_position)
+        end = (start[0] if coordinate_info[0] is None else float(coordinate_info[0]),
+               start[1] if coordinate_info[1] is None else float(coordinate_info[1]))
+        center = arcs.arc_center(start, end, offset, radius, direction)
+        if center is None or center == start:
+            self.g_code_plane_movement((end[0], end[1], coordinate_info[2]))
+            return
+        geometry = arcs.arc_geometry(start, end, center, direction)
+        self.__calculate_movement_rate()
+        arc_length = arcs.arc_length(geometry)
+        required_ticks = max(int(arc_length / self.__movement_rate), 1)
+        self.elapsed_time += self.__move_seconds(arc_length)
+        if self.headless:
+            self.__nozzle_x_position, self.__nozzle_y_position = end
+            return
+        extrude = coordinate_info[2]
+        chords = 1
+        if extrude:
+            tolerance = self.arc_tolerance if self.arc_tolerance_function is None else self.arc_tolerance_function()
+            chords = min(arcs.chord_count(geometry, tolerance), required_ticks)
+        self.movement_queue.put((0, 0, 0, extrude, extrude))
+        previous = start
+        for chord in range(chords):
+            first_tick = required_ticks * chord // chords + 1
+            last_tick = required_ticks * (chord + 1) // chords
+            for tick in range(first_tick, last_tick + 1):
+                point = end if tick == required_ticks else arcs.arc_point(center, geometry, tick / required_ticks)
+                self.movement_queue.put((point[0] - previous[0], 0, point[1] - previous[1], False, extrude))
+                previous = point
+            if chord < chords - 1:
+                # the end of this chord and the start of the next
+                self.movement_queue.put((0, 0, 0, True, True))
+                self.movement_queue.put((0, 0, 0, True, True))
+        self.movement_queue.put((0, 0, 0, extrude, extrude))
+
     def g_code_layer_movement(self, target_height):
         self.__calculate_movement_rate()
         z_difference = abs(float(target_height) - self.__nozzle_z_position)
         required_ticks = max(int(z_difference / self.__movement_rate), 1)
         z_step = (z_difference / required_ticks) if self.__nozzle_z_position < float(target_height) \
             else -(z_difference / required_ticks)
-        for tick in range(required_ticks):
-            self.movement_queue.put((0, z_step, 0, False, False))
-        print("Z height change: %s" % target_height)
+        self.elapsed_time += self.__move_seconds(z_difference)
+        if self.headless:
+            self.__nozzle_z_position = float(target_height)
+        else:
+            for tick in range(required_ticks):
+                self.movement_queue.put((0, z_step, 0, False, False))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Z height change: %s", target_height)
 
     def __zero_head(self):
-        print("Zeroing head")
+        log.info("Zeroing head")
+        if self.headless:
+            # nothing is drawn, so the head simply starts at the plate origin
+            self.__nozzle_x_position = 0
+            self.__nozzle_y_position = 0
+            self.__nozzle_z_position = 0
+            return
         x_difference = -(self.__plate_x_zero - self.nozzle_position[0])
         y_difference = -(self.__bed_level - self.nozzle_position[1])
         z_difference = (self.__plate_z_zero - self.nozzle_position[2])
@@ -134,7 +289,14 @@ class Printer:
     def __calculate_movement_rate(self):
         mm_per_ms = self.__feed_rate / (30000.0 / self.__simulation_speed)
         self.__movement_rate = mm_per_ms * self.tick_rate
-        print("New movement rate: %f" % self.__movement_rate)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("New movement rate: %f", self.__movement_rate)
+
+    def __move_seconds(self, length):
+        # machine time of a move at the feed rate without acceleration, the model toolpath.durations and so
+        # layer_stats use as well. The ticks of a move are rounded and framed by stationary ones, so they
+        # only set the pace of the animation
+        return length / (self.__feed_rate / 60.0) if self.__feed_rate > 0 else 0.0
 
     def increase_simulation_speed(self):
         self.__simulation_speed += 1
@@ -145,12 +307,21 @@ class Printer:
         self.__simulation_speed -= 1
 
     def __reset_printer(self, event):
+        import pygame
         if event.key == pygame.K_z:  # resets x and y positions
             self.__model_x_position = 0
             self.__model_y_position = 0
             self.__model_z_position = 0
-            print("X: %d | Y: %d | Z: %d" % (self.__model_x_position,
-                  self.__model_y_position, self.__model_z_position))
+            log.debug("X: %d | Y: %d | Z: %d", self.__model_x_position,
+                      self.__model_y_position, self.__model_z_position)
+
+    def update_nozzle_position(self):
+        # same nozzle_position building the head gives, for ticks that are simulated without being drawn
+        if self.__nozzle_offset is None:
+            self.__nozzle_offset = PrinterHead(self.__dimension, self.__x_offset, 0, 0).get_nozzle_position()
+        self.nozzle_position = (self.__nozzle_offset[0] + self.__model_x_position,
+                                self.__nozzle_offset[1] + self.__model_y_position,
+                                self.__nozzle_offset[2])
 
     def update_printer_frame(self):
         self.__build_printer_head()
@@ -159,52 +330,34 @@ class Printer:
         self.__build_plate()
 
     def __build_printer_head(self):
-        glLineWidth(1)
-        glBegin(GL_LINES)
         head = PrinterHead(self.__dimension, self.__x_offset,
                            self.__model_x_position, self.__model_y_position)
-        glColor3d(1.0, 1.0, 1.0)
-        for part in head.all_parts:
-            for edge in part[1]:
-                for vertex in edge:
-                    glVertex3fv(part[0][vertex])
-
-        glEnd()
+        render_backend.current().draw_lines(_edge_vertices(head.all_parts), PART_COLOR)
         self.nozzle_position = head.get_nozzle_position()
 
     def __build_horizontal_rail(self):
-        glBegin(GL_LINES)
         horizontal_rail = HorizontalRail(
             self.__dimension, self.__x_offset, self.__model_y_position)
-        for part in horizontal_rail.all_parts:
-            for edge in part[1]:
-                for vertex in edge:
-                    glVertex3fv(part[0][vertex])
-
-        glEnd()
+        render_backend.current().draw_lines(_edge_vertices(horizontal_rail.all_parts), PART_COLOR)
 
     def __build_vertical_rail(self):
-        glBegin(GL_LINES)
         vertical_rail = VerticalRail(self.__dimension, self.__x_offset)
-        for part in vertical_rail.all_parts:
-            for edge in part[1]:
-                for vertex in edge:
-                    glVertex3fv(part[0][vertex])
+        render_backend.current().draw_lines(_edge_vertices(vertical_rail.all_parts), PART_COLOR)
 
-        glEnd()
+    def update_plate_zero(self):
+        # the plate corner the head is zeroed against, for printers that simulate without being drawn
+        self.__create_plate()
 
-    def __build_plate(self):
-        glBegin(GL_LINES)
+    def __create_plate(self):
         plate = Plate(self.__dimension, self.__x_offset,
                       self.__bed_level, self.__model_z_position)
-        for part in plate.all_parts:
-            for edge in part[1]:
-                for vertex in edge:
-                    glVertex3fv(part[0][vertex])
-
-        glEnd()
         self.__plate_x_zero = plate.get_x_zero()
         self.__plate_z_zero = plate.get_z_zero()
+        return plate
+
+    def __build_plate(self):
+        plate = self.__create_plate()
+        render_backend.current().draw_lines(_edge_vertices(plate.all_parts), PART_COLOR)
 
     def set_extrusion_speed(self, new_es):
         self.extrusion_speed = float(new_es)
@@ -217,3 +370,8 @@ class Printer:
 
     def get_total_extruded(self):
         return self.total_extruded.__round__(5)
+
+
+def _edge_vertices(parts):
+    # the two end vertices of every edge of every part, one line each
+    return [part[0][vertex] for part in parts for edge in part[1] for vertex in edge]
@@ -0,0 +1,391 @@
+import ctypes
+import math
+from collections import Counter
+
+from lazy_import import lazy_module
+
+from features import FEATURE_COLORS
+from vertex_layout import FEATURE_COLOR_OFFSET, FEATURE_COLUMN, LAYER_COLOR_OFFSET, VERTEX_FLOATS, VERTEX_STRIDE
+
+GL = lazy_module("OpenGL.GL")
+GLU = lazy_module("OpenGL.GLU")
+np = lazy_module("numpy")
+
+# everything the scene modules draw goes through the backend in use, chosen once at startup with use()
+BACKEND_NAMES = ("immediate", "buffered", "null")
+FONT_FILE = "Fonts/FiraCode-VF.ttf"
+CHUNK_VERTICES = 1 << 18  # vertices per GPU buffer of VertexChunks, even so no line is split
+
+_current = None
+
+
+class ImmediateBackend:
+    # fixed-function OpenGL one vertex call at a time, how the simulator always drew
+    def __init__(self):
+        self.__fonts = {}
+
+    def clear(self):
+        GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+
+    def draw_lines(self, vertices, color, width=1):
+        # every two vertices are one line, all in one colour
+        GL.glLineWidth(width)
+        GL.glBegin(GL.GL_LINES)
+        GL.glColor3d(color[0], color[1], color[2])
+        for vertex in vertices:
+            GL.glVertex3fv(vertex)
+        GL.glEnd()
+
+    def draw_colored_lines(self, points, width=4, color=None):
+        # (position, colour) pairs as PrintedObject stores them, color overrides the colour of every point
+        GL.glLineWidth(width)
+        GL.glBegin(GL.GL_LINES)
+        if color is not None:
+            GL.glColor3d(color[0], color[1], color[2])
+            for point in points:
+                GL.glVertex3f(point[0][0], point[0][1], point[0][2])
+        else:
+            for point in points:
+                GL.glColor3d(point[1][0], point[1][1], point[1][2])
+                GL.glVertex3f(point[0][0], point[0][1], point[0][2])
+        GL.glEnd()
+
+    def draw_feature_runs(self, runs, is_colored_by_feature, hidden_features, width=4):
+        # (feature, points) runs as PrintedObject keeps them, in feature colours or the points' own
+        for feature, points in runs:
+            if feature not in hidden_features:
+                self.draw_colored_lines(points, width, FEATURE_COLORS[feature] if is_colored_by_feature else None)
+
+    def draw_vertex_chunks(self, chunks, is_colored_by_feature, hidden_features, width=4):
+        # VertexChunks are vertex buffers already, every backend with a GL context draws them the same way
+        chunks.draw(is_colored_by_feature, hidden_features, width)
+
+    def draw_colored_points(self, points, size=4):
+        GL.glPointSize(size)
+        GL.glBegin(GL.GL_POINTS)
+        for point in points:
+            GL.glColor3d(point[1][0], point[1][1], point[1][2])
+            GL.glVertex3d(point[0][0], point[0][1], point[0][2])
+        GL.glEnd()
+
+    def draw_vertex_array(self, vertices, stride, color_offset, ranges, width=4):
+        # lines from an interleaved float32 array (position first) that already lives in memory,
+        # drawn as the given (first vertex, vertex count) ranges
+        address = vertices.ctypes.data
+        GL.glLineWidth(width)
+        GL.glEnableClientState(GL.GL_VERTEX_ARRAY)
+        GL.glEnableClientState(GL.GL_COLOR_ARRAY)
+        GL.glVertexPointer(3, GL.GL_FLOAT, stride, ctypes.c_void_p(address))
+        GL.glColorPointer(3, GL.GL_FLOAT, stride, ctypes.c_void_p(address + color_offset))
+        for first, count in ranges:
+            GL.glDrawArrays(GL.GL_LINES, first, count)
+        GL.glDisableClientState(GL.GL_COLOR_ARRAY)
+        GL.glDisableClientState(GL.GL_VERTEX_ARRAY)
+
+    def draw_text(self, x, y, font_size, text, color=(255, 255, 255, 255)):
+        # window coordinates from the bottom left, returns the size of the drawn text
+        import pygame
+        font = self.__fonts.get(font_size)
+        if font is None:
+            font = self.__fonts[font_size] = pygame.font.Font(FONT_FILE, font_size)
+        render = font.render(text, True, color, (0, 0, 0, 0)).convert_alpha()
+        text_data = pygame.image.tostring(render, "RGBA", True)
+        GL.glWindowPos2d(x, y)
+        GL.glDrawPixels(render.get_width(), render.get_height(), GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, text_data)
+        return render.get_width(), render.get_height()
+
+    def load_identity(self):
+        GL.glLoadIdentity()
+
+    def perspective(self, fov_y, aspect, near, far):
+        GLU.gluPerspective(fov_y, aspect, near, far)
+
+    def translate(self, x, y, z):
+        GL.glTranslatef(x, y, z)
+
+    def rotate(self, angle, x, y, z):
+        GL.glRotatef(angle, x, y, z)
+
+    def scale(self, x, y, z):
+        GL.glScalef(x, y, z)
+
+    def push_matrix(self):
+        GL.glPushMatrix()
+
+    def pop_matrix(self):
+        GL.glPopMatrix()
+
+    def unproject(self, window_x, window_y, depth):
+        # window_y counts from the bottom, depth 0 is the near and 1 the far plane
+        return GLU.gluUnProject(window_x, window_y, depth, GL.glGetDoublev(GL.GL_MODELVIEW_MATRIX),
+                                GL.glGetDoublev(GL.GL_PROJECTION_MATRIX), GL.glGetIntegerv(GL.GL_VIEWPORT))
+
+    def viewport_height(self):
+        return GL.glGetIntegerv(GL.GL_VIEWPORT)[3]
+
+
+class VertexChunks:
+    # an append-only list of vertex_layout vertices in vertex buffers of CHUNK_VERTICES, drawn as runs of one
+    # feature type, so only new vertices are uploaded and hiding or recolouring only changes which runs are drawn
+    def __init__(self):
+        self.chunks = []  # vertex buffer names
+        self.runs = []  # [feature, first vertex, vertex count], never crossing a chunk
+        self.vertex_count = 0
+
+    def rewind(self):
+        # forgets every vertex, the buffers are written over by the next ones
+        self.runs = []
+        self.vertex_count = 0
+
+    def append(self, vertices):
+        while len(vertices):
+            chunk, offset = divmod(self.vertex_count, CHUNK_VERTICES)
+            if chunk == len(self.chunks):
+                self.chunks.append(GL.glGenBuffers(1))
+                GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.chunks[-1])
+                GL.glBufferData(GL.GL_ARRAY_BUFFER, CHUNK_VERTICES * VERTEX_STRIDE, None, GL.GL_DYNAMIC_DRAW)
+            part = vertices[:CHUNK_VERTICES - offset]
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.chunks[chunk])
+            GL.glBufferSubData(GL.GL_ARRAY_BUFFER, offset * VERTEX_STRIDE, part.nbytes, part)
+            self.__add_runs(part[:, FEATURE_COLUMN], offset)
+            self.vertex_count += len(part)
+            vertices = vertices[len(part):]
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+
+    def __add_runs(self, features, offset):
+        # a new run starts where the feature changes or a new chunk begins
+        changes = np.flatnonzero(np.diff(features)) + 1
+        starts = np.concatenate(([0], changes))
+        ends = np.concatenate((changes, [len(features)]))
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            feature = int(features[start])
+            if start == 0 and offset > 0 and self.runs and self.runs[-1][0] == feature:
+                self.runs[-1][2] += end
+            else:
+                self.runs.append([feature, self.vertex_count + start, end - start])
+
+    def draw(self, is_colored_by_feature, hidden_features, width=4):
+        GL.glLineWidth(width)
+        GL.glEnableClientState(GL.GL_VERTEX_ARRAY)
+        GL.glEnableClientState(GL.GL_COLOR_ARRAY)
+        color_offset = FEATURE_COLOR_OFFSET if is_colored_by_feature else LAYER_COLOR_OFFSET
+        bound_chunk = None
+        for feature, first, count in self.runs:
+            if feature in hidden_features:
+                continue
+            chunk, offset = divmod(first, CHUNK_VERTICES)
+            if chunk != bound_chunk:
+                GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.chunks[chunk])
+                GL.glVertexPointer(3, GL.GL_FLOAT, VERTEX_STRIDE, ctypes.c_void_p(0))
+                GL.glColorPointer(3, GL.GL_FLOAT, VERTEX_STRIDE, ctypes.c_void_p(color_offset))
+                bound_chunk = chunk
+            GL.glDrawArrays(GL.GL_LINES, offset, count)
+        GL.glDisableClientState(GL.GL_COLOR_ARRAY)
+        GL.glDisableClientState(GL.GL_VERTEX_ARRAY)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+
+
+class BufferedBackend(ImmediateBackend):
+    # packs each draw call into one interleaved array and submits it through a streaming vertex buffer,
+    # one upload and one glDrawArrays instead of a Python call per vertex. The printed object's runs are kept
+    # in VertexChunks instead and only the points added since the last frame are uploaded
+    def __init__(self):
+        super().__init__()
+        self.__buffer = None
+        self.__printed = VertexChunks()
+        self.__printed_runs = None  # the runs list uploaded to __printed, it only grows until it is replaced
+        self.__uploaded = (0, 0)  # (run, points of it) uploaded so far
+
+    def __draw(self, mode, vertices):
+        # vertices: N x 6 float32, position then colour
+        if not len(vertices):
+            return
+        if self.__buffer is None:
+            self.__buffer = GL.glGenBuffers(1)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.__buffer)
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL.GL_STREAM_DRAW)
+        GL.glEnableClientState(GL.GL_VERTEX_ARRAY)
+        GL.glEnableClientState(GL.GL_COLOR_ARRAY)
+        GL.glVertexPointer(3, GL.GL_FLOAT, 24, ctypes.c_void_p(0))
+        GL.glColorPointer(3, GL.GL_FLOAT, 24, ctypes.c_void_p(12))
+        GL.glDrawArrays(mode, 0, len(vertices))
+        GL.glDisableClientState(GL.GL_COLOR_ARRAY)
+        GL.glDisableClientState(GL.GL_VERTEX_ARRAY)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+
+    def draw_lines(self, vertices, color, width=1):
+        packed = np.empty((len(vertices), 6), dtype=np.float32)
+        packed[:, :3] = np.array(vertices, dtype=np.float32).reshape(-1, 3)
+        packed[:, 3:] = color
+        GL.glLineWidth(width)
+        self.__draw(GL.GL_LINES, packed)
+
+    def draw_colored_lines(self, points, width=4, color=None):
+        GL.glLineWidth(width)
+        self.__draw(GL.GL_LINES, _pack_points(points, color))
+
+    def draw_feature_runs(self, runs, is_colored_by_feature, hidden_features, width=4):
+        # PrintedObject appends to its runs until it replaces the list (spilling, hot reload, snapshots),
+        # then everything is uploaded again
+        if runs is not self.__printed_runs:
+            self.__printed_runs = runs
+            self.__printed.rewind()
+            self.__uploaded = (0, 0)
+        first_run, uploaded = self.__uploaded
+        new = []
+        for feature, points in runs[first_run:]:
+            if len(points) > uploaded:
+                new.append(_pack_feature_points(points[uploaded:], feature))
+            uploaded = 0
+        if new:
+            self.__printed.append(np.concatenate(new))
+        if runs:
+            self.__uploaded = (len(runs) - 1, len(runs[-1][1]))
+        self.draw_vertex_chunks(self.__printed, is_colored_by_feature, hidden_features, width)
+
+    def draw_colored_points(self, points, size=4):
+        GL.glPointSize(size)
+        self.__draw(GL.GL_POINTS, _pack_points(points))
+
+
+def _pack_points(points, color=None):
+    if color is not None:
+        packed = np.empty((len(points), 6), dtype=np.float32)
+        packed[:, :3] = np.array([point[0] for point in points], dtype=np.float32).reshape(-1, 3)
+        packed[:, 3:] = color
+        return packed
+    return np.array([point[0] + point[1] for point in points], dtype=np.float32).reshape(-1, 6)
+
+
+def _pack_feature_points(points, feature):
+    # (position, colour) points of one feature type in vertex_layout
+    packed = np.empty((len(points), VERTEX_FLOATS), dtype=np.float32)
+    packed[:, :6] = _pack_points(points)
+    packed[:, 6:9] = FEATURE_COLORS[feature]
+    packed[:, FEATURE_COLUMN] = feature
+    return packed
+
+
+class NullBackend:
+    # draws nothing and needs no GL context, it counts what would have been drawn so the scene code can be
+    # benchmarked anywhere. Matrices are kept as in OpenGL so unproject (mouse picking) still works
+    def __init__(self, display_size=(1280, 720)):
+        self.display_size = display_size
+        self.counts = Counter()  # draw calls, primitives and vertices by kind
+        self.__matrix = np.identity(4)
+        self.__stack = []
+
+    def reset_counts(self):
+        counts = self.counts
+        self.counts = Counter()
+        return counts
+
+    def clear(self):
+        self.counts["clears"] += 1
+
+    def draw_lines(self, vertices, color, width=1):
+        self.__count_lines(len(vertices))
+
+    def draw_colored_lines(self, points, width=4, color=None):
+        self.__count_lines(len(points))
+
+    def draw_feature_runs(self, runs, is_colored_by_feature, hidden_features, width=4):
+        for feature, points in runs:
+            if feature not in hidden_features:
+                self.__count_lines(len(points))
+
+    def draw_vertex_chunks(self, chunks, is_colored_by_feature, hidden_features, width=4):
+        for feature, first, count in chunks.runs:
+            if feature not in hidden_features:
+                self.__count_lines(count)
+
+    def draw_colored_points(self, points, size=4):
+        self.counts["draw_calls"] += 1
+        self.counts["points"] += len(points)
+        self.counts["vertices"] += len(points)
+
+    def draw_vertex_array(self, vertices, stride, color_offset, ranges, width=4):
+        for first, count in ranges:
+            self.__count_lines(count)
+
+    def __count_lines(self, vertex_count):
+        self.counts["draw_calls"] += 1
+        self.counts["lines"] += vertex_count // 2
+        self.counts["vertices"] += vertex_count
+
+    def draw_text(self, x, y, font_size, text, color=(255, 255, 255, 255)):
+        self.counts["texts"] += 1
+        # roughly the size of the monospaced UI font
+        return int(len(text) * font_size * 0.6), int(font_size * 1.3)
+
+    def load_identity(self):
+        self.__matrix = np.identity(4)
+
+    def perspective(self, fov_y, aspect, near, far):
+        f = 1.0 / math.tan(math.radians(fov_y) / 2)
+        self.__multiply(np.array([[f / aspect, 0, 0, 0],
+                                  [0, f, 0, 0],
+                                  [0, 0, (far + near) / (near - far), 2 * far * near / (near - far)],
+                                  [0, 0, -1, 0]]))
+
+    def translate(self, x, y, z):
+        matrix = np.identity(4)
+        matrix[:3, 3] = (x, y, z)
+        self.__multiply(matrix)
+
+    def rotate(self, angle, x, y, z):
+        # the glRotate matrix
+        axis = np.array((x, y, z), dtype=np.float64)
+        axis /= np.linalg.norm(axis)
+        x, y, z = axis
+        c = math.cos(math.radians(angle))
+        s = math.sin(math.radians(angle))
+        matrix = np.identity(4)
+        matrix[:3, :3] = [[x * x * (1 - c) + c, x * y * (1 - c) - z * s, x * z * (1 - c) + y * s],
+                          [y * x * (1 - c) + z * s, y * y * (1 - c) + c, y * z * (1 - c) - x * s],
+                          [x * z * (1 - c) - y * s, y * z * (1 - c) + x * s, z * z * (1 - c) + c]]
+        self.__multiply(matrix)
+
+    def scale(self, x, y, z):
+        self.__multiply(np.diag((x, y, z, 1.0)))
+
+    def __multiply(self, matrix):
+        self.__matrix = self.__matrix @ matrix
+
+    def push_matrix(self):
+        self.__stack.append(self.__matrix.copy())
+
+    def pop_matrix(self):
+        self.__matrix = self.__stack.pop()
+
+    def unproject(self, window_x, window_y, depth):
+        width, height = self.display_size
+        device = np.array((2 * window_x / width - 1, 2 * window_y / height - 1, 2 * depth - 1, 1.0))
+        world = np.linalg.solve(self.__matrix, device)
+        return tuple(world[:3] / world[3])
+
+    def viewport_height(self):
+        return self.display_size[1]
+
+
+def create(name, display_size=None):
+    if name == "immediate":
+        return ImmediateBackend()
+    if name == "buffered":
+        return BufferedBackend()
+    if name == "null":
+        return NullBackend(display_size) if display_size is not None else NullBackend()
+    raise ValueError("Unknown render backend %r, expected one of %s" % (name, ", ".join(BACKEND_NAMES)))
+
+
+def use(backend):
+    # a backend instance or one of BACKEND_NAMES
+    global _current
+    _current = create(backend) if isinstance(backend, str) else backend
+    return _current
+
+
+def current():
+    if _current is None:
+        use("immediate")
+    return _current
@@ -0,0 +1,97 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+import sim_log
+
+log = sim_log.get_logger("profiler")
+
+DEFAULT_INTERVAL = 0.005  # seconds between samples
+
+
+class SamplingProfiler:
+    # a background thread samples the stack of one thread (the main loop's) at a fixed interval and counts
+    # collapsed stacks, ready for flamegraph.pl or speedscope. Every stack is rooted in the layer and
+    # simulation speed at the time of the sample, so slow parts of the print stand out as their own towers
+    def __init__(self, printer, interval=DEFAULT_INTERVAL, thread_id=None):
+        self.printer = printer
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.stacks = Counter()
+        self.samples = 0
+        self.__labels = {}  # code object -> frame label
+        self.__running = threading.Event()
+        self.__thread = None
+        self.__started = 0.0
+
+    def is_running(self):
+        return self.__running.is_set()
+
+    def start(self):
+        if self.is_running():
+            return
+        self.stacks = Counter()
+        self.samples = 0
+        self.__started = time.perf_counter()
+        self.__running.set()
+        self.__thread = threading.Thread(target=self.__sample, name="profiler", daemon=True)
+        self.__thread.start()
+        log.warning("Profiling every %.1f ms", self.interval * 1000)
+
+    def stop(self, file_name=None):
+        # returns the file the samples were written to
+        if not self.is_running():
+            return None
+        self.__running.clear()
+        self.__thread.join()
+        if file_name is None:
+            file_name = time.strftime("simulator-profile-%Y%m%d-%H%M%S.folded")
+        self.write(file_name)
+        log.warning("Wrote %d samples over %.1f s to %s", self.samples,
+                    time.perf_counter() - self.__started, file_name)
+        return file_name
+
+    def toggle(self, file_name=None):
+        if self.is_running():
+            self.stop(file_name)
+        else:
+            self.start()
+
+    def write(self, file_name):
+        with open(file_name, "w") as file:
+            for stack, count in sorted(self.stacks.items()):
+                file.write("%s %d\n" % (stack, count))
+
+    def __sample(self):
+        next_sample = time.perf_counter()
+        while self.__running.is_set():
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            stack = self.__collapse(frame)
+            del frame
+            self.stacks["layer %d;speed %dx;%s" % (
+                self.printer.current_layer, self.printer.get_simulation_rate(), stack)] += 1
+            self.samples += 1
+            next_sample += self.interval
+            delay = next_sample - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_sample = time.perf_counter()
+
+    def __collapse(self, frame):
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            label = self.__labels.get(code)
+            if label is None:
+                # collapsed stacks are split on ";" and the count on the last space
+                label = "%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+                label = self.__labels[code] = label.replace(";", ":")
+            labels.append(label)
+            frame = frame.f_back
+        labels.reverse()
+        return ";".join(labels)
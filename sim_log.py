@@ -0,0 +1,93 @@
+import logging
+import sys
+import time
+from collections import deque
+
+# every module logs under this name so one call configures the whole simulator
+ROOT_LOGGER_NAME = "simulator"
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+
+_ring_handler = None
+
+
+class RingBufferHandler(logging.Handler):
+    # keeps the newest records in memory, formatting only happens when the buffer is dumped
+    def __init__(self, capacity):
+        super().__init__()
+        self.records = deque(maxlen=capacity)
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def dump(self, stream):
+        records = list(self.records)
+        for record in records:
+            stream.write(self.format(record) + "\n")
+        return len(records)
+
+
+class PhaseTimer:
+    # logs how long each phase of a multi-step operation (startup, loading) took
+    def __init__(self, name, started=None):
+        self.name = name
+        self.started = started if started is not None else time.perf_counter()
+        self.phases = []  # (phase, seconds since previous mark, seconds since start)
+        self.__last = self.started
+        self.__log = get_logger(name)
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        duration = now - self.__last
+        self.phases.append((phase, duration, now - self.started))
+        self.__last = now
+        self.__log.info("%s: %.1f ms (%.1f ms since start)", phase, duration * 1000, (now - self.started) * 1000)
+
+    def report(self):
+        summary = ", ".join("%s at %.0f ms" % (phase, total * 1000) for phase, duration, total in self.phases)
+        self.__log.info("%s phases: %s", self.name, summary)
+
+
+def get_logger(name):
+    return logging.getLogger("%s.%s" % (ROOT_LOGGER_NAME, name))
+
+
+def configure(level="WARNING", ring_capacity=0, ring_level="DEBUG"):
+    global _ring_handler
+    root = logging.getLogger(ROOT_LOGGER_NAME)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.propagate = False
+    formatter = logging.Formatter(LOG_FORMAT)
+
+    console = logging.StreamHandler(sys.stderr)
+    console.setLevel(level.upper() if isinstance(level, str) else level)
+    console.setFormatter(formatter)
+    root.addHandler(console)
+    lowest = console.level
+
+    _ring_handler = None
+    if ring_capacity > 0:
+        _ring_handler = RingBufferHandler(ring_capacity)
+        _ring_handler.setLevel(ring_level.upper() if isinstance(ring_level, str) else ring_level)
+        _ring_handler.setFormatter(formatter)
+        root.addHandler(_ring_handler)
+        lowest = min(lowest, _ring_handler.level)
+
+    # the logger level gates the hot paths, so it only goes as low as the lowest active sink
+    root.setLevel(lowest)
+    return root
+
+
+def dump_ring(file_name=None):
+    if _ring_handler is None:
+        return 0
+    if file_name is None:
+        file_name = time.strftime("simulator-trace-%Y%m%d-%H%M%S.log")
+    with open(file_name, "w") as file:
+        count = _ring_handler.dump(file)
+    get_logger("log").warning("Dumped %d trace records to %s", count, file_name)
+    return count
+
+
+# nothing below WARNING is emitted until configure() is called
+logging.getLogger(ROOT_LOGGER_NAME).setLevel(logging.WARNING)
@@ -0,0 +1,325 @@
+import multiprocessing
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import sim_log
+from features import FEATURE_COLORS
+from vertex_layout import VERTEX_FLOATS, VERTEX_STRIDE
+
+log = sim_log.get_logger("process")
+
+RING_CAPACITY = 1 << 16  # vertices in flight between the processes, in vertex_layout so they go to the GPU as they are
+
+HEAD_STATE_SIZE = 12  # Printer.get_head_state
+# status slots after the head state
+LOAD_PROGRESS = HEAD_STATE_SIZE
+IS_PRINTING = HEAD_STATE_SIZE + 1
+STATE_SIZE = HEAD_STATE_SIZE + 2
+PUBLISH_EVERY = 256  # simulation steps between head state updates while running flat out
+
+
+class VertexRing:
+    # single producer, single consumer ring of vertices in shared memory. The producer only moves the write
+    # count and the consumer the read count, each after its slots are done, so no lock is needed
+    def __init__(self, capacity=RING_CAPACITY, names=None):
+        self.capacity = capacity
+        if names is None:
+            self.__vertex_memory = shared_memory.SharedMemory(create=True, size=capacity * VERTEX_STRIDE)
+            self.__count_memory = shared_memory.SharedMemory(create=True, size=2 * 8)
+            self.is_owner = True
+        else:
+            self.__vertex_memory = shared_memory.SharedMemory(name=names[0])
+            self.__count_memory = shared_memory.SharedMemory(name=names[1])
+            self.is_owner = False
+        self.vertices = np.ndarray((capacity, VERTEX_FLOATS), dtype=np.float32, buffer=self.__vertex_memory.buf)
+        self.counts = np.ndarray(2, dtype=np.int64, buffer=self.__count_memory.buf)  # written, read
+        if self.is_owner:
+            self.counts[:] = 0
+
+    def names(self):
+        return self.__vertex_memory.name, self.__count_memory.name
+
+    def push(self, vertex):
+        # blocks while the viewer is a full ring behind
+        written = int(self.counts[0])
+        while written - int(self.counts[1]) >= self.capacity:
+            time.sleep(0.001)
+        self.vertices[written % self.capacity] = vertex
+        self.counts[0] = written + 1
+
+    def available(self):
+        # (first vertex number, views into the ring) of everything not read yet, two views when it wraps
+        read = int(self.counts[1])
+        written = int(self.counts[0])
+        start = read % self.capacity
+        count = written - read
+        if start + count <= self.capacity:
+            return read, [self.vertices[start:start + count]]
+        return read, [self.vertices[start:], self.vertices[:start + count - self.capacity]]
+
+    def release(self, count):
+        self.counts[1] += count
+
+    def close(self):
+        self.vertices = None
+        self.counts = None
+        self.__vertex_memory.close()
+        self.__count_memory.close()
+        if self.is_owner:
+            self.__vertex_memory.unlink()
+            self.__count_memory.unlink()
+
+
+class SharedState:
+    # head state and status floats, guarded by a sequence number that is odd while they are written
+    def __init__(self, name=None):
+        if name is None:
+            self.__memory = shared_memory.SharedMemory(create=True, size=(STATE_SIZE + 1) * 8)
+            self.is_owner = True
+        else:
+            self.__memory = shared_memory.SharedMemory(name=name)
+            self.is_owner = False
+        self.values = np.ndarray(STATE_SIZE + 1, dtype=np.float64, buffer=self.__memory.buf)
+        if self.is_owner:
+            self.values[:] = 0
+
+    def name(self):
+        return self.__memory.name
+
+    def write(self, index, values):
+        self.values[0] += 1
+        self.values[1 + index:1 + index + len(values)] = values
+        self.values[0] += 1
+
+    def read(self):
+        while True:
+            sequence = self.values[0]
+            values = self.values[1:].copy()
+            if sequence % 2 == 0 and self.values[0] == sequence:
+                return values
+
+    def close(self):
+        self.values = None
+        self.__memory.close()
+        if self.is_owner:
+            self.__memory.unlink()
+
+
+def _simulate(file_name, tick_rate, steps_per_second, ring_names, state_name, commands, log_level):
+    # runs in the simulation process: the viewer's main loop without any drawing
+    sim_log.configure(log_level)
+    from g_code import GCode
+    from printed_object import layer_color
+    from printer import Printer
+    ring = VertexRing(RING_CAPACITY, ring_names)
+    state = SharedState(state_name)
+    printer = Printer(tick_rate)
+    g_code = GCode(printer, file_name, load=False)
+    g_code.load()
+    printer.update_nozzle_position()
+    printer.update_plate_zero()
+    state.write(0, printer.get_head_state())
+    state.write(LOAD_PROGRESS, (1.0,))
+    is_printing = False
+    is_paused = False
+    is_finished = False
+    step = 0
+    started = time.perf_counter()
+    try:
+        while True:
+            try:
+                is_idle = not is_printing or is_paused or is_finished
+                command = commands.get(timeout=0.01) if is_idle else commands.get_nowait()
+            except queue.Empty:
+                command = None
+            if command == "stop":
+                break
+            elif command == "start" and not is_printing:
+                printer.start_print(g_code)
+                is_printing = True
+                state.write(IS_PRINTING, (1.0,))
+                started = time.perf_counter()
+                step = 0
+            elif command == "pause":
+                is_paused = not is_paused
+                started = time.perf_counter()  # paused time is not made up for afterwards
+                step = 0
+            elif command == "faster":
+                printer.increase_simulation_speed()
+            elif command == "slower":
+                printer.decrease_simulation_speed()
+            if not is_printing or is_paused or is_finished:
+                state.write(0, printer.get_head_state())
+                continue
+
+            for batch_step in range(PUBLISH_EVERY):
+                if steps_per_second and step >= (time.perf_counter() - started) * steps_per_second:
+                    time.sleep(0.001)
+                    break
+                step += 1
+                if not printer.movement_queue.empty():
+                    insert_status = printer.move_printer()
+                    printer.update_nozzle_position()
+                    if insert_status[0]:
+                        position = printer.get_nozzle_position()
+                        ring.push(position[:2] + (-position[2],) + layer_color(position[1]) +
+                                  FEATURE_COLORS[printer.current_feature] + (printer.current_feature,))
+                elif not g_code.command_queue.empty():
+                    g_code.process_g_code()
+                else:
+                    is_finished = True
+                    log.info("Print finished after %d steps", step)
+                    break
+            state.write(0, printer.get_head_state())
+    finally:
+        ring.close()
+        state.close()
+
+
+class SimulationProcess:
+    # GCode and Printer motion in their own process, printed vertices and head state come back through shared
+    # memory so stepping the simulation never waits for the GIL held by the drawing
+    def __init__(self, file_name, tick_rate, steps_per_second, log_level="WARNING"):
+        # spawn rather than fork, the viewer already holds a window and a GL context. Spawned children share
+        # the viewer's resource tracker, so the segments are only unlinked once, by the viewer
+        context = multiprocessing.get_context("spawn")
+        self.ring = VertexRing()
+        self.state = SharedState()
+        self.__commands = context.Queue()
+        self.__process = context.Process(
+            target=_simulate, name="simulation", daemon=True,
+            args=(file_name, tick_rate, steps_per_second, self.ring.names(), self.state.name(), self.__commands,
+                  log_level))
+
+    def start(self):
+        self.__process.start()
+
+    def send(self, command):
+        self.__commands.put(command)
+
+    def read_state(self, printer):
+        values = self.state.read()
+        printer.set_head_state(values[:HEAD_STATE_SIZE])
+        return values[LOAD_PROGRESS], bool(values[IS_PRINTING])
+
+    def stop(self):
+        self.send("stop")
+        self.__process.join(timeout=2)
+        if self.__process.is_alive():
+            self.__process.terminate()
+        self.ring.close()
+        self.state.close()
+
+
+class SharedObjectRenderer:
+    # the printed object on the viewer side: ring slots are uploaded straight into vertex buffers and drawn
+    # as runs of one feature type, so hiding and recolouring stays a draw-list change as in PrintedObject
+    def __init__(self, ring):
+        import render_backend
+        self.ring = ring
+        self.vertices = render_backend.VertexChunks()
+        self.last_vertex = None
+        self.hidden_features = set()
+        self.is_colored_by_feature = False
+
+    def toggle_features(self, features):
+        features = set(features)
+        if features <= self.hidden_features:
+            self.hidden_features -= features
+        else:
+            self.hidden_features |= features
+
+    def update(self):
+        first, views = self.ring.available()
+        for view in views:
+            if len(view):
+                self.vertices.append(view)
+                self.last_vertex = view[-1, :3].copy()
+        self.ring.release(self.vertices.vertex_count - first)
+
+    def draw(self, printer):
+        import render_backend
+        backend = render_backend.current()
+        z_position = printer.get_z_position()
+        backend.push_matrix()
+        backend.translate(0, 0, z_position)
+        backend.draw_vertex_chunks(self.vertices, self.is_colored_by_feature, self.hidden_features)
+        backend.pop_matrix()
+        if self.vertices.vertex_count % 2 == 1:
+            # the segment being printed runs from its start point to the nozzle
+            start = (self.last_vertex[0], self.last_vertex[1], self.last_vertex[2] + z_position)
+            backend.draw_lines((start, tuple(printer.nozzle_position)), (1.0, 1.0, 1.0), 4)
+
+
+def run_viewer(arguments, camera, startup_timer):
+    # the viewer's main loop when the simulation runs in its own process (main.py --process)
+    import pygame
+    import UI
+    import render_backend
+    from features import FEATURE_GROUPS
+    from input_recording import LiveInput
+    from printer import Printer
+    from sampling_profiler import SamplingProfiler
+    tick_rate = 1
+    printer = Printer(tick_rate)  # only drawn, its state comes from the simulation process
+    profiler = SamplingProfiler(printer, arguments.profile_interval / 1000)
+    if arguments.profile:
+        profiler.start()
+    simulation = SimulationProcess(arguments.file, tick_rate, arguments.process_rate, arguments.log_level)
+    simulation.start()
+    renderer = SharedObjectRenderer(simulation.ring)
+    input_source = LiveInput()
+    startup_timer.mark("simulation process started")
+    is_first_frame = True
+    is_startup_reported = False
+    while True:
+        events, pressed_keys = input_source.next_frame()
+        load_progress, is_printing = simulation.read_state(printer)
+        for event in events:
+            if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+                simulation.stop()
+                profiler.stop(arguments.profile)
+                input_source.close()
+                pygame.quit()
+                quit()
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_f and load_progress >= 1.0 and not is_printing:
+                    simulation.send("start")
+                if event.key == pygame.K_z:
+                    simulation.send("pause")
+                if event.key == pygame.K_j:
+                    simulation.send("faster")
+                if event.key == pygame.K_k:
+                    simulation.send("slower")
+                if event.key == pygame.K_t:
+                    renderer.is_colored_by_feature = not renderer.is_colored_by_feature
+                if pygame.K_1 <= event.key < pygame.K_1 + len(FEATURE_GROUPS):
+                    renderer.toggle_features(FEATURE_GROUPS[event.key - pygame.K_1][1])
+                if event.key == pygame.K_l:
+                    sim_log.dump_ring()
+                if event.key == pygame.K_p:
+                    profiler.toggle(arguments.profile)
+            camera.update_camera_event(event)
+
+        camera.update_camera_frame(pressed_keys)
+        renderer.update()
+        render_backend.current().clear()
+        renderer.draw(printer)
+        printer.update_printer_frame()
+        UI.drawUI(camera.get_size(), printer, printer.get_simulation_rate(), printer.get_elapsed_time())
+        if renderer.is_colored_by_feature or renderer.hidden_features:
+            UI.drawFeatureLegend(camera.get_size(), renderer)
+        if load_progress < 1.0:
+            UI.drawLoadingProgress(camera.get_size(), arguments.file, load_progress)
+        pygame.display.flip()
+        if is_first_frame:
+            startup_timer.mark("first frame")
+            is_first_frame = False
+        if not is_startup_reported and load_progress >= 1.0:
+            startup_timer.mark("G-code loaded")
+            startup_timer.report()
+            is_startup_reported = True
+        pygame.time.wait(tick_rate)
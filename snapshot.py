@@ -0,0 +1,97 @@
+import json
+import os
+import time
+
+import numpy as np
+
+import sim_log
+from gcode_program import join_instructions, split_instructions
+
+log = sim_log.get_logger("snapshot")
+
+SNAPSHOT_VERSION = 4
+SNAPSHOT_SUFFIX = ".snapshot.npz"
+
+
+def default_snapshot_name(file_name):
+    return file_name + SNAPSHOT_SUFFIX
+
+
+def queue_items(queue):
+    with queue.mutex:
+        return list(queue.queue)
+
+
+def refill_queue(queue, items):
+    # bulk refill without one put() per item, the queues are unbounded in file mode
+    with queue.mutex:
+        queue.queue.clear()
+        queue.queue.extend(items)
+        queue.unfinished_tasks = len(queue.queue)
+        queue.not_empty.notify_all()
+
+
+def _points_to_arrays(points):
+    # ((x, y, z), (r, g, b)) tuples -> one N x 6 float32 buffer, drawn points never need more precision
+    if not points:
+        return np.empty((0, 6), dtype=np.float32)
+    return np.array([position + color for position, color in points], dtype=np.float32).reshape(-1, 6)
+
+
+def _arrays_to_points(array):
+    return list(zip(map(tuple, array[:, :3].tolist()), map(tuple, array[:, 3:].tolist())))
+
+
+def save_snapshot(file_name, printer, print_object, g_code, viewer_state):
+    start = time.perf_counter()
+    # the movement queue keeps float64, every step is added to the head position and must resume exactly
+    movements = np.array(queue_items(printer.movement_queue), dtype=np.float64).reshape(-1, 5)
+    commands = join_instructions(queue_items(g_code.command_queue))
+    permanent_points = print_object.get_all_permanent_points()[0]
+    state = {
+        "version": SNAPSHOT_VERSION,
+        "printer": printer.get_state(),
+        "printed_object": print_object.get_state(),
+        "g_code": g_code.get_state(),
+        "viewer": viewer_state,
+    }
+    temporary_name = file_name + ".tmp.npz"
+    with open(temporary_name, "wb") as file:
+        np.savez(file,
+                 state=np.frombuffer(json.dumps(state).encode("utf-8"), dtype=np.uint8),
+                 permanent_points=_points_to_arrays(permanent_points),
+                 # the feature of every point is kept as the runs it is drawn in
+                 feature_runs=np.array(print_object.get_feature_runs(), dtype=np.int64).reshape(-1, 2),
+                 segments=print_object.segment_index.to_arrays(),
+                 temporary_points=_points_to_arrays(print_object.temporary_points),
+                 movements=movements,
+                 commands=np.frombuffer(commands, dtype=np.uint8))
+    os.replace(temporary_name, file_name)
+    log.info("Saved snapshot %s in %.1f ms (%d points, %d queued ticks)", file_name,
+             (time.perf_counter() - start) * 1000, len(permanent_points), len(movements))
+
+
+def load_snapshot(file_name, printer, print_object, g_code):
+    start = time.perf_counter()
+    with np.load(file_name) as snapshot:
+        state = json.loads(snapshot["state"].tobytes().decode("utf-8"))
+        if state.get("version") != SNAPSHOT_VERSION:
+            raise ValueError("%s is a version %s snapshot, expected %d" % (
+                file_name, state.get("version"), SNAPSHOT_VERSION))
+        permanent_points = _arrays_to_points(snapshot["permanent_points"])
+        feature_runs = snapshot["feature_runs"]
+        permanent_features = np.repeat(feature_runs[:, 0], feature_runs[:, 1]).tolist()
+        segments = snapshot["segments"]
+        temporary_points = _arrays_to_points(snapshot["temporary_points"])
+        movements = [(row[0], row[1], row[2], bool(row[3]), bool(row[4])) for row in snapshot["movements"].tolist()]
+        commands = split_instructions(snapshot["commands"].tobytes())
+
+    printer.set_state(state["printer"])
+    print_object.set_state(state["printed_object"], permanent_points, temporary_points, permanent_features,
+                           feature_runs.tolist(), segments)
+    g_code.set_state(state["g_code"])
+    refill_queue(printer.movement_queue, movements)
+    refill_queue(g_code.command_queue, commands)
+    log.info("Resumed snapshot %s in %.1f ms (layer %d, %d points)", file_name,
+             (time.perf_counter() - start) * 1000, printer.current_layer, len(permanent_points))
+    return state["viewer"]
@@ -0,0 +1,171 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+
+import sim_log
+from gcode_program import compile_line
+
+log = sim_log.get_logger("stream")
+
+
+class StreamStatistics:
+    def __init__(self):
+        self.lines = 0
+        self.commands = 0
+        self.bytes = 0
+        self.started = time.perf_counter()
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record(self, size, is_command, latency):
+        self.lines += 1
+        self.bytes += size
+        if is_command:
+            self.commands += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def summary(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        mean_latency = self.total_latency / self.lines if self.lines else 0.0
+        return {
+            "lines": self.lines,
+            "commands": self.commands,
+            "bytes": self.bytes,
+            "elapsed": elapsed,
+            "lines_per_second": self.lines / elapsed,
+            "mean_ack_latency": mean_latency,
+            "max_ack_latency": self.max_latency,
+        }
+
+
+def strip_line_number(line):
+    # print hosts send "N123 G1 X10*71", the simulator only wants the command itself
+    if line[:1] != "N":
+        return line
+    checksum = line.rfind("*")
+    if checksum != -1:
+        line = line[:checksum]
+    parts = line.split(None, 1)
+    return parts[1] + "\n" if len(parts) > 1 else "\n"
+
+
+# accepts G-code over TCP or a Unix socket and feeds it into GCode.command_queue,
+# answering every line with "ok" once it fits in the bounded command buffer (like firmware does).
+# One print host is served at a time, the G-code parser state belongs to the print being streamed
+class GCodeStreamServer:
+    def __init__(self, g_code, host="127.0.0.1", port=8250, unix_path=None):
+        self.g_code = g_code
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.connections = []  # StreamStatistics of every connection so far
+        self.__thread = None
+        self.__loop = None
+        self.__server = None
+        self.__peer = None  # the print host being served
+        self.__space = None  # asyncio.Event set by the render loop once it took commands from a full buffer
+        self.__is_waiting = False
+        self.__ready = threading.Event()
+        self.__error = None  # why the server could not be opened, raised again by start()
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.__run, name="gcode-stream", daemon=True)
+        self.__thread.start()
+        self.__ready.wait()
+        if self.__error is not None:
+            raise self.__error
+
+    def stop(self):
+        if self.__loop is not None and self.__server is not None:
+            self.__loop.call_soon_threadsafe(self.__server.close)
+        if self.__thread is not None:
+            self.__thread.join(timeout=2)
+        if self.g_code.taken_listener == self.__taken:
+            self.g_code.taken_listener = None
+
+    def __taken(self):
+        # render loop thread, wakes __enqueue only while it waits
+        if self.__is_waiting:
+            self.__is_waiting = False
+            self.__loop.call_soon_threadsafe(self.__space.set)
+
+    def __run(self):
+        try:
+            asyncio.run(self.__serve())
+        except Exception as error:
+            if self.__ready.is_set():
+                log.exception("G-code stream server stopped")
+            else:
+                self.__error = error
+        finally:
+            self.__ready.set()
+
+    async def __serve(self):
+        self.__loop = asyncio.get_running_loop()
+        self.__space = asyncio.Event()
+        self.g_code.taken_listener = self.__taken
+        if self.unix_path is not None:
+            if os.path.exists(self.unix_path):
+                os.unlink(self.unix_path)
+            self.__server = await asyncio.start_unix_server(self.__handle_client, path=self.unix_path)
+            log.info("Streaming G-code from unix socket %s", self.unix_path)
+        else:
+            self.__server = await asyncio.start_server(self.__handle_client, self.host, self.port)
+            log.info("Streaming G-code from %s:%d", self.host, self.port)
+        self.__ready.set()
+        try:
+            async with self.__server:
+                await self.__server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+
+    async def __handle_client(self, reader, writer):
+        peer = writer.get_extra_info("peername") or self.unix_path
+        if self.__peer is not None:
+            log.warning("Refused print host %s, %s is still connected", peer, self.__peer)
+            writer.write(b"Error: another print host is connected\n")
+            writer.close()
+            return
+        self.__peer = peer
+        log.info("Print host connected: %s", peer)
+        statistics = StreamStatistics()
+        self.connections.append(statistics)
+        try:
+            while True:
+                raw = await reader.readline()
+                if not raw:
+                    break
+                received = time.perf_counter()
+                line = strip_line_number(raw.decode("ascii", errors="replace"))
+                is_command = self.g_code.accept_line(line)
+                if is_command:
+                    await self.__enqueue(compile_line(line))
+                writer.write(b"ok\n")
+                await writer.drain()
+                statistics.record(len(raw), is_command, time.perf_counter() - received)
+        except ConnectionError:
+            log.warning("Print host %s dropped the connection", peer)
+        finally:
+            self.__peer = None
+            writer.close()
+            summary = statistics.summary()
+            log.info("Print host %s disconnected: %d lines (%d commands) in %.2f s, %.0f lines/s, "
+                     "ack latency mean %.3f ms max %.3f ms", peer, summary["lines"], summary["commands"],
+                     summary["elapsed"], summary["lines_per_second"],
+                     summary["mean_ack_latency"] * 1000, summary["max_ack_latency"] * 1000)
+
+    async def __enqueue(self, instruction):
+        # the buffer drains as the render loop processes commands, the host waits for its ok meanwhile.
+        # Waiting is announced before the put is tried, so a command taken in between still wakes us
+        while True:
+            self.__space.clear()
+            self.__is_waiting = True
+            try:
+                self.g_code.command_queue.put_nowait(instruction)
+                self.__is_waiting = False
+                return
+            except queue.Full:
+                await self.__space.wait()
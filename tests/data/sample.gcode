@@ -0,0 +1,142 @@
+M73 P0 R64
+M201 X2500 Y2500 Z400 E5000; sets maximum accelerations, mm/sec^2
+M203 X180 Y180 Z12 E80; sets maximum feedrates, mm / sec
+M204 P2000 R1250 T2500; sets acceleration (P, T) and retract acceleration (R), mm/sec^2
+M205 X8.00 Y8.00 Z2.00 E10.00; sets the jerk limits, mm/sec
+M205 S0 T0; sets the minimum extruding and travel feed rate, mm/sec
+M107
+;TYPE:Custom
+M862.3 P"MINI"; printer model check
+G90; use absolute coordinates
+M83; extruder relative mode
+M117 HELLO WORLD
+M104 S170; set extruder temp for bed leveling
+M140 S60; set bed temp
+M109 R170; wait for bed leveling temp
+M190 S60; wait for bed temp
+M204 T1250; set travel acceleration
+G28; home all without mesh bed level
+G29; mesh bed leveling 
+M204 T2500; restore travel acceleration
+M104 S215; set extruder temp
+G92 E0
+G1 Y-2 X179 F2400
+G1 Z3 F720
+M109 S215; wait for extruder temp
+
+; intro line
+G1 X170 F1000
+G1 Z0.2 F720
+G1 X110 E8 F900
+G1 X40 E10 F700
+G92 E0
+
+M221 S95; set flow
+G21; set units to millimeters
+G90; use absolute coordinates
+M83; use relative distances for extrusion
+M900 K0.2; Filament gcode LA 1.5
+; ; Filament gcode LA 1.0
+M107
+;LAYER_CHANGE
+;Z:0.2
+;HEIGHT:0.2
+;BEFORE_LAYER_CHANGE
+G92 E0.0
+;0.2
+
+
+G1 E-3.2 F4200
+G1 Z.2 F720
+M118 A1 Print started
+G2 X78.007 Y74.282 I.661 J-.562 E.0272
+;AFTER_LAYER_CHANGE
+;0.2
+G1 Z.4
+G1 X77.346 Y74.844 F9000
+G1 Z.2 F720
+G1 E3.2 F2400
+M204 P600
+;TYPE:Skirt/Brim
+;WIDTH:0.42
+G1 F1200
+G1 X78.007 Y74.282 E.0272
+G1 X78.749 Y73.786 E.02798
+G1 X80.375 Y73.068 E.05573
+G1 X82.255 Y72.587 E.06086
+G1 X83.551 Y72.459 E.04084
+G1 X96.549 Y72.461 E.40754
+G1 X97.947 Y72.625 E.04413
+G1 X99.557 Y73.045 E.05216
+G1 X100.651 Y73.469 E.0368
+G1 X101.803 Y74.142 E.04183
+G1 X102.746 Y74.933 E.03859
+G1 X103.611 Y75.952 E.04189
+G1 X104.328 Y77.201 E.04516
+G1 X104.754 Y78.428 E.04072
+G1 X105 Y80.301 E.05924
+G1 X104.974 Y81.064 E.02395
+G1 X104.829 Y81.985 E.02923
+G1 X102.312 Y91.402 E.30562
+G1 X101.97 Y92.356 E.03178
+G1 X101.541 Y93.177 E.02904
+G1 X100.36 Y94.683 E.05999
+G1 X99.203 Y95.624 E.04677
+G1 X97.903 Y96.299 E.04591
+G1 X96.963 Y96.605 E.031
+G1 X96.147 Y96.765 E.02608
+G1 X95.069 Y96.836 E.03387
+G1 X84.311 Y96.814 E.3373
+G1 X83.253 Y96.657 E.03357
+G1 X82.451 Y96.431 E.02613
+G1 X81.521 Y96.04 E.0316
+G1 X80.793 Y95.621 E.02635
+G1 X79.887 Y94.928 E.03577
+G1 X79.387 Y94.399 E.02283
+G1 X78.459 Y93.177 E.04809
+G1 X78.033 Y92.364 E.02878
+G1 X77.657 Y91.297 E.03549
+G1 X75.184 Y82.044 E.30028
+G1 X74.996 Y80.598 E.04575
+G1 X75.175 Y78.798 E.0567
+G1 X75.534 Y77.525 E.04148
+G1 X76.266 Y76.132 E.04932
+G1 X77.308 Y74.89 E.05084
+M204 P1000
+G1 X77.603 Y75.152 F9000
+M204 P600
+G1 F1200
+G1 X77.766 Y74.969 E.00768
+G1 X79.018 Y74.066 E.04841
+G1 X80.53 Y73.413 E.05166
+G1 X82.384 Y72.947 E.05992
+G1 X83.551 Y72.836 E.03678
+G1 X96.534 Y72.838 E.40707
+G1 X97.892 Y72.999 E.04286
+G1 X99.444 Y73.405 E.05032
+G1 X100.486 Y73.807 E.035
+G1 X101.581 Y74.447 E.03976
+G1 X102.478 Y75.198 E.03668
+G1 X103.308 Y76.178 E.04028
+G1 X103.987 Y77.362 E.04279
+G1 X104.383 Y78.499 E.03777
+G1 X104.624 Y80.327 E.05779
+G1 X104.461 Y81.906 E.04976
+G1 X101.952 Y91.29 E.30458
+G1 X101.552 Y92.366 E.03599
+G1 X101.023 Y93.265 E.0327
+G1 X100.078 Y94.432 E.04707
+G1 X98.827 Y95.415 E.0499
+G1 X97.966 Y95.865 E.03046
+G1 X97.245 Y96.134 E.02412
+G1 X95.708 Y96.434 E.04909
+G1 X84.346 Y96.439 E.35627
+G1 X83.326 Y96.287 E.03233
+G1 X82.582 Y96.077 E.02423
+G1 X81.513 Y95.611 E.03656
+G1 X80.684 Y95.087 E.03076
+G1 X79.922 Y94.432 E.03152
+G1 X79.067 Y93.388 E.04229
+G1 X78.639 Y92.748 E.02414
+G1 X78.232 Y91.85 E.03091
+G1 X75.528 Y81.855 E.32464
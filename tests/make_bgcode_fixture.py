@@ -0,0 +1,137 @@
+import os
+import struct
+import sys
+import zlib
+
+# writes data/sample.bgcode from data/sample.gcode the way libbgcode lays a file out: metadata, a thumbnail and
+# MeatPack-encoded G-code blocks stored heatshrink 12/4, deflated, heatshrink 11/4 and plain, each block followed
+# by the CRC32 of its header, parameters and data. python tests/make_bgcode_fixture.py
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import gcode_input
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+FILE_METADATA, GCODE, SLICER_METADATA, PRINTER_METADATA, PRINT_METADATA, THUMBNAIL = 0, 1, 2, 3, 4, 5
+BLOCK_TEXT = 900  # characters of G-code per block, blocks end at a line end
+
+
+def png(width, height):
+    # a grey RGB image
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    rows = b"".join(b"\0" + b"\x80" * 3 * width for row in range(height))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b""))
+
+
+def heatshrink_compress(data, window_bits, lookahead_bits):
+    bits = []
+
+    def put(value, count):
+        bits.extend((value >> shift) & 1 for shift in range(count - 1, -1, -1))
+
+    window = 1 << window_bits
+    longest = 1 << lookahead_bits
+    seen = {}
+    position = 0
+    while position < len(data):
+        length, distance = 0, 0
+        for start in reversed(seen.get(data[position:position + 2], [])[-32:]):
+            if position - start > window:
+                break
+            count = 0
+            while count < longest and position + count < len(data) and data[start + count] == data[position + count]:
+                count += 1
+            if count > length:
+                length, distance = count, position - start
+        if length >= 2:
+            put(0, 1)
+            put(distance - 1, window_bits)
+            put(length - 1, lookahead_bits)
+        else:
+            length = 1
+            put(1, 1)
+            put(data[position], 8)
+        for index in range(position, position + length):
+            seen.setdefault(data[index:index + 2], []).append(index)
+        position += length
+    bits.extend([0] * (-len(bits) % 8))
+    return bytes(int("".join(map(str, bits[index:index + 8])), 2) for index in range(0, len(bits), 8))
+
+
+def meatpack(text):
+    # packing and no-spaces on, spaces only survive in comments and free-text commands
+    characters = gcode_input.MEATPACK_CHARACTERS.decode()
+    output = bytearray(b"\xff\xff\xfb\xff\xff\xf7")
+    for line in text.splitlines(True):
+        comment = line.find(";")
+        command, rest = (line, "") if comment == -1 else (line[:comment], line[comment:])
+        if not command.startswith(gcode_input.TEXT_COMMANDS):
+            command = command.replace(" ", "")
+        codes = []
+        for character in command + rest:
+            if character == "E":
+                codes.append(11)
+            elif character != " " and character in characters:
+                codes.append(characters.index(character))
+            else:
+                codes.append(0x100 | ord(character))
+        index = 0
+        while index < len(codes):
+            first = codes[index]
+            if first == 12:
+                output.append(first)
+                index += 1
+                continue
+            second = codes[index + 1]
+            output.append((0xf if first > 0xff else first) | (0xf if second > 0xff else second) << 4)
+            output.extend(code & 0xff for code in (first, second) if code > 0xff)
+            index += 2
+    return bytes(output)
+
+
+def block(block_type, parameters, data, compression=0, uncompressed_size=None):
+    header = struct.pack("<HHI", block_type, compression, len(data) if uncompressed_size is None else uncompressed_size)
+    if compression:
+        header += struct.pack("<I", len(data))
+    return header + parameters + data + struct.pack("<I", zlib.crc32(header + parameters + data))
+
+
+def main():
+    text = open(os.path.join(DATA, "sample.gcode")).read()
+    pieces, piece = [], ""
+    for line in text.splitlines(True):
+        piece += line
+        if len(piece) >= BLOCK_TEXT:
+            pieces.append(piece)
+            piece = ""
+    pieces.append(piece)
+    output = bytearray(gcode_input.BGCODE_MAGIC + struct.pack("<IH", 1, gcode_input.CRC32_CHECKSUM))
+    ini = struct.pack("<H", 0)
+    output += block(FILE_METADATA, ini, b"Producer=PrusaSlicer 2.7.0\n")
+    output += block(PRINTER_METADATA, ini, b"printer_model=MINI\nfilament_type=PLA\n")
+    output += block(THUMBNAIL, struct.pack("<HHH", 0, 16, 16), png(16, 16))
+    output += block(PRINT_METADATA, ini, b"estimated printing time (normal mode)=1m 2s\n")
+    slicer = b"layer_height = 0.2\nnozzle_diameter = 0.4\n"
+    output += block(SLICER_METADATA, ini, zlib.compress(slicer), gcode_input.DEFLATE, len(slicer))
+    encoding = struct.pack("<H", gcode_input.MEATPACK_COMMENTS)
+    compressions = (gcode_input.HEATSHRINK_12_4, gcode_input.DEFLATE, gcode_input.HEATSHRINK_11_4,
+                    gcode_input.NO_COMPRESSION)
+    for index, piece in enumerate(pieces):
+        packed = meatpack(piece)
+        compression = compressions[index % len(compressions)]
+        if compression == gcode_input.DEFLATE:
+            data = zlib.compress(packed)
+        elif compression == gcode_input.HEATSHRINK_12_4:
+            data = heatshrink_compress(packed, 12, 4)
+        elif compression == gcode_input.HEATSHRINK_11_4:
+            data = heatshrink_compress(packed, 11, 4)
+        else:
+            data = packed
+        output += block(GCODE, encoding, data, compression, len(packed))
+    with open(os.path.join(DATA, "sample.bgcode"), "wb") as file:
+        file.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import gcode_input
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+
+
+def read_all(file_name):
+    return [line for lines, progress in gcode_input.read_line_blocks(file_name) for line in lines]
+
+
+class BinaryGCodeTest(unittest.TestCase):
+    # data/sample.bgcode is data/sample.gcode binarised by make_bgcode_fixture.py
+    def test_decodes_to_the_plain_file(self):
+        with open(os.path.join(DATA, "sample.gcode")) as file:
+            expected = file.read().splitlines(True)
+        self.assertEqual(read_all(os.path.join(DATA, "sample.bgcode")), expected)
+
+    def test_rejects_a_damaged_block(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        file_name = os.path.join(directory, "damaged.bgcode")
+        shutil.copy(os.path.join(DATA, "sample.bgcode"), file_name)
+        with open(file_name, "r+b") as file:
+            file.seek(-40, os.SEEK_END)
+            byte = file.read(1)
+            file.seek(-1, os.SEEK_CUR)
+            file.write(bytes((byte[0] ^ 0x20,)))
+        with self.assertRaises(gcode_input.GCodeFormatError):
+            read_all(file_name)
+
+    def test_overlapping_back_reference(self):
+        # "ab", then 6 bytes copied from 2 back
+        compressed = bytes((0xb0, 0xd8, 0x80, 0x05, 0x40))
+        self.assertEqual(gcode_input.heatshrink_decompress(compressed, 11, 4), b"abababab")
+
+    def test_spaces_go_back_before_parameters_only(self):
+        self.assertEqual(gcode_input._space_words("G1X10.5Y-3E.02F1200\n"), "G1 X10.5 Y-3 E.02 F1200\n")
+        self.assertEqual(gcode_input._space_words('M862.3P"MINI";model\n'), 'M862.3 P"MINI";model\n')
+        self.assertEqual(gcode_input._space_words("M117 HELLO WORLD\n"), "M117 HELLO WORLD\n")
+        self.assertEqual(gcode_input._space_words("M117Layer 2\n"), "M117 Layer 2\n")
+        self.assertEqual(gcode_input._space_words(";TYPE:Perimeter\n"), ";TYPE:Perimeter\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+import argparse
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import sim_log
+from estimate import find_files
+from printed_object import layer_color
+from printer import BED_LEVEL
+from toolpath import PLANE_MOVE, load_toolpath
+
+log = sim_log.get_logger("thumbnails")
+
+BACKGROUND = (0, 0, 0)
+MARGIN = 0.05  # fraction of the image left empty around the part
+# azimuth and elevation in degrees, "top" looks straight down on the plate
+VIEWS = {"iso": (-45.0, 30.0), "front": (0.0, 0.0), "top": (0.0, 90.0)}
+
+
+def write_png(file_name, image):
+    # minimal RGB PNG writer, keeps worker processes free of any imaging library
+    height, width, _ = image.shape
+    raw = np.empty((height, width * 3 + 1), dtype=np.uint8)
+    raw[:, 0] = 0  # no filter on any row
+    raw[:, 1:] = image.reshape(height, width * 3)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    with open(file_name, "wb") as file:
+        file.write(b"\x89PNG\r\n\x1a\n")
+        file.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        file.write(chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)))
+        file.write(chunk(b"IEND", b""))
+
+
+def view_matrix(azimuth, elevation):
+    # G-code X right, Y away from the viewer, Z up -> screen x, screen y (up) and depth (away)
+    azimuth = np.radians(azimuth)
+    elevation = np.radians(elevation)
+    turn = np.array([[np.cos(azimuth), -np.sin(azimuth), 0.0],
+                     [np.sin(azimuth), np.cos(azimuth), 0.0],
+                     [0.0, 0.0, 1.0]])
+    tilt = np.array([[1.0, 0.0, 0.0],
+                     [0.0, np.sin(elevation), np.cos(elevation)],
+                     [0.0, np.cos(elevation), -np.sin(elevation)]])
+    return tilt @ turn
+
+
+def layer_colors(heights):
+    # PrintedObject colours each layer by the height the nozzle is drawn at
+    unique_heights, inverse = np.unique(np.round(heights, 3), return_inverse=True)
+    palette = np.array([layer_color(height + BED_LEVEL) for height in unique_heights]).reshape(-1, 3)
+    return palette[inverse]
+
+
+def rasterize(starts, ends, colors, size, view="iso", perspective=0.0):
+    width, height = size
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[:] = BACKGROUND
+    if len(starts) == 0:
+        return image
+    matrix = view_matrix(*VIEWS[view])
+    projected_starts = starts @ matrix.T
+    projected_ends = ends @ matrix.T
+    if perspective:
+        # simple perspective: shrink by depth relative to the part's extent
+        depths = np.concatenate((projected_starts[:, 2], projected_ends[:, 2]))
+        nearest_depth, depth_range = depths.min(), max(np.ptp(depths), 1e-6)
+        axis = (np.minimum(projected_starts[:, :2].min(axis=0), projected_ends[:, :2].min(axis=0)) +
+                np.maximum(projected_starts[:, :2].max(axis=0), projected_ends[:, :2].max(axis=0))) / 2
+        for projected in (projected_starts, projected_ends):
+            shrink = 1.0 + perspective * (projected[:, 2] - nearest_depth) / depth_range
+            projected[:, :2] = axis + (projected[:, :2] - axis) / shrink[:, None]
+
+    # fit the part into the image, keeping its aspect ratio
+    both = np.concatenate((projected_starts, projected_ends))
+    low = both[:, :2].min(axis=0)
+    extent = max(float(np.max(both[:, :2].max(axis=0) - low)), 1e-6)
+    scale = min(width, height) * (1 - 2 * MARGIN) / extent
+    center = (both[:, :2].max(axis=0) + low) / 2
+    offset = np.array([width / 2.0, height / 2.0])
+    pixel_starts = (projected_starts[:, :2] - center) * scale + offset
+    pixel_ends = (projected_ends[:, :2] - center) * scale + offset
+
+    # sample every segment once per pixel along its longer axis, all segments at once
+    steps = np.ceil(np.abs(pixel_ends - pixel_starts).max(axis=1)).astype(np.int64) + 1
+    segment = np.repeat(np.arange(len(steps)), steps)
+    first = np.cumsum(steps) - steps
+    t = (np.arange(len(segment)) - first[segment]) / np.maximum(steps[segment] - 1, 1)
+    pixels = pixel_starts[segment] + (pixel_ends[segment] - pixel_starts[segment]) * t[:, None]
+    depth = projected_starts[segment, 2] + (projected_ends[segment, 2] - projected_starts[segment, 2]) * t
+    columns = np.clip(np.rint(pixels[:, 0]).astype(np.int64), 0, width - 1)
+    rows = np.clip(height - 1 - np.rint(pixels[:, 1]).astype(np.int64), 0, height - 1)
+
+    # depth test: for every pixel keep the nearest sample
+    index = rows * width + columns
+    order = np.lexsort((depth, index))
+    nearest = order[np.unique(index[order], return_index=True)[1]]
+    near, far = depth.min(), depth.max()
+    shade = 1.0 - 0.4 * (depth[nearest] - near) / max(far - near, 1e-6)
+    image.reshape(-1, 3)[index[nearest]] = np.clip(colors[segment[nearest]] * shade[:, None] * 255, 0, 255)
+    return image
+
+
+def extrusion_segments(toolpath, layer=None):
+    moves = toolpath.moves
+    selected = (moves["kind"] == PLANE_MOVE) & moves["extrude"] & (moves["e"] > 0)
+    if layer is not None:
+        selected &= moves["layer"] == layer
+    starts, ends, rows = toolpath.plane_segments(selected)
+    return starts, ends, layer_colors(ends[:, 2])
+
+
+def render_file(file_name, output_directory, size, view, perspective, per_layer):
+    start = time.perf_counter()
+    toolpath = load_toolpath(file_name)
+    base_name = os.path.join(output_directory, os.path.splitext(os.path.basename(file_name))[0])
+    written = []
+    starts, ends, colors = extrusion_segments(toolpath)
+    write_png(base_name + ".png", rasterize(starts, ends, colors, size, view, perspective))
+    written.append(base_name + ".png")
+    if per_layer:
+        for layer in range(toolpath.layer_count):
+            starts, ends, colors = extrusion_segments(toolpath, layer)
+            if len(starts):
+                layer_name = "%s_layer%04d.png" % (base_name, layer)
+                write_png(layer_name, rasterize(starts, ends, colors, size, "top"))
+                written.append(layer_name)
+    return file_name, written, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render toolpath thumbnails on the CPU, no OpenGL needed")
+    parser.add_argument("targets", nargs="+", help="G-code files, directories or glob patterns")
+    parser.add_argument("-o", "--output", default="thumbnails", help="directory for the PNG files")
+    parser.add_argument("--size", type=int, nargs=2, default=(256, 256), metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--view", choices=sorted(VIEWS), default="iso")
+    parser.add_argument("--perspective", type=float, default=0.0,
+                        help="0 for orthographic, larger values shrink far parts more")
+    parser.add_argument("--layers", action="store_true", help="also write a top view of every layer")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (defaults to cpu count)")
+    parser.add_argument("--log-level", default="INFO")
+    arguments = parser.parse_args()
+    sim_log.configure(arguments.log_level)
+
+    files = find_files(arguments.targets)
+    if not files:
+        parser.error("no G-code files found")
+    os.makedirs(arguments.output, exist_ok=True)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=arguments.workers) as executor:
+        jobs = [executor.submit(render_file, file_name, arguments.output, tuple(arguments.size), arguments.view,
+                                arguments.perspective, arguments.layers) for file_name in files]
+        for job in jobs:
+            file_name, written, duration = job.result()
+            log.info("%s: %d images in %.0f ms", file_name, len(written), duration * 1000)
+    log.info("Rendered %d files in %.2f s", len(files), time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
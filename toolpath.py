@@ -0,0 +1,235 @@
+import os
+
+import numpy as np
+
+import arcs
+import gcode_program as program
+import sim_log
+from features import OTHER
+from g_code import GCode
+from gcode_program import MachineState
+
+log = sim_log.get_logger("toolpath")
+
+# one row per head movement of a processed move command, positions are the end point of the move in machine
+# millimetres (G-code coordinates plus any G92 offset)
+MOVE_DTYPE = np.dtype([
+    ("line", np.int32),  # 1-based line number in the source file
+    ("layer", np.int32),  # LAYER_CHANGE markers seen before the move, the same count as Printer.current_layer
+    ("kind", np.uint8),
+    ("arc", np.int8),  # arcs.CLOCKWISE for G2, arcs.COUNTERCLOCKWISE for G3, 0 for straight moves
+    ("feature", np.uint8),  # features.FEATURE_TYPES code from the last ;TYPE: comment
+    ("extrude", np.bool_),
+    ("x", np.float32),
+    ("y", np.float32),
+    ("z", np.float32),
+    ("e", np.float32),  # filament fed by the move in mm, relative even with M82, 0 without an E word
+    ("feed_rate", np.float32),  # mm/min in effect for the move
+    ("i", np.float32),  # arc centre relative to the start of the move, R arcs are stored by their centre
+    ("j", np.float32),
+])
+
+PLANE_MOVE = 0
+LAYER_MOVE = 1
+FEED_ONLY = 2  # moves without X, Y or Z (feed rate changes, retractions)
+
+CACHE_SUFFIX = ".toolpath.npz"
+CACHE_VERSION = 4
+
+
+class Toolpath:
+    def __init__(self, moves, file_name=None, layer_count=None):
+        self.moves = moves
+        self.file_name = file_name
+        self.layer_count = layer_count if layer_count is not None else \
+            (int(moves["layer"].max()) + 1 if len(moves) else 0)
+        self.__start_points = None
+        self.__layer_bounds = None
+
+    def __len__(self):
+        return len(self.moves)
+
+    def start_points(self):
+        # the start of a move is the end of the previous one, the head starts at the plate origin
+        if self.__start_points is None:
+            ends = self.end_points()
+            starts = np.empty_like(ends)
+            starts[0] = 0
+            starts[1:] = ends[:-1]
+            self.__start_points = starts
+        return self.__start_points
+
+    def end_points(self):
+        return np.stack((self.moves["x"], self.moves["y"], self.moves["z"]), axis=1)
+
+    def lengths(self):
+        # the printer moves X/Y and Z separately, so plane moves ignore the height difference
+        delta = self.end_points() - self.start_points()
+        plane = np.hypot(delta[:, 0], delta[:, 1])
+        rows = np.flatnonzero(self.moves["arc"])
+        if len(rows):
+            moves = self.moves[rows]
+            starts = self.start_points()[rows, :2]
+            ends = np.column_stack((moves["x"], moves["y"])).astype(np.float64)
+            centers = (starts + np.column_stack((moves["i"], moves["j"]))).astype(np.float64)
+            starts = starts.astype(np.float64)
+            plane[rows] = arcs.arc_length(arcs.arc_geometries(starts, ends, centers, moves["arc"]))
+        return np.where(self.moves["kind"] == LAYER_MOVE, np.abs(delta[:, 2]), plane)
+
+    def __arc_geometry(self, row):
+        start = self.start_points()[row]
+        move = self.moves[row]
+        center = (start[0] + move["i"], start[1] + move["j"])
+        return center, arcs.arc_geometry(start, (move["x"], move["y"]), center, move["arc"])
+
+    def plane_segments(self, selected, tolerance=arcs.ARC_TOLERANCE):
+        # (starts, ends, rows) of the straight pieces the selected plane moves are drawn with, arcs are split
+        # into chords within tolerance
+        rows = np.flatnonzero(selected)
+        starts = self.start_points()[rows].astype(np.float64)
+        ends = self.end_points()[rows].astype(np.float64)
+        is_arc = self.moves["arc"][rows] != 0
+        if not is_arc.any():
+            return starts, ends, rows
+        pieces = [(starts[~is_arc], ends[~is_arc], rows[~is_arc])]
+        for row in rows[is_arc]:
+            center, geometry = self.__arc_geometry(row)
+            count = arcs.chord_count(geometry, tolerance)
+            points = np.array([arcs.arc_point(center, geometry, chord / count) for chord in range(count + 1)])
+            points = np.column_stack((points, np.full(count + 1, self.moves["z"][row], dtype=np.float64)))
+            pieces.append((points[:-1], points[1:], np.full(count, row)))
+        order = np.argsort(np.concatenate([piece[2] for piece in pieces]), kind="stable")
+        return (np.concatenate([piece[0] for piece in pieces])[order],
+                np.concatenate([piece[1] for piece in pieces])[order],
+                np.concatenate([piece[2] for piece in pieces])[order])
+
+    def durations(self):
+        feed_rate = self.moves["feed_rate"].astype(np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            durations = np.where(feed_rate > 0, self.lengths() / (feed_rate / 60.0), 0.0)
+        return np.where(self.moves["kind"] == FEED_ONLY, 0.0, durations)
+
+    def layer_bounds(self):
+        # moves are stored in print order, so each layer is one contiguous slice
+        if self.__layer_bounds is None:
+            layers = np.arange(self.layer_count + 1)
+            self.__layer_bounds = np.searchsorted(self.moves["layer"], layers, side="left")
+        return self.__layer_bounds
+
+    def layer_slice(self, layer):
+        bounds = self.layer_bounds()
+        return slice(bounds[layer], bounds[layer + 1])
+
+
+def compile_lines(commands):
+    # (line number, instruction) pairs from GCode.iterate_instructions, run through the same machine state
+    # as GCode's interpreter. A command that moves Z and X/Y gives a layer move and then a plane move,
+    # as the printer makes them one after the other
+    rows = []
+    machine_state = MachineState()
+    feed_rate = 0.0
+    layer = 0
+    feature = OTHER
+    for line_number, instruction in commands:
+        opcode = instruction[0]
+        if opcode in (program.MOVE, program.ARC_CLOCKWISE, program.ARC_COUNTERCLOCKWISE):
+            words = program.operands(instruction)
+            if words[program.F] is not None:
+                feed_rate = words[program.F]
+            start = machine_state.position[:2]
+            extruded = machine_state.move(words)
+            extrude = extruded is not None
+            e = extruded or 0.0
+            x, y, z = machine_state.position
+            has_plane_move = words[program.X] is not None or words[program.Y] is not None
+            direction = 0
+            center_x = center_y = 0.0
+            if opcode != program.MOVE and (words[program.I] is not None or words[program.J] is not None or
+                                           words[program.R] is not None):
+                offset = None if words[program.I] is None and words[program.J] is None else \
+                    (words[program.I] or 0.0, words[program.J] or 0.0)
+                direction = arcs.CLOCKWISE if opcode == program.ARC_CLOCKWISE else arcs.COUNTERCLOCKWISE
+                center = arcs.arc_center(start, (x, y), offset, words[program.R], direction)
+                if center is None or center == tuple(start):
+                    direction = 0
+                else:
+                    center_x, center_y = center[0] - start[0], center[1] - start[1]
+                has_plane_move = True
+            if words[program.Z] is not None:
+                # the filament goes with the plane move when there is one
+                rows.append((line_number, layer, LAYER_MOVE, 0, feature, extrude and not has_plane_move,
+                             start[0], start[1], z, 0.0 if has_plane_move else e, feed_rate, 0.0, 0.0))
+            if has_plane_move:
+                rows.append((line_number, layer, PLANE_MOVE, direction, feature, extrude, x, y, z, e, feed_rate,
+                             center_x, center_y))
+            elif words[program.Z] is None:
+                rows.append((line_number, layer, FEED_ONLY, 0, feature, extrude, x, y, z, e, feed_rate, 0.0, 0.0))
+        elif opcode == program.SET_POSITION:
+            machine_state.set_position(program.operands(instruction))
+        elif opcode in (program.ABSOLUTE_POSITIONING, program.RELATIVE_POSITIONING):
+            machine_state.is_relative = opcode == program.RELATIVE_POSITIONING
+        elif opcode in (program.ABSOLUTE_EXTRUSION, program.RELATIVE_EXTRUSION):
+            machine_state.is_relative_extrusion = opcode == program.RELATIVE_EXTRUSION
+        elif opcode == program.LAYER_CHANGE:
+            layer += 1
+        elif opcode == program.SET_FEATURE:
+            feature = instruction[1]
+    return Toolpath(np.array(rows, dtype=MOVE_DTYPE), layer_count=layer + 1)
+
+
+def compile_file(file_name):
+    g_code = GCode(None, file_name)
+    toolpath = compile_lines(g_code.iterate_instructions())
+    toolpath.file_name = file_name
+    return toolpath
+
+
+def cache_name(file_name):
+    return file_name + CACHE_SUFFIX
+
+
+def _source_signature(file_name):
+    status = os.stat(file_name)
+    return np.array([CACHE_VERSION, status.st_size, status.st_mtime_ns], dtype=np.int64)
+
+
+def load_cached(file_name, name):
+    # extra arrays cached next to the toolpath (layer statistics and so on), None when stale or missing
+    try:
+        with np.load(cache_name(file_name)) as cached:
+            if not np.array_equal(cached["signature"], _source_signature(file_name)) or name not in cached:
+                return None
+            return cached[name]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_cached(file_name, **arrays):
+    # rewrites the cache file, keeping any arrays that are still valid
+    stored = {}
+    try:
+        with np.load(cache_name(file_name)) as cached:
+            if np.array_equal(cached["signature"], _source_signature(file_name)):
+                stored = {key: cached[key] for key in cached.files}
+    except (OSError, ValueError, KeyError):
+        pass
+    stored.update(arrays)
+    stored["signature"] = _source_signature(file_name)
+    temporary_name = cache_name(file_name) + ".tmp.npz"
+    try:
+        np.savez(temporary_name, **stored)
+        os.replace(temporary_name, cache_name(file_name))
+    except OSError as error:
+        log.warning("Could not write toolpath cache for %s: %s", file_name, error)
+
+
+def load_toolpath(file_name, use_cache=True):
+    if use_cache:
+        moves = load_cached(file_name, "moves")
+        layer_count = load_cached(file_name, "layer_count")
+        if moves is not None and layer_count is not None:
+            return Toolpath(moves, file_name, int(layer_count))
+    toolpath = compile_file(file_name)
+    if use_cache:
+        save_cached(file_name, moves=toolpath.moves, layer_count=np.array(toolpath.layer_count))
+    return toolpath
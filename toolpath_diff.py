@@ -0,0 +1,164 @@
+import argparse
+import hashlib
+import json
+import sys
+
+import numpy as np
+
+import sim_log
+from toolpath import PLANE_MOVE, load_toolpath
+
+log = sim_log.get_logger("diff")
+
+GEOMETRY_TOLERANCE = 0.01  # mm a segment may move before it counts as changed
+DISTANCE_BLOCK = 4_000_000  # point-segment pairs evaluated at once, bounds the temporary arrays
+
+
+def layer_hashes(toolpath):
+    # line numbers are left out, so inserting a comment above a layer does not mark it changed
+    moves = toolpath.moves
+    geometry = np.stack((moves["kind"], moves["arc"], moves["feature"], moves["extrude"], moves["x"], moves["y"],
+                         moves["z"], moves["e"], moves["feed_rate"], moves["i"], moves["j"]),
+                        axis=1).astype(np.float32)
+    bounds = toolpath.layer_bounds()
+    return [hashlib.blake2b(geometry[bounds[layer]:bounds[layer + 1]].tobytes(), digest_size=16).digest()
+            for layer in range(toolpath.layer_count)]
+
+
+def extrusion_segments(toolpath, layer):
+    # arcs are compared by their chords, so moving only an arc's centre still shows as a deviation
+    layer_slice = toolpath.layer_slice(layer)
+    moves = toolpath.moves
+    selected = np.zeros(len(moves), dtype=bool)
+    selected[layer_slice] = (moves["kind"][layer_slice] == PLANE_MOVE) & moves["extrude"][layer_slice]
+    starts, ends, rows = toolpath.plane_segments(selected)
+    return starts, ends, moves["line"][rows]
+
+
+def point_segment_distances(points, starts, ends):
+    # distance from every point to its nearest segment, evaluated in blocks of points
+    if len(starts) == 0:
+        return np.full(len(points), np.inf)
+    direction = ends - starts
+    length_squared = np.einsum("ij,ij->i", direction, direction)
+    length_squared[length_squared == 0] = 1.0  # zero-length segments behave as points
+    block = max(1, DISTANCE_BLOCK // len(starts))
+    distances = np.empty(len(points))
+    for first in range(0, len(points), block):
+        chunk = points[first:first + block, None, :]
+        offset = chunk - starts[None, :, :]
+        t = np.clip(np.einsum("pij,ij->pi", offset, direction) / length_squared, 0.0, 1.0)
+        nearest = starts[None, :, :] + t[:, :, None] * direction[None, :, :]
+        distances[first:first + block] = np.sqrt(((chunk - nearest) ** 2).sum(axis=2)).min(axis=1)
+    return distances
+
+
+def segment_deviation(starts, ends, other_starts, other_ends):
+    # each segment is represented by its end points and midpoint
+    points = np.concatenate((starts, ends, (starts + ends) / 2))
+    distances = point_segment_distances(points, other_starts, other_ends)
+    return distances.reshape(3, -1).max(axis=0) if len(starts) else distances
+
+
+class LayerDiff:
+    def __init__(self, layer, status, time_a=0.0, time_b=0.0, extruded_a=0.0, extruded_b=0.0,
+                 max_deviation=0.0, mean_deviation=0.0, changed_lines=None):
+        self.layer = layer
+        self.status = status  # "changed", "added" or "removed"
+        self.time_a = time_a
+        self.time_b = time_b
+        self.extruded_a = extruded_a
+        self.extruded_b = extruded_b
+        self.max_deviation = max_deviation
+        self.mean_deviation = mean_deviation
+        # source lines in file A whose segments moved by more than the tolerance
+        self.changed_lines = changed_lines if changed_lines is not None else np.empty(0, dtype=np.int32)
+
+    def to_dict(self):
+        return {
+            "layer": self.layer,
+            "status": self.status,
+            "time_a": self.time_a,
+            "time_b": self.time_b,
+            "extruded_a": self.extruded_a,
+            "extruded_b": self.extruded_b,
+            "max_deviation": self.max_deviation,
+            "mean_deviation": self.mean_deviation,
+            "changed_segments": len(self.changed_lines),
+        }
+
+
+def _layer_totals(toolpath, durations, layer):
+    layer_slice = toolpath.layer_slice(layer)
+    return float(durations[layer_slice].sum()), float(np.maximum(toolpath.moves["e"][layer_slice], 0).sum())
+
+
+def diff_toolpaths(toolpath_a, toolpath_b, tolerance=GEOMETRY_TOLERANCE):
+    hashes_a = layer_hashes(toolpath_a)
+    hashes_b = layer_hashes(toolpath_b)
+    durations_a = toolpath_a.durations()
+    durations_b = toolpath_b.durations()
+    differences = []
+    for layer in range(max(toolpath_a.layer_count, toolpath_b.layer_count)):
+        if layer >= toolpath_b.layer_count:
+            time_a, extruded_a = _layer_totals(toolpath_a, durations_a, layer)
+            differences.append(LayerDiff(layer, "removed", time_a=time_a, extruded_a=extruded_a,
+                                         changed_lines=np.unique(extrusion_segments(toolpath_a, layer)[2])))
+            continue
+        if layer >= toolpath_a.layer_count:
+            time_b, extruded_b = _layer_totals(toolpath_b, durations_b, layer)
+            differences.append(LayerDiff(layer, "added", time_b=time_b, extruded_b=extruded_b))
+            continue
+        if hashes_a[layer] == hashes_b[layer]:
+            continue
+        # only layers whose hashes differ pay for the geometric comparison
+        time_a, extruded_a = _layer_totals(toolpath_a, durations_a, layer)
+        time_b, extruded_b = _layer_totals(toolpath_b, durations_b, layer)
+        starts_a, ends_a, lines_a = extrusion_segments(toolpath_a, layer)
+        starts_b, ends_b, lines_b = extrusion_segments(toolpath_b, layer)
+        deviation_a = segment_deviation(starts_a, ends_a, starts_b, ends_b)
+        deviation_b = segment_deviation(starts_b, ends_b, starts_a, ends_a)
+        both = np.concatenate((deviation_a, deviation_b))
+        finite = both[np.isfinite(both)]
+        differences.append(LayerDiff(
+            layer, "changed", time_a, time_b, extruded_a, extruded_b,
+            float(both.max()) if len(both) else 0.0, float(finite.mean()) if len(finite) else 0.0,
+            np.unique(lines_a[deviation_a > tolerance])))
+    return differences
+
+
+def diff_files(file_a, file_b, tolerance=GEOMETRY_TOLERANCE, use_cache=True):
+    return diff_toolpaths(load_toolpath(file_a, use_cache), load_toolpath(file_b, use_cache), tolerance)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two G-code files layer by layer")
+    parser.add_argument("file_a")
+    parser.add_argument("file_b")
+    parser.add_argument("--tolerance", type=float, default=GEOMETRY_TOLERANCE,
+                        help="mm a segment may move before it counts as changed")
+    parser.add_argument("--json", action="store_true", help="print the differences as JSON")
+    parser.add_argument("--no-cache", action="store_true", help="recompile instead of using <file>.toolpath.npz")
+    parser.add_argument("--log-level", default="WARNING")
+    arguments = parser.parse_args()
+    sim_log.configure(arguments.log_level)
+
+    differences = diff_files(arguments.file_a, arguments.file_b, arguments.tolerance, not arguments.no_cache)
+    if arguments.json:
+        json.dump([difference.to_dict() for difference in differences], sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return
+    if not differences:
+        print("No layers differ")
+        return
+    print("layer  status    time a   time b  extruded a  extruded b  max dev  mean dev  moved")
+    for difference in differences:
+        print("%5d  %-7s %8.1f %8.1f %11.2f %11.2f %8.3f %9.3f %6d" % (
+            difference.layer, difference.status, difference.time_a, difference.time_b, difference.extruded_a,
+            difference.extruded_b, difference.max_deviation, difference.mean_deviation,
+            len(difference.changed_lines)))
+    print("%d layers differ" % len(differences))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+# one printed vertex as it is spilled to disk, passed between the simulation processes and uploaded to
+# the GPU: drawn position before PrintedObject's z_position shift, layer colour, feature colour, feature code
+VERTEX_FLOATS = 10
+VERTEX_STRIDE = VERTEX_FLOATS * 4
+LAYER_COLOR_OFFSET = 3 * 4
+FEATURE_COLOR_OFFSET = 6 * 4
+FEATURE_COLUMN = 9
@@ -0,0 +1,237 @@
+import argparse
+import ctypes
+import os
+import shlex
+import subprocess
+import time
+
+import sim_log
+
+log = sim_log.get_logger("export")
+
+DEFAULT_ENCODER = ("ffmpeg -loglevel error -y -f rawvideo -pix_fmt rgb24 -s {width}x{height} -r {fps} -i - "
+                   "-vf vflip -pix_fmt yuv420p {output}")
+
+
+def open_offscreen_context(width, height):
+    # without a display server SDL's offscreen driver gives an EGL context, Mesa's llvmpipe renders on the CPU
+    if not os.environ.get("DISPLAY") and not os.environ.get("WAYLAND_DISPLAY"):
+        os.environ.setdefault("SDL_VIDEODRIVER", "offscreen")
+    import pygame
+    from pygame.locals import DOUBLEBUF, HIDDEN, OPENGL
+    pygame.init()
+    pygame.display.set_mode((width, height), DOUBLEBUF | OPENGL | HIDDEN)
+
+
+class FrameBuffer:
+    # renders into an off-screen colour + depth target so the export size does not depend on any window
+    def __init__(self, width, height):
+        from OpenGL import GL
+        self.width = width
+        self.height = height
+        self.framebuffer = GL.glGenFramebuffers(1)
+        self.color, self.depth = GL.glGenRenderbuffers(2)
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self.framebuffer)
+        GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, self.color)
+        GL.glRenderbufferStorage(GL.GL_RENDERBUFFER, GL.GL_RGBA8, width, height)
+        GL.glFramebufferRenderbuffer(GL.GL_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0, GL.GL_RENDERBUFFER, self.color)
+        GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, self.depth)
+        GL.glRenderbufferStorage(GL.GL_RENDERBUFFER, GL.GL_DEPTH_COMPONENT24, width, height)
+        GL.glFramebufferRenderbuffer(GL.GL_FRAMEBUFFER, GL.GL_DEPTH_ATTACHMENT, GL.GL_RENDERBUFFER, self.depth)
+        status = GL.glCheckFramebufferStatus(GL.GL_FRAMEBUFFER)
+        if status != GL.GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError("Offscreen framebuffer is incomplete (status 0x%x)" % status)
+        GL.glViewport(0, 0, width, height)
+
+
+class PixelReader:
+    # glReadPixels into one pixel buffer object while the other, filled a frame earlier, is mapped and copied,
+    # so the CPU never waits for the frame that was just submitted
+    def __init__(self, width, height):
+        from OpenGL import GL
+        self.__gl = GL
+        self.width = width
+        self.height = height
+        self.size = width * height * 3
+        self.buffers = GL.glGenBuffers(2)
+        for pixel_buffer in self.buffers:
+            GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pixel_buffer)
+            GL.glBufferData(GL.GL_PIXEL_PACK_BUFFER, self.size, None, GL.GL_STREAM_READ)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        GL.glPixelStorei(GL.GL_PACK_ALIGNMENT, 1)
+        self.__index = 0
+        self.__pending = [False, False]
+
+    def read(self):
+        # returns the previous frame's RGB rows (bottom row first), None for the very first frame
+        GL = self.__gl
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, self.buffers[self.__index])
+        GL.glReadPixels(0, 0, self.width, self.height, GL.GL_RGB, GL.GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        self.__pending[self.__index] = True
+        self.__index = 1 - self.__index
+        pixels = self.__map(self.__index)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        return pixels
+
+    def flush(self):
+        pixels = self.__map(1 - self.__index)
+        self.__gl.glBindBuffer(self.__gl.GL_PIXEL_PACK_BUFFER, 0)
+        return pixels
+
+    def __map(self, index):
+        GL = self.__gl
+        if not self.__pending[index]:
+            return None
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, self.buffers[index])
+        pointer = GL.glMapBuffer(GL.GL_PIXEL_PACK_BUFFER, GL.GL_READ_ONLY)
+        pixels = ctypes.string_at(pointer, self.size)
+        GL.glUnmapBuffer(GL.GL_PIXEL_PACK_BUFFER)
+        self.__pending[index] = False
+        return pixels
+
+
+class EncoderPipe:
+    def __init__(self, command):
+        log.info("Encoding with: %s", command)
+        self.process = subprocess.Popen(shlex.split(command), stdin=subprocess.PIPE)
+        self.frames = 0
+
+    def write(self, pixels):
+        self.process.stdin.write(pixels)
+        self.frames += 1
+
+    def close(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError("Encoder exited with status %d" % self.process.returncode)
+
+
+class ImageSequence:
+    def __init__(self, directory, width, height):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.width = width
+        self.height = height
+        self.frames = 0
+
+    def write(self, pixels):
+        import pygame
+        image = pygame.image.frombuffer(pixels, (self.width, self.height), "RGB")
+        # OpenGL rows start at the bottom of the image
+        pygame.image.save(pygame.transform.flip(image, False, True),
+                          os.path.join(self.directory, "frame_%06d.png" % self.frames))
+        self.frames += 1
+
+    def close(self):
+        pass
+
+
+class TimelapseExporter:
+    def __init__(self, file_name, sink, width, height, every_seconds=None, simulation_speed=20,
+                 orbit=0.0, draw_hud=False):
+        open_offscreen_context(width, height)
+        from camera import Camera
+        from g_code import GCode
+        from printed_object import PrintedObject
+        from printer import Printer
+        self.framebuffer = FrameBuffer(width, height)
+        self.reader = PixelReader(width, height)
+        self.camera = Camera((width, height))
+        self.printer = Printer(1)
+        for speed in range(1, simulation_speed):
+            self.printer.increase_simulation_speed()
+        self.print_object = PrintedObject(self.printer)
+        self.g_code = GCode(self.printer, file_name)
+        self.sink = sink
+        self.every_seconds = every_seconds  # None captures one frame per layer
+        self.orbit = orbit
+        self.draw_hud = draw_hud
+
+    def run(self):
+        start = time.perf_counter()
+        printer = self.printer
+        self.__render()  # builds the printer once, zeroing the head needs the drawn plate and nozzle
+        printer.start_print(self.g_code)
+        last_layer = printer.current_layer
+        next_capture = self.every_seconds
+        while not printer.movement_queue.empty() or not self.g_code.command_queue.empty():
+            if not printer.movement_queue.empty():
+                insert_status = printer.move_printer()
+                printer.update_nozzle_position()
+                if insert_status[1]:
+                    self.print_object.insert_temporary_point()
+                if insert_status[0]:
+                    self.print_object.insert_permanent_point()
+                    self.print_object.erase_temporary_points()
+                continue
+            self.g_code.process_g_code()
+            if self.every_seconds is None:
+                is_capture = printer.current_layer != last_layer
+                last_layer = printer.current_layer
+            else:
+                is_capture = printer.get_elapsed_time() >= next_capture
+                while next_capture <= printer.get_elapsed_time():
+                    next_capture += self.every_seconds
+            if is_capture:
+                self.__capture()
+        self.__capture()
+        pixels = self.reader.flush()
+        if pixels is not None:
+            self.sink.write(pixels)
+        self.sink.close()
+        log.info("Exported %d frames in %.1f s", self.sink.frames, time.perf_counter() - start)
+        return self.sink.frames
+
+    def __render(self):
+        self.print_object.update_object_frame()
+        self.printer.update_printer_frame()
+        if self.draw_hud:
+            import UI
+            UI.drawUI(self.camera.get_size(), self.printer, self.printer.get_simulation_rate(),
+                      self.printer.get_elapsed_time())
+
+    def __capture(self):
+        if self.orbit:
+            self.camera.backend.rotate(self.orbit, 0, 1, 0)
+        self.__render()
+        pixels = self.reader.read()
+        if pixels is not None:
+            self.sink.write(pixels)
+
+
+def parse_size(text):
+    width, _, height = text.lower().partition("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a timelapse of a simulated print without a screen")
+    parser.add_argument("file", help="G-code file to simulate")
+    parser.add_argument("-o", "--output", default="timelapse.mp4", help="video file written by the encoder")
+    parser.add_argument("--frames", metavar="DIR", help="write a PNG sequence here instead of encoding a video")
+    parser.add_argument("--encoder", default=DEFAULT_ENCODER,
+                        help="command reading raw RGB frames on stdin ({width}, {height}, {fps}, {output})")
+    parser.add_argument("--size", default="1280x720", type=parse_size, help="frame size, WIDTHxHEIGHT")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--every", type=float, metavar="SECONDS",
+                        help="one frame per this many seconds of simulated print time (default: one per layer)")
+    parser.add_argument("--speed", type=int, default=20, help="simulation speed, higher steps in coarser ticks")
+    parser.add_argument("--orbit", type=float, default=0.0, help="degrees the view turns between frames")
+    parser.add_argument("--hud", action="store_true", help="draw the layer / extrusion text as in the viewer")
+    parser.add_argument("--log-level", default="INFO")
+    arguments = parser.parse_args()
+    sim_log.configure(arguments.log_level)
+
+    width, height = arguments.size
+    if arguments.frames:
+        sink = ImageSequence(arguments.frames, width, height)
+    else:
+        sink = EncoderPipe(arguments.encoder.format(width=width, height=height, fps=arguments.fps,
+                                                    output=shlex.quote(arguments.output)))
+    exporter = TimelapseExporter(arguments.file, sink, width, height, arguments.every, arguments.speed,
+                                 arguments.orbit, arguments.hud)
+    exporter.run()
+
+
+if __name__ == "__main__":
+    main()